@@ -1,15 +1,25 @@
 import os
 import timeit
+from concurrent.futures import ThreadPoolExecutor
 
 from flask import Flask, flash, request, redirect, url_for, jsonify
 from werkzeug.utils import secure_filename
 from celery import Celery
-from v2s_wrapper import execute_v2s
+from celery.signals import worker_init, worker_process_init
+from v2s_wrapper import (execute_v2s, get_cache_key, load_opacity_model,
+                         load_touch_model, tune_touch_model)
 from v2s.util.general import JSONFileUtils
+from result_cache import ResultCache
 from result_processing import *
 
 UPLOAD_FOLDER = os.getcwd().strip('flask_application') + 'uploads'
 ALLOWED_EXTENSIONS = {'mp4', 'pdf'}
+# results of processed videos, returned again when the same video is uploaded
+RESULT_CACHE_FOLDER = os.getcwd().strip('flask_application') + 'result_cache'
+RESULT_CACHE_MAX_ENTRIES = 200
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# hint and ocr requests of a video sent at once
+OCR_WORKERS = 4
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
@@ -20,53 +30,77 @@ celery = Celery(app.name,
                 broker=app.config['CELERY_BROKER_URL'],
                 result_backend=app.config['CELERY_BROKER_URL'])
 
+result_cache = ResultCache(RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_ENTRIES,
+                           RESULT_CACHE_MAX_BYTES)
 
-@celery.task(bind=True)
-def process_video(self, filepath):
-    self.update_state(state='PROCESSING')
 
-    start = timeit.default_timer()
-    detected_actions_json = execute_v2s(filepath)
-    extracted_actions = extract_action(detected_actions_json)
+@worker_init.connect
+def init_worker(**kwargs):
+    # measure the fastest tf threading once per machine before the pool starts
+    tune_touch_model()
 
-    file_path, extension = os.path.splitext(filepath)
 
-    # get the hint text for the action
-    for i in range(len(extracted_actions)):
-        # only do for tap and long tap:
-        if extracted_actions[i]["act_type"] != "SWIPE":
-            screen = extracted_actions[i]['first_frame'] - 1
-            screen_number = f'{screen:04}'
-            screen_path = file_path +  f"/extracted_frames/{screen_number}.jpg"
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # tf sessions do not survive a fork, so each pool process loads its own
+    # touch and opacity models once and reuses them for every task it runs
+    load_touch_model()
+    load_opacity_model()
 
-            coordinate = extracted_actions[i]['taps'][0]
 
-            extracted_actions[i]['action_hint'] = get_action_hint(screen_path, coordinate)
+# a job whose worker died is queued again, and resumes touch detection from
+# its checkpoint
+@celery.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def process_video(self, filepath, cache_key=None):
+    self.update_state(state='PROCESSING')
+
+    start = timeit.default_timer()
+    file_path, extension = os.path.splitext(filepath)
+
+    extracted_actions = []
+    action_hints = []
+    resulting_screens = []
+    # actions are extracted while touch detection goes on with the rest of
+    # the video, and their hint and ocr requests are sent right away
+    with ThreadPoolExecutor(OCR_WORKERS) as ocr_pool:
+        def add_action(action):
+            # get the hint text for the action, only for tap and long tap
+            if action["act_type"] != "SWIPE":
+                screen_path = get_screen_path(file_path, action['first_frame'] - 1)
+                coordinate = action['taps'][0]
+                action_hints.append((action, ocr_pool.submit(get_action_hint, screen_path, coordinate)))
+
+            # the resulting screen of the previous action is the the screen before this action
+            if len(extracted_actions) != 0:
+                screen_path = get_screen_path(file_path, action['first_frame'] - 1)
+                resulting_screens.append(ocr_pool.submit(ocr, screen_path))
+            extracted_actions.append(action)
+
+        segmenter = ActionSegmenter(add_action)
+        detections = execute_v2s(filepath, segmenter.add_frame)
+        segmenter.finish()
 
-    # put the resulting screen ocr result
-    for i in range(0, len(extracted_actions)):
         # the result of the last action
-        if i == len(extracted_actions) - 1:
+        if len(extracted_actions) != 0:
             # find the number of total frames in the video
             extracted_frames_dir = file_path  + f"/extracted_frames/"
             total_frames = len([name for name in os.listdir(extracted_frames_dir) if
                                 os.path.isfile(os.path.join(extracted_frames_dir, name))])
 
-            first_frame = extracted_actions[i]['first_frame']
+            first_frame = extracted_actions[-1]['first_frame']
 
             # two seconds after the start of the action, else use the last frame of the video
             if first_frame + 60 > total_frames:
-                screen_number = f'{total_frames:04}'
+                screen = total_frames
             else:
-                screen_number = f'{first_frame+60:04}'
-
-        else:
-            # the resulting screen of the first action is the the screen before the second action
-            screen_before_next_action = extracted_actions[i+1]['first_frame'] - 1
-            screen_number = f'{screen_before_next_action:04}'
+                screen = first_frame + 60
+            resulting_screens.append(ocr_pool.submit(ocr, get_screen_path(file_path, screen)))
 
-        screen_path = file_path +  f"/extracted_frames/{screen_number}.jpg"
-        extracted_actions[i]['resulting_screen_ocr'] = ocr(screen_path)
+        for action, action_hint in action_hints:
+            action['action_hint'] = action_hint.result()
+        # put the resulting screen ocr result
+        for action, resulting_screen in zip(extracted_actions, resulting_screens):
+            action['resulting_screen_ocr'] = resulting_screen.result()
 
     # self.update_state(result=extracted_actions)
     JSONFileUtils.output_data_to_json(extracted_actions, os.path.join(filepath.rsplit(".", 1)[0], "all_detections.json"))
@@ -75,10 +109,18 @@ def process_video(self, filepath):
     # self.update_state(result=extracted_actions)
     JSONFileUtils.output_data_to_json({"duartion": duration}, os.path.join(filepath.rsplit(".", 1)[0], "duration.json"))
     JSONFileUtils.output_data_to_json(extracted_actions, os.path.join(filepath.rsplit(".", 1)[0], "all_detections.json"))
+    if cache_key is not None:
+        # phase 1 detections are cached from memory, no json file is written
+        result_cache.put(cache_key, {"all_detections.json": extracted_actions,
+                                     "incomplete_detections.json": detections})
     return extracted_actions
 
 
 
+def get_screen_path(file_path, screen):
+    return file_path + f"/extracted_frames/{screen:04}.jpg"
+
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -100,7 +142,12 @@ def upload_file():
             filename = secure_filename(file.filename)
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
             file.save(filepath)
-            task = process_video.apply_async(args=[filepath])
+            # the same video processed the same way gives the same result
+            cache_key = get_cache_key(filepath)
+            if cache_key is not None and result_cache.get(cache_key) is not None:
+                # the status of a cached video is its cached result
+                return jsonify(202, {'Location': url_for('task_status', task_id=cache_key)})
+            task = process_video.apply_async(args=[filepath, cache_key])
             return jsonify(202, {'Location': url_for('task_status', task_id=task.id)})
 
     # return jsonify(202, {'Location': '/testing'})
@@ -117,6 +164,10 @@ def upload_file():
 
 @app.route('/status/<task_id>')
 def task_status(task_id):
+    # cache keys are given as task ids for videos already processed
+    cached_result = result_cache.get(task_id)
+    if cached_result is not None:
+        return jsonify({'state': 'SUCCESS', 'result': cached_result})
     task = process_video.AsyncResult(task_id)
     if task.state == 'PENDING':
         # job did not start yet
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+
+# results of a finished job kept for each cached video
+CACHED_FILES = ["all_detections.json", "incomplete_detections.json"]
+
+
+class ResultCache:
+    """
+    Keeps the results of processed videos on disk, keyed by the content of the
+    upload, the touch model and the scene config, so re-uploading the same
+    video returns its result without processing it again.
+
+    Each entry is a directory named by its key holding CACHED_FILES. The
+    modification time of an entry is its last use; the least recently used
+    entries are evicted once there are more than max_entries or they take
+    more than max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_entries, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Returns the cached all_detections of a key, or None on a miss.
+        """
+        # keys come from request urls; hidden names are temporary entries
+        if key.startswith(".") or os.path.basename(key) != key:
+            return None
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry, "all_detections.json")) as file:
+                result = json.load(file)
+            # mark the entry as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            # missing, or evicted while being read
+            return None
+        return result
+
+    def put(self, key, results):
+        """
+        Caches the results of a job under a key, then evicts entries over the
+        limits. results maps each of CACHED_FILES to its json data.
+        """
+        missing = [name for name in CACHED_FILES if name not in results]
+        if missing:
+            raise ValueError("Missing results to cache: " + ", ".join(missing))
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+        # fill a temporary entry so readers never see a partial one
+        temp_entry = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for name in CACHED_FILES:
+                with open(os.path.join(temp_entry, name), "w") as file:
+                    json.dump(results[name], file)
+            os.rename(temp_entry, entry)
+        except OSError:
+            # another worker cached the same video meanwhile
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache is within
+        max_entries and max_bytes.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, file))
+                           for file in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                # evicted by another worker
+                continue
+
+        entries.sort()
+        total_bytes = sum(size for last_use, size, entry in entries)
+        while entries and (len(entries) > self.max_entries or total_bytes > self.max_bytes):
+            last_use, size, entry = entries.pop(0)
+            shutil.rmtree(entry, ignore_errors=True)
+            total_bytes -= size
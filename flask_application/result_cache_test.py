@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from result_cache import CACHED_FILES, ResultCache
+
+
+def make_results(key, padding=0):
+    """
+    Returns the results of a job, all_detections padded by padding bytes.
+    """
+    return {"all_detections.json": {"key": key, "padding": "x" * padding},
+            "incomplete_detections.json": []}
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.last_use = 1000000000
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def put(self, cache, key, padding=0):
+        cache.put(key, make_results(key, padding))
+        self.touch(key)
+
+    def touch(self, key):
+        # modification times are set explicitly, so entries never share one
+        self.last_use += 10
+        os.utime(os.path.join(self.cache_dir, key), (self.last_use, self.last_use))
+
+    def cached_keys(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_put_get_round_trip(self):
+        cache = ResultCache(self.cache_dir, 10, 10 ** 6)
+        self.put(cache, "a")
+        self.assertEqual(cache.get("a"), make_results("a")["all_detections.json"])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.cache_dir, "a"))),
+                         sorted(CACHED_FILES))
+        self.assertIsNone(cache.get("b"))
+
+    def test_put_missing_results(self):
+        cache = ResultCache(self.cache_dir, 10, 10 ** 6)
+        with self.assertRaises(ValueError):
+            cache.put("a", {"all_detections.json": {}})
+        self.assertEqual(self.cached_keys(), [])
+
+    def test_get_rejects_paths(self):
+        cache = ResultCache(self.cache_dir, 10, 10 ** 6)
+        self.put(cache, "a")
+        self.assertIsNone(cache.get("../" + os.path.basename(self.cache_dir) + "/a"))
+        self.assertIsNone(cache.get(".tmp-a"))
+
+    def test_evict_least_recently_used_entries(self):
+        cache = ResultCache(self.cache_dir, 2, 10 ** 6)
+        self.put(cache, "a")
+        self.put(cache, "b")
+        # reading an entry makes it the most recently used
+        cache.get("a")
+        self.touch("a")
+        self.put(cache, "c")
+        self.assertEqual(self.cached_keys(), ["a", "c"])
+
+    def test_put_existing_entry_marks_it_used(self):
+        cache = ResultCache(self.cache_dir, 2, 10 ** 6)
+        self.put(cache, "a")
+        self.put(cache, "b")
+        self.put(cache, "a")
+        self.put(cache, "c")
+        self.assertEqual(self.cached_keys(), ["a", "c"])
+
+    def test_evict_over_max_bytes(self):
+        cache = ResultCache(self.cache_dir, 10, 2500)
+        self.put(cache, "a", 1000)
+        self.put(cache, "b", 1000)
+        self.assertEqual(self.cached_keys(), ["a", "b"])
+        self.put(cache, "c", 1000)
+        self.assertEqual(self.cached_keys(), ["b", "c"])
+        # an entry larger than the cache does not stay either
+        cache.put("d", make_results("d", 3000))
+        self.assertEqual(self.cached_keys(), [])
+
+    def test_evict_skips_temporary_entries(self):
+        cache = ResultCache(self.cache_dir, 1, 10 ** 6)
+        os.mkdir(os.path.join(self.cache_dir, ".tmp-job"))
+        self.put(cache, "a")
+        self.put(cache, "b")
+        self.assertEqual(self.cached_keys(), [".tmp-job", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
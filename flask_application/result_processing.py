@@ -3,6 +3,7 @@ import math
 import requests
 import json
 from base64 import b64encode
+from v2s.phase2.action_classification.run_segmentation import ActionRuns
 
 
 class TextBoundArray:
@@ -124,74 +125,54 @@ def remove_symbol(string):
 
 
 def extract_action(incomplete_actions):
-    prev = incomplete_actions[0]
-    screenId = [prev["screenId"]]
-    taps = [prev["screenTap"][0]]
-    detected_actions = []
-    for action in incomplete_actions[1:]:
-        try:
-            if action["screenId"] - prev["screenId"] == 1:
-                screenId.append(action["screenId"])
-                taps.append(action["screenTap"][0])
-                prev = action
-            else:
-
-                together = {"act_type": getAction(taps), "frames": screenId, "taps": taps}
-                getAction(taps)
-                detected_actions.append(together)
-                prev = action
-                screenId = [action["screenId"]]
-                taps = [action["screenTap"][0]]
-        except NameError:
-            print("error")
-
-    getAction(taps)
-    together = {"act_type": getAction(taps), "frames": screenId, "taps": taps}
-    detected_actions.append(together)
-    actions = []
-    for detected_action in detected_actions:
-        action = dict()
-        action['first_frame'] = detected_action["frames"][0]
-        if detected_action["act_type"] == 'CLICK':
-            action["act_type"] = detected_action["act_type"]
-            x = 0
-            y = 0
-            for tap in detected_action["taps"]:
-                x += tap["x"]
-                y += tap["y"]
-
-            coord = dict()
-            coord["x"] = x // len(detected_action["taps"])
-            coord["y"] = y // len(detected_action["taps"])
-            action["taps"] = [coord]
-        elif detected_action["act_type"] == 'SWIPE':
-            action["act_type"] = detected_action["act_type"]
-            x = 0
-            y = 0
-            action["taps"] = []
-            for tap in detected_action["taps"]:
-                x = tap["x"]
-                y = tap["y"]
-
-                coord = {}
-                coord["x"] = x // 1
-                coord["y"] = y // 1
-                action["taps"].append(coord)
-        elif detected_action["act_type"] == 'LONG_CLICK':
-            action["act_type"] = detected_action["act_type"]
-            x = 0
-            y = 0
-            for tap in detected_action["taps"]:
-                x += tap["x"]
-                y += tap["y"]
-
-            coord = dict()
-            coord["x"] = x // len(detected_action["taps"])
-            coord["y"] = y // len(detected_action["taps"])
-            action["taps"] = [coord]
-        actions.append(action)
-
-    return actions
+    """
+    Returns an action per run of consecutive frames of the detected frames,
+    segmented on arrays of their first taps.
+    """
+    return ActionRuns.from_json(incomplete_actions).get_records()
+
+
+def make_action(frames, taps):
+    """
+    Returns the action of a run of consecutive frames, given the first tap
+    detected in each.
+    """
+    runs = ActionRuns.from_arrays(frames, [tap["x"] for tap in taps], [tap["y"] for tap in taps])
+    return runs.get_records()[0]
+
+
+class ActionSegmenter:
+    """
+    Builds the actions of extract_action from detected frames given one at a
+    time in frame order, so each action is passed to callback as soon as a
+    frame without a touch, or a gap in the frames, ends it instead of once
+    the whole video is detected.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.frames = []
+        self.taps = []
+
+    def add_frame(self, frame):
+        """
+        Adds the next frame, a dict like the ones of incomplete_detections.json.
+        """
+        if len(self.frames) != 0 and (len(frame["screenTap"]) == 0
+                                      or frame["screenId"] - self.frames[-1] != 1):
+            self.finish()
+        if len(frame["screenTap"]) != 0:
+            self.frames.append(frame["screenId"])
+            self.taps.append(frame["screenTap"][0])
+
+    def finish(self):
+        """
+        Ends the action in progress, if any.
+        """
+        if len(self.frames) != 0:
+            self.callback(make_action(self.frames, self.taps))
+            self.frames = []
+            self.taps = []
 
 
 def get_action_hint(file_path, action_coordinate):
@@ -205,27 +186,5 @@ def get_action_hint(file_path, action_coordinate):
     return text_bound_array.find_nearest_text(action_coordinate)
 
 
-def getAction(taps):
-    n = len(taps)
-    x0 = taps[0]["x"]
-    y0 = taps[0]["y"]
-    x1 = taps[n // 2]["x"]
-    y1 = taps[n // 2]["y"]
-    x2 = taps[n - 2]["x"]
-    y2 = taps[n - 2]["y"]
-
-    if disBetweenPoint(x0, y0, x2, y2) > 5:
-        return "SWIPE"
-    else:
-        if n > 30:
-            return "LONG_CLICK"
-        else:
-            return "CLICK"
-
-
-def disBetweenPoint(x1, y1, x2, y2):
-    distance = math.sqrt(((x1 - x2) ** 2) + ((y1 - y2) ** 2))
-    return distance
-
 if __name__ == "__main__":
     pass
@@ -1,30 +1,149 @@
+import functools
+import hashlib
 import json
+import multiprocessing
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 sys.path.append(os.path.abspath(os.getcwd()).strip('flask_application') + "/python_v2s")
 from v2s.pipeline import PipelineV2S
+from v2s.phase1.phase1 import CURRPATH, Phase1V2S
+from v2s.phase1.detection.opacity_detection import KerasOpacityModel
+from v2s.phase1.detection.thread_tuner import ThreadTuner
+from v2s.phase1.detection.touch_model import (FrozenGraphTouchModel,
+                                             TouchModelService)
+from v2s.util.constants import (DETECTION_BATCH_SIZE, INTER_OP_THREADS,
+                                INTRA_OP_THREADS)
+from v2s.util.general import GeneralUtils, JSONFileUtils
 
-def execute_v2s(filepath):
-    scene_config = {
-        "video_path": filepath,
-        "device_model": "Nexus_5",
-        "arch": "x86",
-        "emulator": "True",
-       "touch_model": "/phase1/detection/touch_model/saved_model_n5/frozen_inference_graph_n5.pb",
-        "labelmap": "/phase1/detection/touch_model/v2s_label_map.pbtxt",
-        "opacity_model": "/phase1/detection/opacity_model/model-saved-alex8-tuned.h5", 
-        "app_name": "<APP_NAME>"
-    }
-    # this is the path to use ssd model instead of faster rcnn, replace line 13 with the line below
-    # "touch_model": "v2s/phase1/detection/touch_model/my_model/saved_model/",
-
-    v2s = PipelineV2S(scene_config)
+SCENE_CONFIG = {
+    "device_model": "Nexus_5",
+    "arch": "x86",
+    "emulator": "True",
+   "touch_model": "/phase1/detection/touch_model/saved_model_n5/frozen_inference_graph_n5.pb",
+    "labelmap": "/phase1/detection/touch_model/v2s_label_map.pbtxt",
+    "opacity_model": "/phase1/detection/opacity_model/model-saved-alex8-tuned.h5", 
+    "app_name": "<APP_NAME>",
+    # keep the touch model loaded in the worker between videos
+    "persistent_model": True,
+    # use the fastest tf threading of this machine, measured once
+    "autotune_threads": True,
+    # log detected frames so a job rerun after a worker died resumes
+    "checkpoint": True,
+    # score opacity while detecting, so frames reach the action segmenter
+    # as they are detected
+    "fuse_opacity": True,
+    # detections are taken from the pipeline in memory, so skip the json files
+    "write_artifacts": False
+}
+# "host:port" of a shared touch_server; when set, workers send their frames
+# to it instead of each loading a copy of the touch model, authenticating
+# with the secret the server was started with, V2S_INFERENCE_AUTHKEY, or
+# the key a loopback server made for this user
+INFERENCE_SERVER = os.environ.get("V2S_INFERENCE_SERVER")
+
+# this is the path to use ssd model instead of faster rcnn, replace the touch_model line with the line below
+# "touch_model": "v2s/phase1/detection/touch_model/my_model/saved_model/",
+
+def get_thread_settings():
+    """
+    Returns the tf threading and batch size settings videos are detected
+    with; tuned ones are measured on first use and then read from cache.
+    """
+    if not SCENE_CONFIG["autotune_threads"]:
+        return {"intra_op_threads": INTRA_OP_THREADS,
+                "inter_op_threads": INTER_OP_THREADS,
+                "batch_size": DETECTION_BATCH_SIZE}
+    tuner = ThreadTuner(FrozenGraphTouchModel, CURRPATH + SCENE_CONFIG["touch_model"])
+    return tuner.get_settings(Phase1V2S.get_frame_shape(SCENE_CONFIG))
+
+def tune_touch_model():
+    """
+    Measures the thread settings of this machine if not cached yet. Runs in a
+    separate process so the worker never starts tf before forking its pool.
+    """
+    if INFERENCE_SERVER or not SCENE_CONFIG["autotune_threads"]:
+        return
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as pool:
+        pool.submit(get_thread_settings).result()
+
+def load_touch_model():
+    """
+    Loads and warms up the touch model in the process-wide model service, so
+    videos processed afterwards by this process do not pay for it.
+    """
+    if INFERENCE_SERVER:
+        return
+    settings = get_thread_settings()
+    # same arguments as the detector, so it finds this model in the service
+    TouchModelService.get_instance().get_model(
+        FrozenGraphTouchModel, CURRPATH + SCENE_CONFIG["touch_model"],
+        warm_up_shape=Phase1V2S.get_frame_shape(SCENE_CONFIG),
+        intra_op_threads=settings["intra_op_threads"],
+        inter_op_threads=settings["inter_op_threads"])
+
+def load_opacity_model():
+    """
+    Loads and warms up the opacity model in the process-wide model service,
+    where the opacity detector of every video finds it.
+    """
+    if not SCENE_CONFIG["persistent_model"]:
+        return
+    TouchModelService.get_instance().get_model(
+        KerasOpacityModel, CURRPATH + SCENE_CONFIG["opacity_model"],
+        warm_up_shape=(227, 227, 3))
+
+def get_scene_config(filepath):
+    """
+    Returns the scene config a video is processed with.
+    """
+    scene_config = dict(SCENE_CONFIG, video_path=filepath)
+    if INFERENCE_SERVER:
+        scene_config["inference_server"] = INFERENCE_SERVER
+    return scene_config
+
+@functools.lru_cache(maxsize=None)
+def get_model_hash(model_path):
+    """
+    Returns the hash of a model file, computed once per process.
+    """
+    return GeneralUtils.get_file_hash(CURRPATH + model_path)
+
+def get_cache_key(filepath):
+    """
+    Returns the result cache key of a video: a hash of its content, of the
+    touch and opacity models and of the scene config it is processed with.
+    Returns None when the touch model runs on a shared inference server,
+    whose model is not known here, so results are not cached.
+    """
+    if INFERENCE_SERVER:
+        return None
+    scene_config = get_scene_config(filepath)
+    # where the video is does not change its result
+    del scene_config["video_path"]
+    key = hashlib.sha1()
+    key.update(GeneralUtils.get_file_hash(filepath).encode())
+    key.update(get_model_hash(SCENE_CONFIG["touch_model"]).encode())
+    key.update(get_model_hash(SCENE_CONFIG["opacity_model"]).encode())
+    key.update(json.dumps(scene_config, sort_keys=True).encode())
+    return key.hexdigest()
+
+def execute_v2s(filepath, frame_listener=None):
+    """
+    Detects the touches of a video. When given, frame_listener is called with
+    the json of each frame, in frame order, while detection runs.
+    """
+    scene_config = get_scene_config(filepath)
+
+    json_listener = None
+    if frame_listener is not None:
+        # frames are passed on as the dicts incomplete_detections.json holds
+        json_listener = lambda frame: frame_listener(JSONFileUtils.to_json_data(frame))
+    v2s = PipelineV2S(scene_config, json_listener)
     v2s.execute()
-    name, extension = os.path.splitext(filepath)
-    detected_actions_path =  name + '/incomplete_detections.json'
-    detected_actions = open(detected_actions_path, 'r')
-    json_result = json.load(detected_actions)
-    return json_result
+    # same dicts incomplete_detections.json holds, without the round trip
+    return JSONFileUtils.to_json_data(v2s.get_output())
 
 
 if __name__ == "__main__":
@@ -28,7 +28,8 @@ setup_args = dict(
     author='SEMERU',
     author_email='charlyb@gmail.com',
     keywords=['v2s', 'Video2Scenario', 'android'],
-    scripts=[join('v2s', 'bin','exec_v2s')],
+    scripts=[join('v2s', 'bin','exec_v2s'), join('v2s', 'bin','touch_server'),
+             join('v2s', 'bin','benchmark_scale')],
     url='https://gitlab.com/SEMERU-Code/Android/Video2Sceneario/',
     download_url='https://pypi.org/project/v2s/',
     python_requires='>=3.8.0'
@@ -10,6 +10,10 @@ class AbstractPhase(ABC):
     -------
     execute()
         Executes phase.
+    set_input(data)
+        Receives the output of the previous phase.
+    get_output()
+        Returns the output of the phase.
     """
 
     @abstractmethod
@@ -17,4 +21,28 @@ class AbstractPhase(ABC):
         """
         Executes phase.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def set_input(self, data):
+        """
+        Receives the output of the previous phase in the pipeline, before
+        execute is called. Phases reading their input from files ignore it.
+
+        Parameters
+        ----------
+        data : 
+            output of the previous phase
+        """
+        pass
+
+    def get_output(self):
+        """
+        Returns the output of the phase, passed to the next phase in the
+        pipeline.
+
+        Returns
+        -------
+        output : 
+            output of the phase; None if it has none
+        """
+        return None
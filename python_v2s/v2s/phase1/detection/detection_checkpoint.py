@@ -0,0 +1,191 @@
+# detection_checkpoint.py
+import json
+import logging
+import os
+
+from v2s.util.general import ComplexEncoder
+from v2s.util.screen import Frame, ScreenTap
+
+
+class DetectionCheckpoint():
+    """
+    Append-only log of the frames touch detection has scored, so a detection
+    interrupted by a crash resumes where it stopped instead of starting over.
+
+    The first line identifies the video the log belongs to; every other line
+    is the json of one scored Frame, with or without taps. The log is kept
+    open for appending while detecting, and each line is appended with a
+    single write, so detections sharded across processes can share the log,
+    each through its own handle, and a line cut short by a crash is ignored.
+
+    Attributes
+    ----------
+    path : string
+        path to the log
+    video_path : string
+        path to the video being detected on
+    file : file
+        log opened for appending by this process; None until needed
+
+    Methods
+    -------
+    prepare()
+        Keeps the log if it belongs to the video, otherwise starts a new one.
+    load()
+        Returns the frames scored so far.
+    record(detection)
+        Appends a scored frame to the log.
+    close()
+        Closes the log of this process.
+    remove()
+        Deletes the log once detection completed.
+    __open()
+        Opens the log for appending.
+    __get_header()
+        Returns the line identifying the video.
+    __read_frame(frame_dict)
+        Rebuilds a Frame from its json.
+    """
+
+    def __init__(self, path, video_path):
+        """
+        Parameters
+        ----------
+        path : string
+            path to the log
+        video_path : string
+            path to the video being detected on
+        """
+        self.path = path
+        self.video_path = video_path
+        self.file = None
+
+    def __getstate__(self):
+        """
+        Returns the checkpoint without its handle, which processes detecting
+        a shard open themselves.
+        """
+        state = self.__dict__.copy()
+        state["file"] = None
+        return state
+
+    def prepare(self):
+        """
+        Keeps the log if it was written for the same video file, otherwise
+        starts a new one, and opens it for appending. Must be called before
+        detection starts.
+        """
+        self.close()
+        header = self.__get_header()
+        resume = False
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                resume = file.readline() == header
+        if resume:
+            logging.info("Resuming touch detection from: " + self.path)
+            with open(self.path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                torn = file.read(1) != b"\n"
+        else:
+            with open(self.path, "w") as file:
+                file.write(header)
+        self.__open()
+        if resume and torn:
+            # end the line cut short by the crash, so only it is ignored
+            self.file.write(b"\n")
+
+    def load(self):
+        """
+        Returns the frames scored so far.
+
+        Returns
+        -------
+        frames : dict of int:Frame
+            scored frames by frame id
+        """
+        frames = {}
+        with open(self.path) as file:
+            # skip the header
+            file.readline()
+            for line in file:
+                try:
+                    frame = self.__read_frame(json.loads(line))
+                except ValueError:
+                    # last line of a crashed detection
+                    continue
+                frames[frame.get_id()] = frame
+        return frames
+
+    def record(self, detection):
+        """
+        Appends a scored frame to the log.
+
+        Parameters
+        ----------
+        detection : Frame
+            frame with the taps detected in it, if any
+        """
+        line = json.dumps(detection, cls=ComplexEncoder) + "\n"
+        if self.file is None:
+            self.__open()
+        # appending a whole line in one write keeps concurrent lines apart
+        self.file.write(line.encode("utf-8"))
+
+    def close(self):
+        """
+        Closes the log of this process, if open; it is reopened by the next
+        record.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """
+        Closes and deletes the log once detection completed.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __open(self):
+        """
+        Opens the log for appending. Writes are unbuffered, so every line
+        reaches the file as soon as it is recorded.
+        """
+        self.file = open(self.path, "ab", buffering=0)
+
+    def __get_header(self):
+        """
+        Returns the line identifying the video, by path, size and
+        modification time.
+
+        Returns
+        -------
+        header : string
+            first line of the log
+        """
+        stat = os.stat(self.video_path)
+        return json.dumps({"video": os.path.abspath(self.video_path),
+                           "size": stat.st_size,
+                           "mtime": stat.st_mtime}, sort_keys=True) + "\n"
+
+    def __read_frame(self, frame_dict):
+        """
+        Rebuilds a Frame from its json.
+
+        Parameters
+        ----------
+        frame_dict : dict
+            json of a Frame
+
+        Returns
+        -------
+        frame : Frame
+            frame with its taps
+        """
+        frame = Frame(frame_dict["screenId"])
+        for tap in frame_dict["screenTap"]:
+            frame.add_tap(ScreenTap(tap["x"], tap["y"], tap["confidence"],
+                                    tap["confidenceOpacity"], tap["frame"]))
+        return frame
@@ -0,0 +1,105 @@
+# detection_checkpoint_test.py
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from v2s.phase1.detection.detection_checkpoint import DetectionCheckpoint
+from v2s.util.general import JSONFileUtils
+from v2s.util.screen import Frame, ScreenTap
+
+
+def make_frame(frame_id):
+    """
+    Returns a scored frame with a tap on even frames and none on odd frames.
+    """
+    frame = Frame(frame_id)
+    if frame_id % 2 == 0:
+        frame.add_tap(ScreenTap(10.5 * frame_id, 20.0, 0.9, None, frame_id))
+    return frame
+
+
+class DetectionCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "detection_checkpoint.jsonl")
+        self.video_path = os.path.join(self.directory, "video.mp4")
+        with open(self.video_path, "wb") as file:
+            file.write(b"video")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, checkpoint, frame_ids):
+        for frame_id in frame_ids:
+            checkpoint.record(make_frame(frame_id))
+
+    def assertLoaded(self, checkpoint, frame_ids):
+        frames = checkpoint.load()
+        self.assertEqual(sorted(frames), list(frame_ids))
+        self.assertEqual(JSONFileUtils.to_json_data([frames[frame_id] for frame_id in frame_ids]),
+                         JSONFileUtils.to_json_data([make_frame(frame_id) for frame_id in frame_ids]))
+
+    def test_resume(self):
+        checkpoint = DetectionCheckpoint(self.path, self.video_path)
+        checkpoint.prepare()
+        self.record(checkpoint, range(1, 6))
+        # recorded lines are in the file before the log is closed
+        self.assertLoaded(DetectionCheckpoint(self.path, self.video_path), range(1, 6))
+
+        resumed = DetectionCheckpoint(self.path, self.video_path)
+        resumed.prepare()
+        self.record(resumed, range(6, 8))
+        resumed.close()
+        self.assertLoaded(resumed, range(1, 8))
+
+    def test_resume_after_torn_line(self):
+        checkpoint = DetectionCheckpoint(self.path, self.video_path)
+        checkpoint.prepare()
+        self.record(checkpoint, range(1, 4))
+        checkpoint.file.write(b'{"screenId": 4, "scree')
+        checkpoint.close()
+
+        resumed = DetectionCheckpoint(self.path, self.video_path)
+        resumed.prepare()
+        self.record(resumed, range(4, 6))
+        resumed.close()
+        self.assertLoaded(resumed, range(1, 6))
+
+    def test_other_video_starts_over(self):
+        checkpoint = DetectionCheckpoint(self.path, self.video_path)
+        checkpoint.prepare()
+        self.record(checkpoint, range(1, 4))
+        checkpoint.close()
+        with open(self.video_path, "ab") as file:
+            file.write(b" edited")
+
+        restarted = DetectionCheckpoint(self.path, self.video_path)
+        restarted.prepare()
+        self.assertLoaded(restarted, [])
+        restarted.close()
+
+    def test_copy_opens_its_own_log(self):
+        checkpoint = DetectionCheckpoint(self.path, self.video_path)
+        checkpoint.prepare()
+        copy = pickle.loads(pickle.dumps(checkpoint))
+        self.assertIsNone(copy.file)
+        self.record(checkpoint, [1])
+        self.record(copy, [2])
+        self.record(checkpoint, [3])
+        copy.close()
+        self.assertLoaded(checkpoint, [1, 2, 3])
+
+    def test_remove(self):
+        checkpoint = DetectionCheckpoint(self.path, self.video_path)
+        checkpoint.prepare()
+        self.record(checkpoint, [1])
+        checkpoint.remove()
+        self.assertIsNone(checkpoint.file)
+        self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+# frame_gating.py
+import numpy as np
+
+from v2s.util.constants import STATIC_FRAME_BLOCK, STATIC_FRAME_THRESHOLD
+
+
+class FrameDifferenceGate():
+    """
+    Cheap pre-filter deciding whether a frame changed enough since the last
+    frame passed to the touch model to need inference. Screen recordings are
+    mostly static, so unchanged frames can reuse the previous detections.
+
+    Frames are compared through a thumbnail holding the mean gray level of
+    each block x block region. A frame is static if no region changed by more
+    than threshold gray levels. The touch indicator covers several regions, so
+    it appearing, moving or fading always counts as a change.
+
+    Attributes
+    ----------
+    threshold : float
+        largest change of a region, in gray levels, still considered static
+    block : int
+        size in pixels of the regions compared
+    reference : np array
+        thumbnail of the last frame passed to the model
+    skipped_frames : int
+        number of frames found static
+
+    Methods
+    -------
+    needs_inference(image_np)
+        Returns whether a frame changed since the last frame passed to the
+        model.
+    reset()
+        Forgets the reference frame and skipped count.
+    __thumbnail(image_np)
+        Returns the mean gray level of each region of a frame.
+    get_skipped_frames()
+        Returns number of frames found static.
+    get_threshold()
+        Returns threshold.
+    set_threshold(threshold)
+        Changes threshold to specified value.
+    """
+
+    def __init__(self, threshold=STATIC_FRAME_THRESHOLD, block=STATIC_FRAME_BLOCK):
+        """
+        Parameters
+        ----------
+        threshold : float, optional
+            largest change of a region, in gray levels, still considered static
+        block : int, optional
+            size in pixels of the regions compared
+        """
+        self.threshold = threshold
+        self.block = block
+        self.reference = None
+        self.skipped_frames = 0
+
+    def needs_inference(self, image_np):
+        """
+        Returns whether a frame changed since the last frame passed to the
+        model. Frames that need inference become the new reference.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        bool : bool
+            False if the frame is static and can reuse previous detections
+        """
+        thumbnail = self.__thumbnail(image_np)
+        if (self.reference is not None and self.reference.shape == thumbnail.shape
+                and np.abs(thumbnail - self.reference).max() <= self.threshold):
+            self.skipped_frames += 1
+            return False
+        self.reference = thumbnail
+        return True
+
+    def reset(self):
+        """
+        Forgets the reference frame and skipped count.
+        """
+        self.reference = None
+        self.skipped_frames = 0
+
+    def __thumbnail(self, image_np):
+        """
+        Returns the mean gray level of each region of a frame.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        thumbnail : np array
+            mean gray level of each block x block region
+        """
+        # average every other pixel only, halving the cost of the thumbnail
+        sample = image_np[::2, ::2]
+        size = max(self.block // 2, 1)
+        height = sample.shape[0] // size * size
+        width = sample.shape[1] // size * size
+        regions = sample[:height, :width].reshape(height // size, size,
+                                                  width // size, size, -1)
+        return regions.mean(axis=(1, 3, 4), dtype=np.float32)
+
+    def get_skipped_frames(self):
+        """
+        Returns number of frames found static.
+
+        Returns
+        -------
+        skipped_frames : int
+            number of frames that reused previous detections
+        """
+        return self.skipped_frames
+
+    def get_threshold(self):
+        """
+        Returns threshold.
+
+        Returns
+        -------
+        threshold : float
+            largest change of a region still considered static
+        """
+        return self.threshold
+
+    def set_threshold(self, threshold):
+        """
+        Changes threshold to specified value.
+
+        Parameters
+        ----------
+        threshold : float
+            new threshold in gray levels
+        """
+        self.threshold = threshold
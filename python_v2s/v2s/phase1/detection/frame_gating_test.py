@@ -0,0 +1,74 @@
+# frame_gating_test.py
+import unittest
+
+import numpy as np
+
+from v2s.phase1.detection.frame_gating import FrameDifferenceGate
+
+
+def make_frame(value=120, seed=0):
+    """
+    Returns a 320x240 frame of a gray level with a little noise.
+    """
+    noise = np.random.default_rng(seed).integers(-2, 3, (320, 240, 3))
+    return (value + noise).astype(np.uint8)
+
+
+class FrameDifferenceGateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = FrameDifferenceGate(threshold=8, block=16)
+
+    def test_first_frame_needs_inference(self):
+        self.assertTrue(self.gate.needs_inference(make_frame()))
+        self.assertEqual(self.gate.get_skipped_frames(), 0)
+
+    def test_noise_is_static(self):
+        self.gate.needs_inference(make_frame(seed=0))
+        for seed in range(1, 6):
+            self.assertFalse(self.gate.needs_inference(make_frame(seed=seed)))
+        self.assertEqual(self.gate.get_skipped_frames(), 5)
+
+    def test_touch_indicator_needs_inference(self):
+        frame = make_frame()
+        self.gate.needs_inference(frame)
+        touched = frame.copy()
+        touched[150:170, 100:120] = 255
+        self.assertTrue(self.gate.needs_inference(touched))
+        # the indicator fading out is a change again
+        self.assertTrue(self.gate.needs_inference(frame))
+
+    def test_single_pixel_is_static(self):
+        frame = make_frame()
+        self.gate.needs_inference(frame)
+        changed = frame.copy()
+        changed[150, 100] = 255
+        self.assertFalse(self.gate.needs_inference(changed))
+
+    def test_drift_is_measured_from_reference(self):
+        # each frame is close to the previous one, but not to the reference
+        self.gate.needs_inference(make_frame(100))
+        self.assertFalse(self.gate.needs_inference(make_frame(105)))
+        self.assertTrue(self.gate.needs_inference(make_frame(110)))
+        self.assertFalse(self.gate.needs_inference(make_frame(115)))
+
+    def test_threshold(self):
+        self.gate.set_threshold(20)
+        self.assertEqual(self.gate.get_threshold(), 20)
+        self.gate.needs_inference(make_frame(100))
+        self.assertFalse(self.gate.needs_inference(make_frame(115)))
+
+    def test_other_shape_needs_inference(self):
+        self.gate.needs_inference(make_frame())
+        self.assertTrue(self.gate.needs_inference(make_frame()[:160]))
+
+    def test_reset(self):
+        self.gate.needs_inference(make_frame())
+        self.gate.needs_inference(make_frame())
+        self.gate.reset()
+        self.assertEqual(self.gate.get_skipped_frames(), 0)
+        self.assertTrue(self.gate.needs_inference(make_frame()))
+
+
+if __name__ == "__main__":
+    unittest.main()
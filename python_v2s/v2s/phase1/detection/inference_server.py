@@ -0,0 +1,318 @@
+# inference_server.py
+import ipaddress
+import logging
+import os
+import queue
+import socket
+import time
+from multiprocessing.connection import Client, Listener
+from threading import Thread
+
+import numpy as np
+
+from v2s.phase1.detection.touch_model import AbstractTouchModel
+from v2s.util.constants import (INFERENCE_AUTHKEY_ENV,
+                                INFERENCE_AUTHKEY_FILE_ENV,
+                                INFERENCE_LOCAL_AUTHKEY_PATH,
+                                INFERENCE_MAX_BATCH_SIZE,
+                                INFERENCE_MAX_LATENCY,
+                                INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT)
+
+
+class InferenceServer():
+    """
+    Local server running one shared touch model for every detection that
+    connects to it. Frames sent by concurrent clients are combined into
+    batches of up to max_batch_size frames; a batch runs as soon as it is
+    full or once its first request waited max_latency seconds.
+
+    Requests are unpickled, so only clients holding the shared secret may
+    connect: the server refuses to listen beyond loopback without one. On
+    loopback, it then makes a random key for the clients of the same user.
+
+    Attributes
+    ----------
+    model : AbstractTouchModel
+        model shared by all clients
+    address : (string, int)
+        host and port the server listens on
+    authkey : bytes
+        key clients must authenticate with
+    max_batch_size : int
+        number of frames after which a batch runs without waiting
+    max_latency : float
+        longest time, in seconds, a request waits for a batch to fill
+    requests : Queue
+        pending (images_np, reply) requests
+
+    Methods
+    -------
+    get_authkey()
+        Returns the shared secret clients and server authenticate with.
+    get_local_authkey()
+        Returns the key made by a loopback server without a secret.
+    is_loopback(host)
+        Returns whether a host is only reachable from this machine.
+    serve_forever()
+        Accepts clients and answers their requests until interrupted.
+    __make_local_authkey()
+        Makes a random key and writes it where clients of this user read it.
+    __serve_client(connection)
+        Forwards the requests of one client to the batching thread.
+    __batch_requests()
+        Combines pending requests into batches and runs them.
+    __run_batch(requests)
+        Runs the model on the frames of several requests and replies to each.
+    """
+
+    def __init__(self, model, address=(INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT),
+                 authkey=None,
+                 max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                 max_latency=INFERENCE_MAX_LATENCY):
+        """
+        Parameters
+        ----------
+        model : AbstractTouchModel
+            model shared by all clients
+        address : (string, int), optional
+            host and port to listen on
+        authkey : bytes, optional
+            key clients must authenticate with; the shared secret if None
+        max_batch_size : int, optional
+            number of frames after which a batch runs without waiting
+        max_latency : float, optional
+            longest time, in seconds, a request waits for a batch to fill
+
+        Raises
+        ------
+        ValueError
+            if there is no secret and address is not a loopback address
+        """
+        if authkey is None:
+            authkey = InferenceServer.get_authkey()
+        if authkey is None:
+            if not InferenceServer.is_loopback(address[0]):
+                raise ValueError("Inference server on " + str(address[0]) + " needs a secret in " +
+                                 INFERENCE_AUTHKEY_ENV + " or " + INFERENCE_AUTHKEY_FILE_ENV)
+            logging.warning("No inference server secret set, listening on loopback only "
+                            "with a key in: " + INFERENCE_LOCAL_AUTHKEY_PATH)
+            authkey = InferenceServer.__make_local_authkey()
+        self.model = model
+        self.address = address
+        self.authkey = authkey
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+
+    @staticmethod
+    def get_authkey():
+        """
+        Returns the shared secret clients and server authenticate with, read
+        from INFERENCE_AUTHKEY_ENV or the file named by
+        INFERENCE_AUTHKEY_FILE_ENV.
+
+        Returns
+        -------
+        authkey : bytes
+            shared secret; None if not set
+        """
+        authkey = os.environ.get(INFERENCE_AUTHKEY_ENV)
+        if authkey:
+            return authkey.encode()
+        authkey_path = os.environ.get(INFERENCE_AUTHKEY_FILE_ENV)
+        if authkey_path:
+            with open(authkey_path, "rb") as file:
+                authkey = file.read().strip()
+            if authkey:
+                return authkey
+        return None
+
+    @staticmethod
+    def get_local_authkey():
+        """
+        Returns the key made by a loopback server started without a secret.
+
+        Returns
+        -------
+        authkey : bytes
+            key of the last such server; None if there is none
+        """
+        try:
+            with open(INFERENCE_LOCAL_AUTHKEY_PATH, "rb") as file:
+                return file.read() or None
+        except OSError:
+            return None
+
+    @staticmethod
+    def __make_local_authkey():
+        """
+        Makes a random key and writes it to INFERENCE_LOCAL_AUTHKEY_PATH,
+        readable by this user only.
+
+        Returns
+        -------
+        authkey : bytes
+            new key
+        """
+        authkey = os.urandom(32)
+        os.makedirs(os.path.dirname(INFERENCE_LOCAL_AUTHKEY_PATH), exist_ok=True)
+        # replaced whole, so clients never read a partial key
+        temp_path = INFERENCE_LOCAL_AUTHKEY_PATH + "." + str(os.getpid())
+        file = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(file, "wb") as file:
+            file.write(authkey)
+        os.replace(temp_path, INFERENCE_LOCAL_AUTHKEY_PATH)
+        return authkey
+
+    @staticmethod
+    def is_loopback(host):
+        """
+        Returns whether a host is only reachable from this machine.
+
+        Parameters
+        ----------
+        host : string
+            host name or address to listen on
+
+        Returns
+        -------
+        is_loopback : bool
+            True if host resolves to a loopback address
+        """
+        try:
+            return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+        except (OSError, ValueError):
+            return False
+
+    def serve_forever(self):
+        """
+        Accepts clients and answers their requests until interrupted.
+        """
+        Thread(target=self.__batch_requests, daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            logging.info("Inference server listening on: " + str(self.address))
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception as e:
+                    # a failed handshake must not stop the server
+                    logging.warning("Rejected inference client: " + str(e))
+                    continue
+                Thread(target=self.__serve_client, args=(connection,),
+                       daemon=True).start()
+
+    def __serve_client(self, connection):
+        """
+        Forwards the requests of one client to the batching thread and sends
+        back the replies.
+
+        Parameters
+        ----------
+        connection : Connection
+            connection to the client
+        """
+        reply = queue.Queue(1)
+        try:
+            while True:
+                images_np = connection.recv()
+                self.requests.put((images_np, reply))
+                connection.send(reply.get())
+        except (EOFError, OSError):
+            # client disconnected
+            pass
+        finally:
+            connection.close()
+
+    def __batch_requests(self):
+        """
+        Combines pending requests into batches and runs them.
+        """
+        while True:
+            requests = [self.requests.get()]
+            size = len(requests[0][0])
+            deadline = time.monotonic() + self.max_latency
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                requests.append(request)
+                size += len(request[0])
+            self.__run_batch(requests)
+
+    def __run_batch(self, requests):
+        """
+        Runs the model on the frames of several requests and replies to each
+        with the detections of its own frames. Requests are grouped by frame
+        shape, since images in one batch must share a shape.
+
+        Parameters
+        ----------
+        requests : list of (np array, Queue)
+            frames of each request and where to put its reply
+        """
+        by_shape = {}
+        for request in requests:
+            by_shape.setdefault(request[0].shape[1:], []).append(request)
+
+        for shape_requests in by_shape.values():
+            try:
+                detections = self.model.infer(np.concatenate(
+                    [images_np for images_np, reply in shape_requests]))
+            except Exception as e:
+                logging.exception("Inference failed")
+                for images_np, reply in shape_requests:
+                    reply.put(("error", str(e)))
+                continue
+
+            start = 0
+            for images_np, reply in shape_requests:
+                reply.put(("ok", detections[start:start + len(images_np)]))
+                start += len(images_np)
+
+class RemoteTouchModel(AbstractTouchModel):
+    """
+    Touch model running in an InferenceServer. Frames are sent to the server,
+    which may batch them with frames from other detections.
+
+    Attributes
+    ----------
+    connection : Connection
+        connection to the server
+    """
+
+    def __init__(self, address=(INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT),
+                 authkey=None):
+        """
+        Parameters
+        ----------
+        address : (string, int), optional
+            host and port of the server
+        authkey : bytes, optional
+            key to authenticate with; the shared secret if None, or the key
+            of a loopback server started without one
+
+        Raises
+        ------
+        ValueError
+            if there is no key to authenticate with
+        """
+        if authkey is None:
+            authkey = InferenceServer.get_authkey() or InferenceServer.get_local_authkey()
+        if authkey is None:
+            raise ValueError("No inference server secret in " + INFERENCE_AUTHKEY_ENV + " or " +
+                             INFERENCE_AUTHKEY_FILE_ENV + ", nor a key in " + INFERENCE_LOCAL_AUTHKEY_PATH)
+        self.connection = Client(address, authkey=authkey)
+
+    def infer(self, images_np):
+        self.connection.send(images_np)
+        status, detections = self.connection.recv()
+        if status != "ok":
+            raise RuntimeError("Inference server failed: " + detections)
+        return detections
+
+    def close(self):
+        self.connection.close()
@@ -3,13 +3,14 @@ import datetime
 import logging
 import os
 from abc import ABC, abstractmethod
+from collections import deque
 
 import numpy as np
 from keras.models import load_model
 from PIL import Image
-from tensorflow.keras.utils import img_to_array, load_img
 
-from v2s.util.general import ImageUtils
+from v2s.phase1.video_manipulation.frame_source import ExtractedFrameSource
+from v2s.util.constants import OPACITY_BATCH_SIZE
 
 class AbstractOpacityDetector(ABC):
     """
@@ -63,13 +64,85 @@ class AbstractOpacityDetector(ABC):
         """
         self.prediction_time = time
 
+class KerasOpacityModel():
+    """
+    Trained opacity model loaded from a keras file, kept loaded by a
+    TouchModelService between videos.
+
+    Attributes
+    ----------
+    model_path : string
+        path to trained opacity model
+    keras_model : keras model
+        loaded model
+
+    Methods
+    -------
+    predict(images_np)
+        Returns the opacity predictions of a batch of crops.
+    warm_up(image_shape)
+        Runs the model once so the first real batch does not pay for setup.
+    close()
+        Releases the resources held by the model.
+    """
+
+    def __init__(self, model_path):
+        """
+        Parameters
+        ----------
+        model_path : string
+            path to trained opacity model
+        """
+        self.model_path = model_path
+        self.keras_model = load_model(model_path)
+
+    def predict(self, images_np):
+        """
+        Returns the opacity predictions of a batch of crops.
+
+        Parameters
+        ----------
+        images_np : np array
+            normalized crops with shape [batch_size, size, size, 3]
+
+        Returns
+        -------
+        predictions : np array
+            probability of low opacity of each crop, with shape [batch_size, 1]
+        """
+        return np.asarray(self.keras_model.predict_on_batch(images_np))
+
+    def warm_up(self, image_shape):
+        """
+        Runs the model once so the first real batch does not pay for setup.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [size, size, 3] of the crops
+        """
+        self.predict(np.zeros((OPACITY_BATCH_SIZE,) + tuple(image_shape),
+                              dtype=np.float32))
+
+    def close(self):
+        """
+        Releases the resources held by the model.
+        """
+        pass
+
 class OpacityDetectorALEXNET(AbstractOpacityDetector):
     """
-    Opacity detector using ALEXNET trained model. Inputs extracted frames with 
-    touches already detected, crops those frames, and feeds the cropped touch 
-    detectors into a model to detect opacity. Outputs opacity predictions which
-    can then be added to the detections.
-    
+    Opacity detector using ALEXNET trained model. Inputs frames with touches
+    already detected, crops the touch indicators from the decoded frames, and
+    feeds the crops into a model to detect opacity. The opacity predictions are
+    set on the screen taps they belong to.
+
+    Crops never go through disk: they are cut from the frames of the frame
+    source straight into one preallocated array, scored batch_size crops at a
+    time so every model call has the same shape. Touch detection may instead
+    stream its frames to the detector while they are decoded, see
+    add_frame(), so frames are not decoded a second time.
+
     Executes one video at a time.
 
     Attributes
@@ -78,31 +151,64 @@ class OpacityDetectorALEXNET(AbstractOpacityDetector):
         frames touches are detected in
     video_path : string
         path to video file being analyzed
-    cropped_path : string
-        path where cropped images will be placed
+    frame_source : AbstractFrameSource
+        source of the full resolution frames to crop from; if None, the
+        extracted frames of the video are read from disk
     opacity_predictions : array of int
-        predictions of opacity
+        predictions of opacity, in the order of the taps of frames
     prediction_time : float
         time to complete predictions
     model_path : string
         path to trained opacity model
-    keras_model : keras model
-        keras model to use
+    model_service : TouchModelService
+        keeps the model loaded across detections; if None, the model is
+        loaded for each detection
+    batch_size : int
+        number of crops passed to the model at once
     size : int
         size of image to pass into model
     touch_indicator_size : int
         size of touch indicator based on model
-
+    stream_batch : np array
+        crops of streamed taps waiting to be scored
+    stream_taps : list of ScreenTaps
+        taps of the crops in stream_batch
+    stream_predictions : list of np arrays
+        predictions of the streamed batches already scored
+    stream_model : KerasOpacityModel
+        model scoring streamed batches
+    stream_listener : callable
+        called with each streamed frame once its taps are scored
+    stream_frames : deque of (Frame, int)
+        streamed frames waiting for their taps to be scored, with the number
+        of taps streamed up to the end of each
+    stream_added : int
+        number of taps streamed
+    stream_scored : int
+        number of streamed taps scored
 
     Methods
     -------
     execute_detection()
         Executes opacity prediction.
-    __crop_and_compile_images()
-        Crops and compiles detected touch images into a format that can be
-        fed to model.
-    __load_model(path)
-        Loads model to be used so that predictions can be made.
+    __crop_images(taps)
+        Crops the touch indicators of taps into one normalized array.
+    __crop(image_np, tap, scale)
+        Crops the touch indicator of a tap and resizes it to the model input.
+    __predict(images_np)
+        Runs the model on the crops in batches of batch_size crops.
+    start_stream(listener)
+        Prepares to score the taps of frames added one at a time.
+    add_frame(frame, image_np, scale)
+        Crops the taps of a frame, scoring crops batch_size at a time.
+    finish_stream()
+        Scores the remaining crops of the frames added.
+    __score_stream_batch()
+        Scores the crops of the current batch.
+    __release_stream_frames()
+        Passes the streamed frames whose taps are all scored to the listener.
+    __get_model()
+        Returns the opacity model.
     set_indicator_size(size)
         Changes touch indicator size to specified value.
     get_opacity_predictions()
@@ -113,21 +219,30 @@ class OpacityDetectorALEXNET(AbstractOpacityDetector):
         Returns frames.
     set_frames(frames)
         Changes frames to specified value.
+    get_frame_source()
+        Returns the frame source crops are cut from.
+    set_frame_source(source)
+        Changes frame source to specified value.
+    get_model_service()
+        Returns the model service.
+    set_model_service(service)
+        Changes model service to specified value.
+    get_batch_size()
+        Returns batch size.
+    set_batch_size(size)
+        Changes batch size to specified value.
     get_video_path()
         Returns video path.
     set_video_path(path)
         Changes video path to specified value.
-    get_cropped_path()
-        Returns cropped path.
-    set_cropped_path(path)
-        Changes cropped path to specified value.
     get_model_path()
         Returns path to opacity model.
     set_model_path(path)
         Changes model path to specified value.
     """
 
-    def __init__(self, frames, model=None, video_path=None, indicator=None):
+    def __init__(self, frames, model=None, video_path=None, indicator=None,
+                 batch_size=OPACITY_BATCH_SIZE):
         """
         Parameters
         ----------
@@ -137,103 +252,238 @@ class OpacityDetectorALEXNET(AbstractOpacityDetector):
             path to trained opacity model
         video_path : string, optional
             path to video file to be detected
-        device : enum
-            device model
+        indicator : int, optional
+            size of touch indicator
+        batch_size : int, optional
+            number of crops passed to the model at once
         """
         super().__init__()
         self.frames = frames
         self.opacity_predictions = None
         self.model_path = model
         self.video_path = video_path
+        self.frame_source = None
+        self.model_service = None
+        self.batch_size = batch_size
         self.touch_indicator_size = indicator
+        self.stream_batch = None
+        self.stream_taps = []
+        self.stream_predictions = []
+        self.stream_model = None
+        self.stream_listener = None
+        self.stream_frames = deque()
+        self.stream_added = 0
+        self.stream_scored = 0
         # This is the size defined in the model for AlexNet architecture
         self.size = 227
 
     def execute_detection(self):
         """
-        Executes opacity prediction.
+        Executes opacity prediction and sets the opacity confidence of every
+        screen tap of frames.
         """
-        self.__crop_and_compile_images()
-        # get the images in the cropped folder
         logging.info("Detecting opacity value for video : " +
                                              os.path.basename(self.video_path))
-        img_list = [img for img in os.listdir(self.cropped_path) if
-                                            os.path.splitext(img)[1] == ".jpg"]
-        # sort image list so we know the order of the predictions
-        img_list.sort()
-        predictions = []
-        images = []
-        for img in img_list:
-            touch = os.path.join(self.cropped_path, img)
-            temp_image = load_img(touch)
-            temp_image = temp_image.resize((self.size, self.size), Image.ANTIALIAS)
-            temp_image_np = img_to_array(temp_image)
-            # Normalization
-            temp_image_np = temp_image_np.reshape((1,) + temp_image_np.shape) / 255
-            images.append(temp_image_np)
-
-        # resize all images together to get ready to pass into model
-        images = np.array(images).reshape(len(images), self.size, self.size, 3)
-        # load model
-        self.keras_model = self.__load_model(self.model_path)
-        # use model to predict
-        # set attribute opacity_predictions
-        predictions = self.keras_model.predict(images)
+        start_prediction_time = datetime.datetime.now().replace(microsecond=0)
+        taps = [(frame.get_id(), tap) for frame in self.frames
+                for tap in frame.get_screen_taps()]
+        images = self.__crop_images(taps)
+        predictions = self.__predict(images)[:len(taps)]
+        for (frame_id, tap), prediction in zip(taps, predictions):
+            # extract the prediction that the indicator is low opacity
+            tap.set_opacity_confidence(prediction[0].item()) #.item() converts from np.float32 to float
         self.set_opacity_predictions(predictions)
 
-    
-    def __crop_and_compile_images(self):
+        end_prediction_time = datetime.datetime.now().replace(microsecond=0)
+        self.set_prediction_time(end_prediction_time - start_prediction_time)
+        logging.info("Opacity detection process took: " + str(self.prediction_time))
+
+    def __crop_images(self, taps):
         """
-        Crops and compiles detected touch images into a format that can be
-        fed to model.
+        Crops the touch indicators of taps into one normalized array, padded
+        with blank crops to a multiple of batch_size.
+
+        Parameters
+        ----------
+        taps : list of (int, ScreenTap)
+            frame id and tap of each crop, in order
+
+        Returns
+        -------
+        images : np array
+            crops with shape [padded number of taps, size, size, 3]
+        """
+        num_images = -(-len(taps) // self.batch_size) * self.batch_size
+        images = np.zeros((num_images, self.size, self.size, 3), dtype=np.float32)
+        if len(taps) == 0:
+            return images
+
+        # match the frame number with the crops to cut from it
+        crops = {}
+        for index, (frame_id, tap) in enumerate(taps):
+            crops.setdefault(frame_id, []).append((index, tap))
+        frames = self.get_frame_source().select(crops.keys())
+        for frame_id, full_img in frames:
+            for index, tap in crops.get(frame_id, []):
+                images[index] = self.__crop(full_img, tap)
+        # Normalization
+        images /= 255
+        return images
+
+    def __crop(self, image_np, tap, scale=1.0):
+        """
+        Crops the touch indicator of a tap and resizes it to the model input.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame the tap was detected in
+        tap : ScreenTap
+            tap to crop, in device coordinates
+        scale : float, optional
+            size of the frame relative to the device screen
+
+        Returns
+        -------
+        crop : np array
+            crop with shape [size, size, 3]
         """
         # alias for shorter usage
-        size = self.touch_indicator_size
-        # ensure placement directory exists
-        if not os.path.exists(self.cropped_path):
-            os.mkdir(self.cropped_path)
-        # path to extracted frames
-        video_dir, video_file = os.path.split(self.video_path)
-        video_name, video_extension = os.path.splitext(video_file)
-        extracted_frames_dir_path = os.path.join(video_dir, video_name , 
-                                                 "extracted_frames")
-        logging.info(extracted_frames_dir_path)
-        # match the frame number with the image to crop
-        for detection in self.frames:
-            # format string as it was for images
-            det_id = "%04d" % detection.get_id()
-            img_base = det_id + ".jpg"
-            img_path = os.path.join(extracted_frames_dir_path, img_base)
-            loaded_image = Image.open(img_path)
-            full_img = ImageUtils.load_image_into_np_array(loaded_image)
-            # cycle through each screen tap and save a cropped image
-            for num, tap in enumerate(detection.get_screen_taps()):
-                x = max(round((tap.get_x() - self.touch_indicator_size / 2)), 0)
-                y = max(round((tap.get_y() - self.touch_indicator_size / 2)), 0)
-                
-                crop_path = os.path.join(self.cropped_path, det_id + "_" + 
-                                         str(num) + ".jpg")
-                # slice from top of bounding box to size of touch indicator
-                crop_img = full_img[int(y):int(y+size), int(x):int(x+size)]
-                # save image
-                ImageUtils.save_image_array_as_jpg(crop_img, crop_path)
-
-    def __load_model(self, path):
-        """
-        Loads model to be used so that predictions can be made.
+        size = self.touch_indicator_size * scale
+        height, width = image_np.shape[:2]
+        # box of the touch indicator, clamped to the frame so taps at or past
+        # its edge still keep at least a pixel
+        x = min(max(round((tap.get_x() * scale - size / 2)), 0), width - 1)
+        y = min(max(round((tap.get_y() * scale - size / 2)), 0), height - 1)
+        x_end = min(max(int(x + size), x + 1), width)
+        y_end = min(max(int(y + size), y + 1), height)
+        # slice from top of bounding box to size of touch indicator
+        crop_img = image_np[int(y):y_end, int(x):x_end]
+        crop_img = Image.fromarray(crop_img).resize((self.size, self.size),
+                                                    Image.LANCZOS)
+        return np.asarray(crop_img)
+
+    def start_stream(self, listener=None):
+        """
+        Prepares to score the taps of frames added one at a time while they
+        are still decoded, see add_frame().
 
         Parameters
         ----------
-        path : string
-            path to keras model to load
+        listener : callable, optional
+            called with each added frame, in the order added, once all its
+            taps are scored
+        """
+        self.stream_batch = np.zeros((self.batch_size, self.size, self.size, 3),
+                                     dtype=np.float32)
+        self.stream_taps = []
+        self.stream_predictions = []
+        self.stream_model = None
+        self.stream_listener = listener
+        self.stream_frames = deque()
+        self.stream_added = 0
+        self.stream_scored = 0
+
+    def add_frame(self, frame, image_np, scale=1.0):
+        """
+        Crops the taps of a frame into the current batch, scoring the batch
+        once it holds batch_size crops.
+
+        Parameters
+        ----------
+        frame : Frame
+            frame with detected taps
+        image_np : np array
+            decoded frame
+        scale : float, optional
+            size of image_np relative to the device screen
+        """
+        if self.stream_listener is not None:
+            self.stream_added += len(frame.get_screen_taps())
+            self.stream_frames.append((frame, self.stream_added))
+        for tap in frame.get_screen_taps():
+            self.stream_batch[len(self.stream_taps)] = self.__crop(image_np, tap, scale)
+            self.stream_taps.append(tap)
+            if len(self.stream_taps) == self.batch_size:
+                self.__score_stream_batch()
+        self.__release_stream_frames()
+
+    def finish_stream(self):
+        """
+        Scores the crops left in the current batch and sets opacity
+        predictions to the predictions of every added tap.
+        """
+        if len(self.stream_taps) != 0:
+            self.__score_stream_batch()
+        self.__release_stream_frames()
+        if len(self.stream_predictions) != 0:
+            self.set_opacity_predictions(np.concatenate(self.stream_predictions))
+        else:
+            self.set_opacity_predictions(np.zeros((0, 1), dtype=np.float32))
+        self.stream_batch = None
+        self.stream_model = None
+        self.stream_listener = None
+
+    def __score_stream_batch(self):
+        """
+        Scores the crops of the current batch, padded with blank crops so
+        every model call has the same shape, and empties the batch.
+        """
+        num_taps = len(self.stream_taps)
+        self.stream_batch[num_taps:] = 0
+        # Normalization
+        self.stream_batch[:num_taps] /= 255
+        if self.stream_model is None:
+            self.stream_model = self.__get_model()
+        predictions = self.stream_model.predict(self.stream_batch)[:num_taps]
+        for tap, prediction in zip(self.stream_taps, predictions):
+            tap.set_opacity_confidence(prediction[0].item())
+        self.stream_predictions.append(predictions)
+        self.stream_scored += num_taps
+        self.stream_taps = []
+
+    def __release_stream_frames(self):
+        """
+        Passes the streamed frames whose taps are all scored to the listener,
+        keeping the order they were added in.
+        """
+        while len(self.stream_frames) != 0 and self.stream_frames[0][1] <= self.stream_scored:
+            frame, _ = self.stream_frames.popleft()
+            self.stream_listener(frame)
+
+    def __get_model(self):
+        """
+        Returns the opacity model, from the model service if one is set.
 
         Returns
         -------
-        keras_model: model
-            model that can be used to predict with
+        model : KerasOpacityModel
+            loaded opacity model
         """
-        return load_model(path)
-    
+        if self.model_service is not None:
+            return self.model_service.get_model(KerasOpacityModel, self.model_path)
+        return KerasOpacityModel(self.model_path)
+
+    def __predict(self, images_np):
+        """
+        Runs the model on the crops in batches of batch_size crops.
+
+        Parameters
+        ----------
+        images_np : np array
+            crops with a multiple of batch_size crops
+
+        Returns
+        -------
+        predictions : np array
+            predictions of every crop
+        """
+        if len(images_np) == 0:
+            return np.zeros((0, 1), dtype=np.float32)
+        model = self.__get_model()
+        return np.concatenate([model.predict(images_np[i:i + self.batch_size])
+                               for i in range(0, len(images_np), self.batch_size)])
+
     def set_indicator_size(self, size):
         """
         Changes the touch indicator size to specified value.
@@ -297,8 +547,7 @@ class OpacityDetectorALEXNET(AbstractOpacityDetector):
 
     def set_video_path(self, path):
         """
-        Changes video path to specified value. Also changes the cropped path to
-        match.
+        Changes video path to specified value.
 
         Parameters
         ----------
@@ -307,33 +556,77 @@ class OpacityDetectorALEXNET(AbstractOpacityDetector):
         """
         self.video_path = path
 
-        video_dir, video_file = os.path.split(path)
-        video_name, video_extension = os.path.splitext(video_file)
-        vid_path_dir = os.path.join(video_dir, video_name)
-        crop = os.path.join(vid_path_dir, "cropped_images")
-        self.set_cropped_path(crop)
+    def get_frame_source(self):
+        """
+        Returns the frame source crops are cut from, defaulting to the
+        extracted frames of the video.
 
-    def get_cropped_path(self):
+        Returns
+        -------
+        frame_source : AbstractFrameSource
+            source of full resolution frames
         """
-        Returns cropped path.
+        if self.frame_source is None:
+            video_dir, video_file = os.path.split(self.video_path)
+            video_name, video_extension = os.path.splitext(video_file)
+            return ExtractedFrameSource(os.path.join(video_dir, video_name,
+                                                     "extracted_frames"))
+        return self.frame_source
+
+    def set_frame_source(self, source):
+        """
+        Changes frame source to specified value.
+
+        Parameters
+        ----------
+        source : AbstractFrameSource
+            new frame source, yielding frames at full resolution
+        """
+        self.frame_source = source
+
+    def get_model_service(self):
+        """
+        Returns the model service.
 
         Returns
         -------
-        cropped_path : string
-            path to cropped images
+        model_service : TouchModelService
+            service keeping the model loaded; None if loaded per detection
         """
-        return self.cropped_path
+        return self.model_service
 
-    def set_cropped_path(self, path):
+    def set_model_service(self, service):
         """
-        Changes cropped path to specified value.
+        Changes model service to specified value.
 
         Parameters
         ----------
-        path : string
-            new cropped path
+        service : TouchModelService
+            new model service; None to load the model for each detection
+        """
+        self.model_service = service
+
+    def get_batch_size(self):
+        """
+        Returns batch size.
+
+        Returns
+        -------
+        batch_size : int
+            number of crops passed to the model at once
+        """
+        return self.batch_size
+
+    def set_batch_size(self, size):
+        """
+        Changes batch size to specified value.
+
+        Parameters
+        ----------
+        size : int
+            new number of crops passed to the model at once
         """
-        self.cropped_path = path
+        self.batch_size = size
 
     def get_model_path(self):
         """
@@ -0,0 +1,184 @@
+# scale_benchmark.py
+import logging
+import os
+import timeit
+
+from v2s.phase1.detection.touch_detection import TouchDetectorFRCNN
+from v2s.phase1.detection.touch_model import (FrozenGraphTouchModel,
+                                             TouchModelService)
+from v2s.phase1.video_manipulation.frame_source import ExtractedFrameSource
+from v2s.util.constants import TAP_EPSILON
+from v2s.util.general import GeneralUtils, JSONFileUtils
+
+
+class ScaleBenchmark():
+    """
+    Measures the accuracy/latency tradeoff of downscaled inference on the
+    extracted frames of a video.
+
+    Touch detection runs once per scale with the model already loaded, so the
+    time reported covers decoding, resizing and inference. Taps are compared
+    against the taps detected at full resolution; a tap matches a reference
+    tap of the same frame closer than TAP_EPSILON pixels.
+
+    Attributes
+    ----------
+    video_path : string
+        path to video whose extracted frames are detected on
+    model_path : string
+        path to frozen graph for touch detection
+    labelmap_path : string
+        path to label map for touch detections
+    scales : list of floats
+        scales to benchmark
+    num_frames : int
+        number of frames detected on
+    results : list of dicts
+        scale, seconds, fps, taps, recall, precision and mean_error per scale
+
+    Methods
+    -------
+    execute()
+        Runs touch detection at every scale and compares the detected taps.
+    __detect(scale, service)
+        Runs touch detection on frames downscaled by scale.
+    __compare(reference, detections)
+        Matches detected taps against reference taps.
+    get_results()
+        Returns the benchmark results.
+    """
+
+    def __init__(self, video_path, model, labelmap, scales):
+        """
+        Parameters
+        ----------
+        video_path : string
+            path to video whose frames were already extracted
+        model : string
+            path to frozen graph
+        labelmap : string
+            path to labelmap
+        scales : list of floats
+            scales to benchmark
+        """
+        self.video_path = video_path
+        self.model_path = model
+        self.labelmap_path = labelmap
+        self.scales = scales
+        self.num_frames = 0
+        self.results = []
+
+    def execute(self):
+        """
+        Runs touch detection at every scale and compares the detected taps
+        with those detected at full resolution. Results are also written to
+        "scale_benchmark.json".
+        """
+        # load the model up front so it is not part of any measurement
+        service = TouchModelService()
+        service.get_model(FrozenGraphTouchModel, self.model_path)
+
+        reference, reference_time = self.__detect(1.0, service)
+        self.results = []
+        for scale in self.scales:
+            if scale == 1.0:
+                detections, seconds = reference, reference_time
+            else:
+                detections, seconds = self.__detect(scale, service)
+            result = self.__compare(reference, detections)
+            result["scale"] = scale
+            result["seconds"] = seconds
+            result["fps"] = self.num_frames / seconds if seconds > 0 else 0
+            self.results.append(result)
+            logging.info("Scale {scale}: {seconds:.2f}s ({fps:.1f} fps), "
+                         "recall {recall:.3f}, precision {precision:.3f}, "
+                         "mean error {mean_error:.1f}px".format(**result))
+        service.close()
+
+        video_dir, video_file = os.path.split(self.video_path)
+        video_name, video_extension = os.path.splitext(video_file)
+        JSONFileUtils.output_data_to_json(self.results, os.path.join(
+            video_dir, video_name, "scale_benchmark.json"))
+
+    def __detect(self, scale, service):
+        """
+        Runs touch detection on frames downscaled by scale.
+
+        Parameters
+        ----------
+        scale : float
+            factor to downscale frames by
+        service : TouchModelService
+            service holding the loaded model
+
+        Returns
+        -------
+        detections : (list of Frames, float)
+            detected taps and seconds taken to detect them
+        """
+        video_dir, video_file = os.path.split(self.video_path)
+        video_name, video_extension = os.path.splitext(video_file)
+        frames = ExtractedFrameSource(os.path.join(
+            video_dir, video_name, "extracted_frames"), scale=scale)
+        self.num_frames = len(frames)
+
+        detector = TouchDetectorFRCNN(self.video_path, self.model_path,
+                                      self.labelmap_path)
+        detector.set_frame_source(frames)
+        detector.set_model_service(service)
+        start = timeit.default_timer()
+        detector.execute_detection()
+        return detector.get_touch_detections(), timeit.default_timer() - start
+
+    def __compare(self, reference, detections):
+        """
+        Matches detected taps against reference taps of the same frame.
+
+        Parameters
+        ----------
+        reference : list of Frames
+            taps detected at full resolution
+        detections : list of Frames
+            taps detected at a lower scale
+
+        Returns
+        -------
+        result : dict
+            taps, recall, precision and mean_error of the detected taps
+        """
+        reference_taps = {frame.get_id(): frame.get_screen_taps()
+                          for frame in reference}
+        num_reference = sum(len(taps) for taps in reference_taps.values())
+        num_detected = 0
+        errors = []
+        for frame in detections:
+            unmatched = list(reference_taps.get(frame.get_id(), []))
+            for tap in frame.get_screen_taps():
+                num_detected += 1
+                if len(unmatched) == 0:
+                    continue
+                closest = min(unmatched,
+                              key=lambda ref: GeneralUtils.get_distance(tap, ref))
+                distance = GeneralUtils.get_distance(tap, closest)
+                if distance < TAP_EPSILON:
+                    unmatched.remove(closest)
+                    errors.append(distance)
+
+        return {
+            "taps": num_detected,
+            "recall": len(errors) / num_reference if num_reference > 0 else 1.0,
+            "precision": len(errors) / num_detected if num_detected > 0 else 1.0,
+            "mean_error": sum(errors) / len(errors) if len(errors) > 0 else 0.0
+        }
+
+    def get_results(self):
+        """
+        Returns the benchmark results.
+
+        Returns
+        -------
+        results : list of dicts
+            scale, seconds, fps, taps, recall, precision and mean_error per
+            scale
+        """
+        return self.results
@@ -0,0 +1,187 @@
+# template_touch_model.py
+import numpy as np
+
+from v2s.phase1.detection.touch_model import (AbstractTouchModel,
+                                             FrozenGraphTouchModel)
+from v2s.util.constants import (TEMPLATE_CONFIDENT_CORRELATION,
+                                TEMPLATE_DISC_SIZE, TEMPLATE_MAX_TAPS,
+                                TEMPLATE_MIN_CORRELATION)
+from v2s.util.general import ImageUtils
+
+
+class TemplateTouchModel(AbstractTouchModel):
+    """
+    Classical touch detector matching the "show touches" indicator, a
+    translucent disc of fixed size, without a trained model.
+
+    Frames are reduced to gray and downsampled so the disc spans about
+    TEMPLATE_DISC_SIZE pixels. The edges of the frame are then correlated
+    with a circle the size of the indicator, so that the straight edges of
+    the interface match poorly whatever their contrast. Each correlation peak
+    of at least min_correlation is a tap, scored by its correlation.
+
+    Attributes
+    ----------
+    indicator_size : float
+        diameter of the indicator, in frame pixels
+    min_correlation : float
+        lowest correlation reported as a tap
+    max_taps : int
+        largest number of taps reported per frame
+    step : int
+        distance between pixels kept when downsampling frames
+    template : np array
+        circle template, in downsampled pixels
+
+    Methods
+    -------
+    __infer_image(image_np)
+        Finds the indicators in one frame.
+    __edges(image_np)
+        Returns the edge strength of a downsampled gray frame.
+    """
+
+    def __init__(self, model_path=None, indicator_size=None,
+                 min_correlation=TEMPLATE_MIN_CORRELATION,
+                 max_taps=TEMPLATE_MAX_TAPS):
+        """
+        Parameters
+        ----------
+        model_path : string, optional
+            unused, the indicator is matched without a trained model
+        indicator_size : float
+            diameter of the indicator, in frame pixels
+        min_correlation : float, optional
+            lowest correlation reported as a tap
+        max_taps : int, optional
+            largest number of taps reported per frame
+        """
+        self.indicator_size = indicator_size
+        self.min_correlation = min_correlation
+        self.max_taps = max_taps
+        self.step = max(int(round(indicator_size / TEMPLATE_DISC_SIZE)), 1)
+        # circle one downsampled pixel thick, with a pixel of margin around
+        radius = indicator_size / self.step / 2
+        size = int(np.ceil(radius * 2)) + 3
+        center = (size - 1) / 2
+        yy, xx = np.mgrid[:size, :size]
+        distances = np.hypot(yy - center, xx - center)
+        self.template = (np.abs(distances - radius) <= 1).astype(np.float32)
+
+    def infer(self, images_np):
+        return [self.__infer_image(image_np) for image_np in images_np]
+
+    def __infer_image(self, image_np):
+        """
+        Finds the indicators in one frame.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        detection : (np array, np array, np array)
+            boxes, scores and classes detected in the frame
+        """
+        (height, width) = image_np.shape[:2]
+        edges = self.__edges(image_np)
+        boxes, scores = [], []
+        if edges.shape[0] >= self.template.shape[0] and edges.shape[1] >= self.template.shape[1]:
+            correlations = ImageUtils.match_template(edges, self.template)
+            # peaks closer than a radius to a stronger one belong to the same tap
+            suppress = self.template.shape[0] // 2
+            for _ in range(self.max_taps):
+                peak = np.unravel_index(np.argmax(correlations), correlations.shape)
+                score = correlations[peak]
+                if score < self.min_correlation:
+                    break
+                center_y = (peak[0] + (self.template.shape[0] - 1) / 2) * self.step
+                center_x = (peak[1] + (self.template.shape[1] - 1) / 2) * self.step
+                half = self.indicator_size / 2
+                boxes.append([(center_y - half) / height, (center_x - half) / width,
+                              (center_y + half) / height, (center_x + half) / width])
+                scores.append(score)
+                correlations[max(peak[0] - suppress, 0):peak[0] + suppress + 1,
+                             max(peak[1] - suppress, 0):peak[1] + suppress + 1] = -1
+        return (np.array(boxes, dtype=np.float32).reshape(-1, 4),
+                np.array(scores, dtype=np.float32),
+                np.ones(len(scores), dtype=np.int64))
+
+    def __edges(self, image_np):
+        """
+        Returns the edge strength of a frame reduced to gray and downsampled
+        by averaging step x step blocks, which keeps interface text from
+        aliasing into edges.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        edges : np array
+            gradient magnitude with shape [height / step, width / step]
+        """
+        rows = image_np.shape[0] // self.step
+        cols = image_np.shape[1] // self.step
+        blocks = image_np[:rows * self.step, :cols * self.step].reshape(
+            rows, self.step, cols, self.step, -1)
+        gray = blocks.mean(axis=(1, 3, 4), dtype=np.float32)
+        if rows < 2 or cols < 2:
+            return gray
+        gradient_y, gradient_x = np.gradient(gray)
+        return np.hypot(gradient_y, gradient_x)
+
+class HybridTouchModel(AbstractTouchModel):
+    """
+    Touch detector running the template detector on every frame and a
+    trained model only on the frames the template detector is unsure about:
+    frames with a tap scored below confident_correlation, and frames where it
+    found no tap, since a touch it cannot match scores like the background.
+
+    Attributes
+    ----------
+    template_model : TemplateTouchModel
+        detector run on every frame
+    neural_model : AbstractTouchModel
+        model run on ambiguous frames
+    confident_correlation : float
+        lowest correlation of a tap trusted without the trained model
+    """
+
+    def __init__(self, model_path, indicator_size=None,
+                 neural_class=FrozenGraphTouchModel,
+                 confident_correlation=TEMPLATE_CONFIDENT_CORRELATION,
+                 **neural_args):
+        """
+        Parameters
+        ----------
+        model_path : string
+            path to the trained model
+        indicator_size : float
+            diameter of the indicator, in frame pixels
+        neural_class : class, optional
+            AbstractTouchModel subclass able to load the trained model
+        confident_correlation : float, optional
+            lowest correlation of a tap trusted without the trained model
+        **neural_args
+            extra arguments passed to neural_class
+        """
+        self.template_model = TemplateTouchModel(indicator_size=indicator_size)
+        self.neural_model = neural_class(model_path, **neural_args)
+        self.confident_correlation = confident_correlation
+
+    def infer(self, images_np):
+        detections = self.template_model.infer(images_np)
+        ambiguous = [i for i, (boxes, scores, classes) in enumerate(detections)
+                     if len(scores) == 0 or np.any(scores < self.confident_correlation)]
+        if len(ambiguous) != 0:
+            for i, detection in zip(ambiguous, self.neural_model.infer(images_np[ambiguous])):
+                detections[i] = detection
+        return detections
+
+    def close(self):
+        self.neural_model.close()
@@ -0,0 +1,85 @@
+# template_touch_model_test.py
+import unittest
+
+import numpy as np
+
+from v2s.phase1.detection.template_touch_model import (HybridTouchModel,
+                                                       TemplateTouchModel)
+
+INDICATOR_SIZE = 40
+NEURAL_BOX = np.array([[0.4, 0.4, 0.6, 0.6]], dtype=np.float32)
+
+
+class FakeNeuralModel():
+    """
+    Stands in for the trained model, finding one tap in every frame.
+    """
+
+    def __init__(self, model_path):
+        self.frames = 0
+
+    def infer(self, images_np):
+        self.frames += len(images_np)
+        return [(NEURAL_BOX, np.array([0.9], dtype=np.float32), np.array([1]))
+                for _ in images_np]
+
+    def close(self):
+        pass
+
+
+def make_frame(taps, radius=INDICATOR_SIZE / 2, alpha=0.4, seed=0):
+    """
+    Returns a frame of flat interface blocks with a translucent disc drawn
+    at each tap center.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.repeat(np.repeat(rng.integers(30, 200, (4, 3, 3)), 60, 0), 60, 1).astype(np.float32)
+    image += rng.normal(0, 4, image.shape)
+    yy, xx = np.mgrid[:image.shape[0], :image.shape[1]]
+    for center_y, center_x in taps:
+        disc = (yy - center_y) ** 2 + (xx - center_x) ** 2 < radius ** 2
+        image[disc] = image[disc] * (1 - alpha) + 255 * alpha
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+class TemplateTouchModelTest(unittest.TestCase):
+
+    def test_finds_indicator(self):
+        model = TemplateTouchModel(indicator_size=INDICATOR_SIZE)
+        image = make_frame([(120, 90)])
+        boxes, scores, classes = model.infer(image[np.newaxis, ...])[0]
+        self.assertEqual(len(scores), 1)
+        center_y = (boxes[0][0] + boxes[0][2]) / 2 * image.shape[0]
+        center_x = (boxes[0][1] + boxes[0][3]) / 2 * image.shape[1]
+        self.assertLess(np.hypot(center_y - 120, center_x - 90), INDICATOR_SIZE / 4)
+
+    def test_no_indicator(self):
+        model = TemplateTouchModel(indicator_size=INDICATOR_SIZE)
+        boxes, scores, classes = model.infer(make_frame([])[np.newaxis, ...])[0]
+        self.assertEqual(len(scores), 0)
+
+
+class HybridTouchModelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = HybridTouchModel("model", indicator_size=INDICATOR_SIZE,
+                                      neural_class=FakeNeuralModel)
+
+    def test_confident_match_skips_neural_model(self):
+        detections = self.model.infer(make_frame([(120, 90)])[np.newaxis, ...])
+        self.assertEqual(self.model.neural_model.frames, 0)
+        self.assertEqual(len(detections[0][1]), 1)
+
+    def test_unmatched_touch_falls_back_to_neural_model(self):
+        # a small faint indicator the template cannot match
+        image = make_frame([(120, 90)], radius=INDICATOR_SIZE / 5, alpha=0.1)
+        template_scores = self.model.template_model.infer(image[np.newaxis, ...])[0][1]
+        self.assertEqual(len(template_scores), 0)
+
+        boxes, scores, classes = self.model.infer(image[np.newaxis, ...])[0]
+        self.assertEqual(self.model.neural_model.frames, 1)
+        np.testing.assert_array_equal(boxes, NEURAL_BOX)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+# thread_tuner.py
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import timeit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from v2s.util.constants import (DETECTION_BATCH_SIZE, INTER_OP_THREADS,
+                                TUNING_CACHE_PATH, TUNING_FRAMES)
+from v2s.util.general import GeneralUtils
+
+
+class ThreadTuner():
+    """
+    Finds the fastest tf threading and batch size settings of a touch model
+    on the current machine. A few intra-op, inter-op and batch size
+    combinations are timed on a few frames of the video, or on synthetic
+    frames when there is no video yet, and the fastest is kept in a json cache
+    per machine, model and frame shape so it is only measured once.
+
+    Attributes
+    ----------
+    model_class : class
+        AbstractTouchModel subclass able to load the model
+    model_path : string
+        path to the model
+    cache_path : string
+        path to the json file keeping tuned settings
+    candidates : list of (int, int, int)
+        intra-op threads, inter-op threads and batch size combinations to time
+
+    Methods
+    -------
+    get_settings(image_shape, frame_source=None)
+        Returns the fastest settings, measuring them if not cached.
+    __get_key(image_shape)
+        Returns the cache key of the machine, model and frame shape.
+    __calibrate(image_shape, frame_source)
+        Times every candidate and returns the fastest.
+    __get_frames(image_shape, frame_source)
+        Returns the frames candidates are timed on.
+    measure(model_class, model_path, candidate, images_np)
+        Returns the frames per second reached with a candidate.
+    measure_shared(model_class, model_path, candidate, name, shape)
+        Returns the frames per second reached on frames in shared memory.
+    get_candidates(cpu_count)
+        Returns the default combinations to time.
+    """
+
+    def __init__(self, model_class, model_path, cache_path=TUNING_CACHE_PATH,
+                 candidates=None):
+        """
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_path : string
+            path to the model
+        cache_path : string, optional
+            path to the json file keeping tuned settings
+        candidates : list of (int, int, int), optional
+            intra-op threads, inter-op threads and batch size combinations
+        """
+        self.model_class = model_class
+        self.model_path = model_path
+        self.cache_path = cache_path
+        self.candidates = (candidates if candidates is not None
+                           else self.get_candidates(os.cpu_count() or 1))
+
+    def get_settings(self, image_shape, frame_source=None):
+        """
+        Returns the fastest settings, measuring them if not cached.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [height, width, 3] of the frames that will be detected on
+        frame_source : AbstractFrameSource, optional
+            frames that will be detected on, a few of which are timed
+
+        Returns
+        -------
+        settings : dict
+            intra_op_threads, inter_op_threads and batch_size
+        """
+        key = self.__get_key(image_shape)
+        cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        if key in cache:
+            return cache[key]
+
+        settings = self.__calibrate(image_shape, frame_source)
+        # another worker may have tuned meanwhile, keep its entries too
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+        cache[key] = settings
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        temp_path = self.cache_path + "." + str(os.getpid())
+        with open(temp_path, "w") as file:
+            json.dump(cache, file, sort_keys=True)
+        os.replace(temp_path, self.cache_path)
+        return settings
+
+    def __get_key(self, image_shape):
+        """
+        Returns the cache key of the machine, model and frame shape.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [height, width, 3] of the frames
+
+        Returns
+        -------
+        key : string
+            key of the tuned settings
+        """
+        model_file = self.model_path
+        if os.path.isdir(model_file):
+            model_file = os.path.join(model_file, "saved_model.pb")
+        return ":".join([platform.node(), str(os.cpu_count()),
+                         self.model_class.__name__,
+                         GeneralUtils.get_file_hash(model_file),
+                         "x".join(str(size) for size in image_shape)])
+
+    def __calibrate(self, image_shape, frame_source):
+        """
+        Times every candidate and returns the fastest.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [height, width, 3] of the frames
+        frame_source : AbstractFrameSource
+            frames to time a few of; None to time synthetic frames
+
+        Returns
+        -------
+        settings : dict
+            intra_op_threads, inter_op_threads and batch_size
+        """
+        images_np = ThreadTuner.__get_frames(image_shape, frame_source)
+
+        shared = None
+        if self.model_class.process_wide_threads:
+            # frames are copied once for all the processes, which read them
+            # in place instead of each receiving a pickled copy
+            shared = shared_memory.SharedMemory(create=True, size=images_np.nbytes)
+            np.ndarray(images_np.shape, images_np.dtype, buffer=shared.buf)[:] = images_np
+        best, best_fps = None, 0
+        try:
+            for candidate in self.candidates:
+                if shared is not None:
+                    # thread settings are fixed once the model ran, so time
+                    # each candidate in a fresh process
+                    context = multiprocessing.get_context("spawn")
+                    with ProcessPoolExecutor(1, mp_context=context) as pool:
+                        fps = pool.submit(ThreadTuner.measure_shared, self.model_class,
+                                          self.model_path, candidate, shared.name,
+                                          images_np.shape).result()
+                else:
+                    fps = self.measure(self.model_class, self.model_path,
+                                       candidate, images_np)
+                logging.info("Threads (intra, inter, batch) " + str(candidate)
+                             + ": " + "{:.2f}".format(fps) + " fps")
+                if fps > best_fps:
+                    best, best_fps = candidate, fps
+        finally:
+            if shared is not None:
+                shared.close()
+                shared.unlink()
+
+        logging.info("Fastest threads (intra, inter, batch): " + str(best))
+        return {"intra_op_threads": best[0], "inter_op_threads": best[1],
+                "batch_size": best[2]}
+
+    @staticmethod
+    def __get_frames(image_shape, frame_source):
+        """
+        Returns TUNING_FRAMES frames spread over the frame source, repeated if
+        it has fewer, or synthetic frames of image_shape without a source.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [height, width, 3] of the frames
+        frame_source : AbstractFrameSource
+            frames to pick from; None for synthetic frames
+
+        Returns
+        -------
+        images_np : np array
+            frames to time inference on
+        """
+        images = []
+        if frame_source is not None:
+            frame_ids = frame_source.get_frame_ids()
+            if len(frame_ids) != 0:
+                picks = np.linspace(0, len(frame_ids) - 1, TUNING_FRAMES).round().astype(int)
+                selected = frame_source.select([frame_ids[pick] for pick in picks])
+                images = [image_np for _, image_np in selected]
+        if len(images) == 0:
+            logging.info("Timing threads on synthetic frames")
+            return np.random.default_rng(0).integers(
+                0, 256, (TUNING_FRAMES,) + tuple(image_shape), dtype=np.uint8)
+        return np.stack([images[i % len(images)] for i in range(TUNING_FRAMES)])
+
+    @staticmethod
+    def measure_shared(model_class, model_path, candidate, name, shape):
+        """
+        Returns the frames per second reached with a candidate on uint8
+        frames kept in shared memory.
+
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_path : string
+            path to the model
+        candidate : (int, int, int)
+            intra-op threads, inter-op threads and batch size
+        name : string
+            name of the shared memory holding the frames
+        shape : tuple
+            shape [count, height, width, 3] of the frames
+
+        Returns
+        -------
+        fps : float
+            frames inferred per second
+        """
+        shared = shared_memory.SharedMemory(name=name)
+        images_np = np.ndarray(shape, np.uint8, buffer=shared.buf)
+        try:
+            return ThreadTuner.measure(model_class, model_path, candidate, images_np)
+        finally:
+            # the memory cannot be closed while a view of it is left
+            del images_np
+            shared.close()
+
+    @staticmethod
+    def measure(model_class, model_path, candidate, images_np):
+        """
+        Returns the frames per second reached with a candidate.
+
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_path : string
+            path to the model
+        candidate : (int, int, int)
+            intra-op threads, inter-op threads and batch size
+        images_np : np array
+            frames to time inference on
+
+        Returns
+        -------
+        fps : float
+            frames inferred per second
+        """
+        intra_op_threads, inter_op_threads, batch_size = candidate
+        model = model_class(model_path, intra_op_threads=intra_op_threads,
+                            inter_op_threads=inter_op_threads)
+        try:
+            # the first run sets up the session and is not representative
+            model.infer(images_np[:batch_size])
+            start = timeit.default_timer()
+            for i in range(0, len(images_np), batch_size):
+                model.infer(images_np[i:i + batch_size])
+            return len(images_np) / (timeit.default_timer() - start)
+        finally:
+            model.close()
+
+    @staticmethod
+    def get_candidates(cpu_count):
+        """
+        Returns the default combinations to time: all or half of the cpus for
+        single ops, a few ops in parallel, and single or batched frames.
+
+        Parameters
+        ----------
+        cpu_count : int
+            number of cpus of the machine
+
+        Returns
+        -------
+        candidates : list of (int, int, int)
+            intra-op threads, inter-op threads and batch size combinations
+        """
+        intra_choices = sorted(set([cpu_count, max(cpu_count // 2, 1)]))
+        inter_choices = sorted(set([1, 2, INTER_OP_THREADS]))
+        batch_choices = sorted(set([1, DETECTION_BATCH_SIZE]))
+        return [(intra, inter, batch) for intra in intra_choices
+                for inter in inter_choices for batch in batch_choices]
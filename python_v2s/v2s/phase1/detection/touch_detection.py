@@ -1,19 +1,32 @@
 # touch_detection.py
+import copy
 import datetime
-import glob
 import json
 import logging
+import multiprocessing
 import os
 import subprocess as sp
 import sys
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 
-import ntpath
 import numpy as np
-import tensorflow as tf
-from PIL import Image, ImageFile
-
-from v2s.util.general import ComplexEncoder, ImageUtils, ProgressBar
+from PIL import ImageFile
+
+from v2s.phase1.detection.inference_server import RemoteTouchModel
+from v2s.phase1.detection.template_touch_model import (HybridTouchModel,
+                                                      TemplateTouchModel)
+from v2s.phase1.detection.touch_model import (FrozenGraphTouchModel,
+                                             SavedTouchModel,
+                                             TFLiteTouchModel,
+                                             TouchModelService)
+from v2s.phase1.video_manipulation.frame_source import ExtractedFrameSource
+from v2s.util.constants import (DETECTION_BATCH_SIZE, FRAME_QUEUE_SIZE,
+                                INTER_OP_THREADS, INTRA_OP_THREADS,
+                                SHARD_THREADS, TFLITE_THREADS,
+                                TOUCH_SCORE_THRESHOLD, WRITE_WORKERS)
+from v2s.util.general import (BoundedThreadPool, ComplexEncoder, ImageUtils,
+                              ProgressBar)
 from v2s.util.screen import Frame, ScreenTap
 
 # object detection will only be recognized if it has been added to the path
@@ -97,6 +110,58 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
     video_path : string
         path to video being analyzed; this information is used to reach extracted
         frames
+    frame_source : AbstractFrameSource
+        source of the frames to detect on; if None, the extracted frames of
+        the video are read from disk
+    batch_size : int
+        number of frames passed to the model at once
+    write_workers : int
+        number of threads writing annotated frames
+    debug_artifacts : bool
+        whether frames with detected taps are annotated and written to
+        "detected_frames"
+    frame_gate : FrameDifferenceGate
+        decides which frames need inference; static frames reuse the last
+        detections. If None, every frame is passed to the model
+    last_detections : tuple
+        (boxes, scores, classes) of the last frame passed to the model
+    opacity_detector : OpacityDetectorALEXNET
+        if set, scores the opacity of taps while their frame is still
+        decoded, so taps come out with their opacity confidence
+    checkpoint : DetectionCheckpoint
+        log every scored frame is appended to; frames already in it are not
+        detected again. If None, nothing is logged
+    frame_listener : callable
+        called with every scored frame, with or without taps, in frame order,
+        once its opacity is scored when fused; frames resumed from the
+        checkpoint come first. Only called by detections running through the
+        frames in order, i.e. neither coarse-to-fine nor sharded. If None,
+        nothing is called
+    tracker : TouchTracker
+        follows detected taps into the next frames, so those frames are only
+        passed to the model once tracking is lost. If None, every non-static
+        frame is passed to the model
+    model_service : TouchModelService
+        keeps the model loaded across detections; if None, the model is
+        loaded for each detection
+    tflite_threads : int
+        number of threads running a TFLite model
+    indicator_size : float
+        diameter of the touch indicator in the frames passed to the model,
+        used by the template and hybrid detectors
+    intra_op_threads : int
+        threads running a single tf op; 0 lets tf decide
+    inter_op_threads : int
+        tf ops run in parallel; 0 lets tf decide
+    shards : int
+        number of processes detecting on separate runs of frames; 1 detects
+        in the current process
+    coarse_step : int
+        if above 1, touches are first searched on every coarse_step-th frame,
+        then on every frame only around the frames with touches
+    inference_server : (string, int)
+        host and port of a shared inference server running the model; if
+        set, frames are sent to it instead of loading the model
     detection_time : float
         time to detect touches
     
@@ -104,6 +169,109 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
     -------
     execute_detection()
         Executes touch detection on extracted frames located at frames_path.
+    execute_detection_2()
+        Executes touch detection using saved model instead of frozen graph.
+    execute_detection_tflite()
+        Executes touch detection using a TFLite model.
+    execute_detection_template()
+        Executes touch detection by matching the touch indicator.
+    execute_detection_hybrid()
+        Executes touch detection by matching the touch indicator, using the
+        frozen graph on ambiguous frames.
+    __execute_with_model(model_class, **model_args)
+        Executes touch detection with the model at model_path.
+    __execute_coarse_to_fine(model_class, model_args)
+        Executes touch detection on sampled frames, then around touches.
+    __copy_for(source)
+        Returns a copy of the detector detecting on another frame source.
+    __execute_sharded(sources, model_class, model_args)
+        Executes touch detection on each frame source in its own process.
+    detect_shard(detector, model_class, model_args)
+        Executes touch detection for one shard in a worker process.
+    get_auto_shards(cpu_count)
+        Returns shards and thread counts making use of every cpu.
+    __run_detection(infer)
+        Detects touches in every frame of the frame source.
+    __frame_scored(detection)
+        Logs a scored frame and passes it to the frame listener.
+    __resume(frames)
+        Adds checkpointed detections and returns the frames left to detect.
+    __detect_frames(frames, infer)
+        Runs the model on non-static frames in batches of at most batch_size.
+    __emit_batch(pending, batch, infer)
+        Runs the model on a batch and yields the pending frames' detections.
+    __add_detection(frame_id, image_shape, boxes, scores)
+        Adds the taps detected in a frame to touch detections.
+    __write_detection_image(frame_id, image_np, boxes, scores, classes, category_index, detection_output_path)
+        Places the frame with its bounding boxes in "detected_frames".
+    is_debug_artifacts()
+        Returns whether annotated frames are written.
+    set_debug_artifacts(debug)
+        Changes whether annotated frames are written to specified value.
+    get_write_workers()
+        Returns number of threads writing annotated frames.
+    set_write_workers(workers)
+        Changes number of threads writing annotated frames to specified value.
+    get_batch_size()
+        Returns batch size.
+    set_batch_size(size)
+        Changes batch size to specified value.
+    get_coarse_step()
+        Returns the distance between frames of the coarse pass.
+    set_coarse_step(step)
+        Changes coarse step to specified value.
+    get_shards()
+        Returns number of detection processes.
+    set_shards(shards)
+        Changes number of detection processes to specified value.
+    get_intra_op_threads()
+        Returns number of threads running a single tf op.
+    set_intra_op_threads(threads)
+        Changes number of intra-op threads to specified value.
+    get_inter_op_threads()
+        Returns number of tf ops run in parallel.
+    set_inter_op_threads(threads)
+        Changes number of inter-op threads to specified value.
+    get_tflite_threads()
+        Returns number of threads running a TFLite model.
+    set_tflite_threads(threads)
+        Changes number of TFLite threads to specified value.
+    get_indicator_size()
+        Returns the diameter of the touch indicator.
+    set_indicator_size(size)
+        Changes indicator size to specified value.
+    get_inference_server()
+        Returns the inference server address.
+    set_inference_server(address)
+        Changes inference server address to specified value.
+    get_model_service()
+        Returns the model service.
+    set_model_service(service)
+        Changes model service to specified value.
+    get_frame_gate()
+        Returns the frame gate.
+    set_frame_gate(gate)
+        Changes frame gate to specified value.
+    get_opacity_detector()
+        Returns the opacity detector fused with touch detection.
+    set_opacity_detector(detector)
+        Changes opacity detector to specified value.
+    get_checkpoint()
+        Returns the detection checkpoint.
+    set_checkpoint(checkpoint)
+        Changes detection checkpoint to specified value.
+    get_frame_listener()
+        Returns the frame listener.
+    set_frame_listener(listener)
+        Changes frame listener to specified value.
+    get_tracker()
+        Returns the touch tracker.
+    set_tracker(tracker)
+        Changes touch tracker to specified value.
+    get_frame_source()
+        Returns the frame source detection runs on.
+    set_frame_source(source)
+        Changes frame source to specified value.
     set_object_det_path(path)
         Changes object_det_path to specified value.
     set_model_path(path)
@@ -125,7 +293,8 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
     """
 
     def __init__(self,  video_path=None, model=None, labelmap=None, 
-                 num_classes=1):
+                 num_classes=1, batch_size=DETECTION_BATCH_SIZE,
+                 write_workers=WRITE_WORKERS, debug_artifacts=False):
         """
         Parameters
         ----------
@@ -137,6 +306,12 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
             path to labelmap
         num_classes : int, optional
             number of detection classes
+        batch_size : int, optional
+            number of frames passed to the model at once
+        write_workers : int, optional
+            number of threads writing annotated frames
+        debug_artifacts : bool, optional
+            write annotated frames with detected taps to "detected_frames"
         """
         super(TouchDetectorFRCNN, self).__init__()
         self.touch_detections = []
@@ -145,264 +320,589 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
         self.labelmap_path = labelmap
         self.num_classes = num_classes
         self.video_path = video_path
+        self.frame_source = None
+        self.batch_size = batch_size
+        self.write_workers = write_workers
+        self.debug_artifacts = debug_artifacts
+        self.frame_gate = None
+        self.last_detections = None
+        self.tracker = None
+        self.checkpoint = None
+        self.frame_listener = None
+        self.opacity_detector = None
+        self.model_service = None
+        self.inference_server = None
+        self.tflite_threads = TFLITE_THREADS
+        self.indicator_size = None
+        self.intra_op_threads = INTRA_OP_THREADS
+        self.inter_op_threads = INTER_OP_THREADS
+        self.shards = 1
+        self.coarse_step = 1
 
     def execute_detection(self):
         """
         Executes touch detection on extracted frames located at frames_path.
+
+        Frames are fed to the model in batches of batch_size frames per
+        session run.
         """
-        # set the default graph in tf to trained touch detection model
-        detection_graph = tf.compat.v1.Graph()
-        with detection_graph.as_default():
-            od_graph_def = tf.compat.v1.GraphDef()
-            with tf.compat.v1.gfile.Open(self.model_path, 'rb') as fid:
-                serialized_graph = fid.read()
-                od_graph_def.ParseFromString(serialized_graph)
-                tf.compat.v1.import_graph_def(od_graph_def, name='')
+        self.__execute_with_model(FrozenGraphTouchModel,
+                                  intra_op_threads=self.intra_op_threads,
+                                  inter_op_threads=self.inter_op_threads)
 
-        # load and get information from labelmap
-        label_map = load_labelmap(self.labelmap_path)
-        categories = convert_label_map_to_categories(label_map,
-                     max_num_classes=self.num_classes, use_display_name=True)
-        category_index = create_category_index(categories)
-        
-        video_dir, video_file = os.path.split(self.video_path)
-        video_name, video_extension = os.path.splitext(video_file)
-        extracted_frames_dir_path = os.path.join(video_dir, video_name , 
-                                                 "extracted_frames")
+    def execute_detection_2(self):
+        """
+        Executes touch detection on extracted frames located at frames_path using saved model instead of frozen graph
 
-        # sort extracted frames so detections occur in a predictable order
-        extracted_frames = glob.glob(os.path.join(extracted_frames_dir_path, '*'))
-        extracted_frames.sort()
+        Frames are fed to the model in batches of batch_size frames per call.
+        """
+        self.__execute_with_model(SavedTouchModel,
+                                  intra_op_threads=self.intra_op_threads,
+                                  inter_op_threads=self.inter_op_threads)
 
-        detection_output_path = os.path.join(video_dir, video_name, 
-                                             "detected_frames")
-        # verify detection out path exists
-        if not os.path.exists(detection_output_path):
-            os.mkdir(detection_output_path)
+    def execute_detection_tflite(self):
+        """
+        Executes touch detection on extracted frames located at frames_path
+        using a TFLite model, optionally int8-quantized, on tflite_threads
+        threads.
+        """
+        self.__execute_with_model(TFLiteTouchModel,
+                                  num_threads=self.tflite_threads)
 
-        
-        logging.info('Detecting touches for video: [{}]'.format(os.path.split(self.video_path)[1]))
+    def execute_detection_template(self):
+        """
+        Executes touch detection on extracted frames located at frames_path
+        by matching the touch indicator, of indicator_size pixels, without a
+        trained model.
+        """
+        self.__execute_with_model(TemplateTouchModel,
+                                  indicator_size=self.indicator_size)
 
-        config =tf.compat.v1.ConfigProto(inter_op_parallelism_threads=4,
-                            allow_soft_placement=True)
+    def execute_detection_hybrid(self):
+        """
+        Executes touch detection on extracted frames located at frames_path
+        by matching the touch indicator, passing only the frames where the
+        match is ambiguous to the frozen graph.
+        """
+        self.__execute_with_model(HybridTouchModel,
+                                  indicator_size=self.indicator_size,
+                                  neural_class=FrozenGraphTouchModel,
+                                  intra_op_threads=self.intra_op_threads,
+                                  inter_op_threads=self.inter_op_threads)
+
+    def __execute_with_model(self, model_class, **model_args):
+        """
+        Executes touch detection with the model at model_path. With more
+        than one shard, frames are split across processes. Frames are sent to
+        the inference server when one is set. Otherwise the model is taken
+        from the model service if one is set, or loaded for this detection
+        only.
 
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        **model_args
+            extra arguments passed to model_class
+        """
+        if self.coarse_step > 1:
+            self.__execute_coarse_to_fine(model_class, model_args)
+            return
+
+        if self.shards > 1:
+            sources = self.get_frame_source().split(self.shards)
+            if len(sources) > 1:
+                self.__execute_sharded(sources, model_class, model_args)
+                return
+            logging.info("Frame source cannot be split, detecting in one process")
+
+        if self.inference_server is None and self.model_service is not None:
+            model = self.model_service.get_model(model_class, self.model_path,
+                                                 **model_args)
+            self.__run_detection(model.infer)
+            return
+
+        if self.inference_server is not None:
+            model = RemoteTouchModel(self.inference_server)
+        else:
+            model = model_class(self.model_path, **model_args)
+        try:
+            self.__run_detection(model.infer)
+        finally:
+            model.close()
+
+    def __execute_coarse_to_fine(self, model_class, model_args):
+        """
+        Executes touch detection on every coarse_step-th frame, then on every
+        frame within coarse_step frames of a frame with touches. Any run of
+        touched frames at least coarse_step frames long contains a sampled
+        frame, so such runs are detected exactly as if every frame was.
+
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_args : dict
+            extra arguments passed to model_class
+        """
         start_detection_time = datetime.datetime.now().replace(microsecond=0)
+        step = self.coarse_step
+        source = self.get_frame_source()
+
+        coarse = self.__copy_for(source.sample(step))
+        fine = self.__copy_for(None)
+        service = None
+        if (self.model_service is None and self.inference_server is None
+                and self.shards == 1):
+            # load the model once for both passes
+            service = TouchModelService()
+            coarse.model_service = fine.model_service = service
+        try:
+            coarse.__execute_with_model(model_class, **model_args)
+
+            fine_ids = set()
+            for detection in coarse.get_touch_detections():
+                fine_ids.update(range(max(detection.get_id() - step + 1, 1),
+                                      detection.get_id() + step))
+            # sampled frames were already detected on
+            fine_ids = [frame_id for frame_id in sorted(fine_ids)
+                        if (frame_id - 1) % step != 0]
+            fine.frame_source = source.select(fine_ids)
+            if len(fine_ids) != 0:
+                fine.__execute_with_model(model_class, **model_args)
+        finally:
+            if service is not None:
+                service.close()
+
+        self.touch_detections = sorted(coarse.get_touch_detections()
+                                       + fine.get_touch_detections(),
+                                       key=lambda frame: frame.get_id())
+        logging.info("Coarse-to-fine detection ran on " +
+                     str(len(coarse.get_frame_source()) + len(fine_ids)) +
+                     " of " + str(len(source)) + " frames")
 
-        # begin a tf session to begin detecting touches
-        with detection_graph.as_default():
-            with tf.compat.v1.Session(graph=detection_graph, config=config) as sess:
-                for image_path in ProgressBar.display(extracted_frames, "Computing: ", 40):
-                    # print(image_path)
-                    # the array based representation of the image will be used later in order to prepare the
-                    # result image with boxes and labels on it.
-
-                    # change the method to load image into np array
-                    # image = Image.open(image_path)
-                    # image_np = ImageUtils.load_image_into_np_array(image)
-                    image_np = np.array(Image.open(image_path))
-
-                    # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-                    image_np_expanded = np.expand_dims(image_np, axis=0)
-                    image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-                    # Each box represents a part of the image where a particular object was detected.
-                    boxes = detection_graph.get_tensor_by_name('detection_boxes:0')
-                    # Each score represents how level of confidence for each of the objects.
-                    # Score is shown on the result image, together with the class label.
-                    scores = detection_graph.get_tensor_by_name('detection_scores:0')
-                    classes = detection_graph.get_tensor_by_name('detection_classes:0')
-                    num_detections = detection_graph.get_tensor_by_name('num_detections:0')
-                    # Actual detection.
-                    (boxes, scores, classes, num_detections) = sess.run(
-                        [boxes, scores, classes, num_detections],
-                        feed_dict={image_tensor: image_np_expanded})
-
-                    boxes = boxes[0]
-                    scores = scores[0]
-
-                    # add each detected tap to a Frame object
-                    base_name = ntpath.basename(image_path)
-                    base_name, file_extension = os.path.splitext(base_name)
-
-                    detection = Frame(int(base_name))
-                    (im_width, im_height) = image_np.shape[1], image_np.shape[0]
-                    for i in range(len(boxes)):
-                        box = boxes[i]
-                        score = scores[i]
-
-                        if score > 0.5:
-                            # Add detection box on the image data
-                            vis_util.visualize_boxes_and_labels_on_image_array(
-                                image_np,
-                                np.squeeze(boxes),
-                                np.squeeze(classes).astype(np.int32),
-                                np.squeeze(scores),
-                                category_index,
-                                use_normalized_coordinates=True,
-                                line_thickness=8)
-
-                            yMin = box[0] * im_height
-                            xMin = box[1] * im_width
-                            yMax = box[2] * im_height
-                            xMax = box[3] * im_width
-                            # calculate avg x-coord and avg y-coord
-                            # for tap
-                            x = xMin + ((xMax - xMin) / 2.0)
-                            y = yMin + ((yMax - yMin) / 2.0)
-                            detection.add_tap(ScreenTap(x, y, float(score)))
-
-                    if (len(detection.get_screen_taps()) > 0):
-                        self.touch_detections.append(detection)
-
-                    # place bbox images in "detected_frames" directory
-                    output_image_file = os.path.join(detection_output_path, 'bbox-' + base_name + file_extension)
-                    # print('Processing: ' + output_image_file, flush=True)
-                    # Don't remove, fixes weird error: https://stackoverflow.com/questions/19600147/sorl-thumbnail-encoder-error-2-when-writing-image-file/41018959#41018959
-                    ImageFile.MAXBLOCK = im_width * im_height
-                    ImageUtils.save_image_array_as_jpg(image_np,
-                                            os.path.join(detection_output_path, 'bbox-' + base_name + file_extension))
-
-            end_detection_time = datetime.datetime.now().replace(microsecond=0)
-            self.set_detection_time(end_detection_time - start_detection_time)
-            logging.info("Touch detection process took: " + str(self.detection_time))
+        end_detection_time = datetime.datetime.now().replace(microsecond=0)
+        self.set_detection_time(end_detection_time - start_detection_time)
+        logging.info("Touch detection process took: " + str(self.detection_time))
 
-    def execute_detection_2(self):
+    def __copy_for(self, source):
         """
-        Executes touch detection on extracted frames located at frames_path using saved model instead of frozen graph
+        Returns a copy of the detector detecting on another frame source,
+        with its own detections, frame gate and tracker.
+
+        Parameters
+        ----------
+        source : AbstractFrameSource
+            frame source of the copy
+
+        Returns
+        -------
+        detector : TouchDetectorFRCNN
+            copy of the detector
+        """
+        detector = copy.copy(self)
+        detector.touch_detections = []
+        detector.frame_source = source
+        detector.frame_gate = copy.deepcopy(self.frame_gate)
+        detector.last_detections = None
+        detector.tracker = copy.deepcopy(self.tracker)
+        detector.coarse_step = 1
+        # copies do not see the frames in order
+        detector.frame_listener = None
+        return detector
+
+    def __execute_sharded(self, sources, model_class, model_args):
         """
-        # set the default graph in tf to trained touch detection model
-        # detection_graph = tf.Graph()
-        # with detection_graph.as_default():
-        #     od_graph_def = tf.GraphDef()
-        #     with tf.gfile.Open(self.model_path, 'rb') as fid:
-        #         serialized_graph = fid.read()
-        #         od_graph_def.ParseFromString(serialized_graph)
-        #         tf.import_graph_def(od_graph_def, name='')
+        Executes touch detection on each frame source in its own process, each
+        loading its own model, and merges the detections in frame order.
+
+        Parameters
+        ----------
+        sources : list of AbstractFrameSources
+            consecutive runs of frames to detect on
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_args : dict
+            extra arguments passed to model_class
+        """
+        logging.info("Detecting touches in " + str(len(sources)) + " processes")
+        start_detection_time = datetime.datetime.now().replace(microsecond=0)
+
+        shards = []
+        for source in sources:
+            shard = self.__copy_for(source)
+            shard.shards = 1
+            # a loaded model cannot be shared with another process
+            shard.model_service = None
+            if shard.opacity_detector is not None:
+                shard.opacity_detector = copy.copy(shard.opacity_detector)
+                shard.opacity_detector.set_model_service(None)
+            shards.append(shard)
+
+        # tf does not survive a fork, so workers start from a fresh interpreter
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(len(shards), mp_context=context) as pool:
+            futures = [pool.submit(TouchDetectorFRCNN.detect_shard, shard,
+                                   model_class, model_args) for shard in shards]
+            results = [future.result() for future in futures]
+
+        self.touch_detections = []
+        skipped_frames = 0
+        for touch_detections, shard_skipped in results:
+            self.touch_detections.extend(touch_detections)
+            skipped_frames += shard_skipped
+        # shards are consecutive, but keep the merge independent of that
+        self.touch_detections.sort(key=lambda frame: frame.get_id())
+        if self.frame_gate is not None:
+            logging.info("Skipped inference on " + str(skipped_frames)
+                         + " static frames")
 
+        end_detection_time = datetime.datetime.now().replace(microsecond=0)
+        self.set_detection_time(end_detection_time - start_detection_time)
+        logging.info("Touch detection process took: " + str(self.detection_time))
+
+    @staticmethod
+    def detect_shard(detector, model_class, model_args):
+        """
+        Executes touch detection for one shard in a worker process.
+
+        Parameters
+        ----------
+        detector : TouchDetectorFRCNN
+            detector set up with the frame source of the shard
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_args : dict
+            extra arguments passed to model_class
+
+        Returns
+        -------
+        result : (list of Frames, int)
+            detections of the shard and number of static frames skipped
+        """
+        detector.__execute_with_model(model_class, **model_args)
+        skipped_frames = 0
+        if detector.frame_gate is not None:
+            skipped_frames = detector.frame_gate.get_skipped_frames()
+        return detector.get_touch_detections(), skipped_frames
+
+    @staticmethod
+    def get_auto_shards(cpu_count=None):
+        """
+        Returns shards and thread counts making use of every cpu, with
+        SHARD_THREADS intra-op threads per shard.
+
+        Parameters
+        ----------
+        cpu_count : int, optional
+            number of cpus; defaults to the cpus of this machine
+
+        Returns
+        -------
+        layout : (int, int, int)
+            shards, intra-op threads and inter-op threads per shard
+        """
+        if cpu_count is None:
+            cpu_count = os.cpu_count() or 1
+        shards = max(cpu_count // SHARD_THREADS, 1)
+        intra_op_threads = max(cpu_count // shards, 1)
+        return shards, intra_op_threads, min(INTER_OP_THREADS, intra_op_threads)
+
+    def __run_detection(self, infer):
+        """
+        Detects touches in every frame of the frame source and adds them to
+        touch detections.
+
+        Parameters
+        ----------
+        infer : callable
+            runs the model on an array of frames with shape
+            [batch_size, height, width, 3] and returns a (boxes, scores,
+            classes) tuple per frame
+        """
         # load and get information from labelmap
         label_map = load_labelmap(self.labelmap_path)
         categories = convert_label_map_to_categories(label_map,
-                                                     max_num_classes=self.num_classes, use_display_name=True)
+                     max_num_classes=self.num_classes, use_display_name=True)
         category_index = create_category_index(categories)
 
         video_dir, video_file = os.path.split(self.video_path)
         video_name, video_extension = os.path.splitext(video_file)
-        extracted_frames_dir_path = os.path.join(video_dir, video_name,
-                                                 "extracted_frames")
-
-        # sort extracted frames so detections occur in a predictable order
-        extracted_frames = glob.glob(os.path.join(extracted_frames_dir_path, '*'))
-        extracted_frames.sort()
+        frames = self.get_frame_source()
+        scale = frames.get_scale()
+        if self.checkpoint is not None:
+            frames = self.__resume(frames)
 
         detection_output_path = os.path.join(video_dir, video_name,
                                              "detected_frames")
-        # verify detection out path exists
-        if not os.path.exists(detection_output_path):
-            os.mkdir(detection_output_path)
+        # annotated frames are only written as debug artifacts
+        if self.debug_artifacts:
+            os.makedirs(detection_output_path, exist_ok=True)
 
         logging.info('Detecting touches for video: [{}]'.format(os.path.split(self.video_path)[1]))
 
-        # config = tf.ConfigProto(inter_op_parallelism_threads=4,
-        #                         allow_soft_placement=True)
-
         start_detection_time = datetime.datetime.now().replace(microsecond=0)
-
-        detect_fn = tf.saved_model.load(self.model_path)
-
-        # begin a tf session to begin detecting touches
-        # with detection_graph.as_default():
-        #     with tf.Session(graph=detection_graph, config=config) as sess:
-        for image_path in ProgressBar.display(extracted_frames, "Computing: ", 40):
-            # print(image_path)
-            # the array based representation of the image will be used later in order to prepare the
-            # result image with boxes and labels on it.
-
-            # change the method to load image into np array
-            # image = Image.open(image_path)
-            # image_np = ImageUtils.load_image_into_np_array(image)
-
-            image_np = np.array(Image.open(image_path))
-
-            # The input needs to be a tensor, convert it using `tf.convert_to_tensor`.
-            input_tensor = tf.convert_to_tensor(image_np)
-            # The model expects a batch of images, so add an axis with `tf.newaxis`.
-            input_tensor = input_tensor[tf.newaxis, ...]
-
-            # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-            input_tensor = np.expand_dims(image_np, axis=0)
-            # image_tensor = detection_graph.get_tensor_by_name('image_tensor:0')
-            # Each box represents a part of the image where a particular object was detected.
-
-            detections = detect_fn(input_tensor)
-
-            num_detections = int(detections.pop('num_detections'))
-            detections = {key: value[0, :num_detections].numpy()
-                          for key, value in detections.items()}
-            detections['num_detections'] = num_detections
-            detections['detection_classes'] = detections['detection_classes'].astype(np.int64)
-
-            boxes = detections['detection_boxes']
-            # Each score represents how level of confidence for each of the objects.
-            # Score is shown on the result image, together with the class label.
-            scores = detections['detection_scores']
-            classes = detections['detection_classes']
-            num_detections = int(detections.pop('num_detections'))
-
-            # num_detections = detection_graph.get_tensor_by_name('num_detections:0')
-            # Actual detection.
-            # (boxes, scores, classes, num_detections) = sess.run(
-            #     [boxes, scores, classes, num_detections],
-            #     feed_dict={image_tensor: image_np_expanded})
-
-            # boxes = boxes[0]
-            # scores = scores[0]
-
-            # add each detected tap to a Frame object
-            base_name = ntpath.basename(image_path)
-            base_name, file_extension = os.path.splitext(base_name)
-
-            detection = Frame(int(base_name))
-            (im_width, im_height) = image_np.shape[1], image_np.shape[0]
-            for i in range(len(boxes)):
-                box = boxes[i]
-                score = scores[i]
-
-                if score > 0.5:
-                    # Add detection box on the image data
-                    vis_util.visualize_boxes_and_labels_on_image_array(
-                        image_np,
-                        np.squeeze(boxes),
-                        np.squeeze(classes).astype(np.int32),
-                        np.squeeze(scores),
-                        category_index,
-                        use_normalized_coordinates=True,
-                        line_thickness=8)
-
-                    yMin = box[0] * im_height
-                    xMin = box[1] * im_width
-                    yMax = box[2] * im_height
-                    xMax = box[3] * im_width
-                    # calculate avg x-coord and avg y-coord
-                    # for tap
-                    x = xMin + ((xMax - xMin) / 2.0)
-                    y = yMin + ((yMax - yMin) / 2.0)
-                    detection.add_tap(ScreenTap(x, y, float(score)))
-
-            if (len(detection.get_screen_taps()) > 0):
-                self.touch_detections.append(detection)
-
-            # place bbox images in "detected_frames" directory
-            output_image_file = os.path.join(detection_output_path, 'bbox-' + base_name + file_extension)
-            # print('Processing: ' + output_image_file, flush=True)
-            # Don't remove, fixes weird error: https://stackoverflow.com/questions/19600147/sorl-thumbnail-encoder-error-2-when-writing-image-file/41018959#41018959
-            ImageFile.MAXBLOCK = im_width * im_height
-            ImageUtils.save_image_array_as_jpg(image_np,
-                                               os.path.join(detection_output_path,
-                                                            'bbox-' + base_name + file_extension))
+        if self.frame_gate is not None:
+            self.frame_gate.reset()
+        if self.tracker is not None:
+            self.tracker.reset()
+        if self.opacity_detector is not None:
+            # frames are passed on once their taps are scored
+            self.opacity_detector.start_stream(self.__frame_scored)
+
+        # frames are decoded ahead by the frame source while annotated
+        # frames are written by the writer pool, so inference never
+        # waits on disk
+        with BoundedThreadPool(self.write_workers, FRAME_QUEUE_SIZE) as writer:
+            for frame_id, image_np, (boxes, scores, classes) in self.__detect_frames(
+                        ProgressBar.display(frames, "Computing: ", 40), infer):
+                # boxes are normalized, so taps of downscaled frames are
+                # mapped back to device coordinates through the frame size
+                frame_shape = (image_np.shape[0] / scale, image_np.shape[1] / scale)
+                detection = self.__add_detection(frame_id, frame_shape,
+                                                 boxes, scores)
+                # crop the taps while the frame is decoded, rather than
+                # decoding it again for opacity detection
+                if self.opacity_detector is not None:
+                    self.opacity_detector.add_frame(detection, image_np, scale)
+                else:
+                    self.__frame_scored(detection)
+                # only frames with taps are worth annotating
+                if self.debug_artifacts and len(detection.get_screen_taps()) > 0:
+                    writer.submit(self.__write_detection_image, frame_id,
+                                  image_np, boxes, scores, classes,
+                                  category_index, detection_output_path)
+
+        if self.frame_gate is not None:
+            logging.info("Skipped inference on " + str(self.frame_gate.get_skipped_frames())
+                         + " of " + str(len(frames)) + " static frames")
+        if self.opacity_detector is not None:
+            self.opacity_detector.finish_stream()
+        if self.checkpoint is not None:
+            # resumed frames come first, keep detections in frame order
+            self.touch_detections.sort(key=lambda frame: frame.get_id())
+        if self.tracker is not None:
+            logging.info("Tracked touches without inference on "
+                         + str(self.tracker.get_tracked_frames()) + " of "
+                         + str(len(frames)) + " frames")
 
         end_detection_time = datetime.datetime.now().replace(microsecond=0)
         self.set_detection_time(end_detection_time - start_detection_time)
         logging.info("Touch detection process took: " + str(self.detection_time))
 
+    def __frame_scored(self, detection):
+        """
+        Logs a scored frame to the checkpoint and passes it to the frame
+        listener.
+
+        Parameters
+        ----------
+        detection : Frame
+            frame with the taps detected in it, if any
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.record(detection)
+        if self.frame_listener is not None:
+            self.frame_listener(detection)
+
+    def __resume(self, frames):
+        """
+        Adds the detections of the frames already in the checkpoint and
+        returns a source over the frames still to detect on.
+
+        Parameters
+        ----------
+        frames : AbstractFrameSource
+            frames to detect on
+
+        Returns
+        -------
+        frames : AbstractFrameSource
+            frames not in the checkpoint
+        """
+        scored = self.checkpoint.load()
+        frame_ids = frames.get_frame_ids()
+        resumed = [frame_id for frame_id in frame_ids if frame_id in scored]
+        if len(resumed) == 0:
+            return frames
+        for frame_id in resumed:
+            if len(scored[frame_id].get_screen_taps()) > 0:
+                self.touch_detections.append(scored[frame_id])
+            if self.frame_listener is not None:
+                self.frame_listener(scored[frame_id])
+        logging.info("Resumed " + str(len(resumed)) + " of " + str(len(frame_ids))
+                     + " frames from checkpoint")
+        return frames.select([frame_id for frame_id in frame_ids
+                              if frame_id not in scored])
+
+    def __detect_frames(self, frames, infer):
+        """
+        Runs the model on frames in batches of at most batch_size frames. A
+        batch is also cut short when the frame size changes, since images in
+        one batch must share a shape.
+
+        When a frame gate is set, static frames are not passed to the model
+        and reuse the detections of the last frame that was. When a tracker is
+        following taps, frames are tracked one at a time instead, and only
+        passed to the model when tracking is lost or a keyframe is due.
+
+        Parameters
+        ----------
+        frames : iterable of (int, np array)
+            frame ids and frames to detect on
+        infer : callable
+            runs the model on an array of frames
+
+        Returns
+        -------
+        detection : (int, np array, tuple)
+            generator of frame id, frame and (boxes, scores, classes), in
+            frame order
+        """
+        # frames waiting for the batch to run, with whether they are in it
+        pending = []
+        batch = []
+        for frame_id, image_np in frames:
+            inferred = (self.frame_gate is None or
+                        self.frame_gate.needs_inference(image_np))
+            # the batch is empty while following, since following only
+            # starts once a batch ran
+            if inferred and self.tracker is not None and self.tracker.is_following():
+                yield from self.__emit_batch(pending, batch, infer)
+                pending, batch = [], []
+                self.last_detections = self.tracker.track(image_np)
+                if self.last_detections is None:
+                    self.last_detections = infer(image_np[np.newaxis, ...])[0]
+                    self.tracker.update(image_np, self.last_detections)
+                yield frame_id, image_np, self.last_detections
+                continue
+            if inferred and len(batch) != 0 and batch[0].shape != image_np.shape:
+                yield from self.__emit_batch(pending, batch, infer)
+                pending, batch = [], []
+            pending.append((frame_id, image_np, inferred))
+            if inferred:
+                batch.append(image_np)
+            # static frames also wait for the batch, so bound them as well
+            if len(batch) >= self.batch_size or len(pending) >= FRAME_QUEUE_SIZE:
+                yield from self.__emit_batch(pending, batch, infer)
+                pending, batch = [], []
+        # take care of last batch
+        yield from self.__emit_batch(pending, batch, infer)
+
+    def __emit_batch(self, pending, batch, infer):
+        """
+        Runs the model on a batch and yields the detections of the pending
+        frames in order.
+
+        Parameters
+        ----------
+        pending : list of (int, np array, bool)
+            frame id, frame and whether the frame is in the batch
+        batch : list of np arrays
+            frames to pass to the model
+        infer : callable
+            runs the model on an array of frames
+        """
+        results = list(infer(np.stack(batch))) if len(batch) != 0 else []
+        # following starts from the last frame the model ran on, taken before
+        # the frame is passed on to be annotated
+        if self.tracker is not None and len(batch) != 0:
+            self.tracker.update(batch[-1], results[-1])
+        results = iter(results)
+        for frame_id, image_np, inferred in pending:
+            if inferred:
+                self.last_detections = next(results)
+            yield frame_id, image_np, self.last_detections
+
+    def __add_detection(self, frame_id, image_shape, boxes, scores):
+        """
+        Adds the taps detected in a frame to touch detections.
+
+        Parameters
+        ----------
+        frame_id : int
+            id of frame
+        image_shape : tuple
+            shape [height, width] of frame at device resolution
+        boxes : np array
+            normalized [yMin, xMin, yMax, xMax] boxes detected in frame
+        scores : np array
+            score of each box
+
+        Returns
+        -------
+        detection : Frame
+            frame with the detected taps
+        """
+        # add each detected tap to a Frame object
+        detection = Frame(frame_id)
+        (im_width, im_height) = image_shape[1], image_shape[0]
+        for i in range(len(boxes)):
+            box = boxes[i]
+            score = scores[i]
+
+            if score > TOUCH_SCORE_THRESHOLD:
+                yMin = box[0] * im_height
+                xMin = box[1] * im_width
+                yMax = box[2] * im_height
+                xMax = box[3] * im_width
+                # calculate avg x-coord and avg y-coord
+                # for tap
+                x = xMin + ((xMax - xMin) / 2.0)
+                y = yMin + ((yMax - yMin) / 2.0)
+                detection.add_tap(ScreenTap(float(x), float(y), float(score)))
+
+        if (len(detection.get_screen_taps()) > 0):
+            self.touch_detections.append(detection)
+        return detection
+
+    def __write_detection_image(self, frame_id, image_np, boxes, scores, classes,
+                                category_index, detection_output_path):
+        """
+        Places the frame with its bounding boxes in "detected_frames". Only
+        used for debug artifacts. Runs on the writer pool; draws on image_np,
+        which inference no longer uses.
+
+        Parameters
+        ----------
+        frame_id : int
+            id of frame
+        image_np : np array
+            frame with shape [height, width, 3]
+        boxes : np array
+            normalized [yMin, xMin, yMax, xMax] boxes detected in frame
+        scores : np array
+            score of each box
+        classes : np array
+            class of each box
+        category_index : dict
+            categories of labelmap
+        detection_output_path : string
+            path to "detected_frames" directory
+        """
+        # name output as the extracted frame would have been named
+        base_name, file_extension = "%04d" % frame_id, ".jpg"
+        (im_width, im_height) = image_np.shape[1], image_np.shape[0]
+        # the frame may still be read by the tracker or opacity detection
+        image_np = image_np.copy()
+
+        # Add detection boxes on the image data
+        vis_util.visualize_boxes_and_labels_on_image_array(
+            image_np,
+            np.squeeze(boxes),
+            np.squeeze(classes).astype(np.int32),
+            np.squeeze(scores),
+            category_index,
+            use_normalized_coordinates=True,
+            min_score_thresh=TOUCH_SCORE_THRESHOLD,
+            line_thickness=8)
+
+        # place bbox images in "detected_frames" directory
+        # Don't remove, fixes weird error: https://stackoverflow.com/questions/19600147/sorl-thumbnail-encoder-error-2-when-writing-image-file/41018959#41018959
+        ImageFile.MAXBLOCK = im_width * im_height
+        ImageUtils.save_image_array_as_jpg(image_np,
+                                os.path.join(detection_output_path, 'bbox-' + base_name + file_extension))
+
     def set_object_det_path(self, path):
         """
         Changes object_det_path to specified value.
@@ -480,6 +980,389 @@ class TouchDetectorFRCNN(AbstractTouchDetector):
         """
         return os.path(self.video_path, "extracted_frames")
 
+    def get_batch_size(self):
+        """
+        Returns batch size.
+
+        Returns
+        -------
+        batch_size : int
+            number of frames passed to the model at once
+        """
+        return self.batch_size
+
+    def set_batch_size(self, size):
+        """
+        Changes batch size to specified value.
+
+        Parameters
+        ----------
+        size : int
+            new number of frames passed to the model at once
+        """
+        self.batch_size = size
+
+    def is_debug_artifacts(self):
+        """
+        Returns whether annotated frames are written.
+
+        Returns
+        -------
+        debug_artifacts : bool
+            whether frames with detected taps are written to "detected_frames"
+        """
+        return self.debug_artifacts
+
+    def set_debug_artifacts(self, debug):
+        """
+        Changes whether annotated frames are written to specified value.
+
+        Parameters
+        ----------
+        debug : bool
+            new debug artifacts setting
+        """
+        self.debug_artifacts = debug
+
+    def get_write_workers(self):
+        """
+        Returns number of threads writing annotated frames.
+
+        Returns
+        -------
+        write_workers : int
+            number of threads writing annotated frames
+        """
+        return self.write_workers
+
+    def set_write_workers(self, workers):
+        """
+        Changes number of threads writing annotated frames to specified value.
+
+        Parameters
+        ----------
+        workers : int
+            new number of writing threads
+        """
+        self.write_workers = workers
+
+    def get_frame_source(self):
+        """
+        Returns the frame source detection runs on. Defaults to the frames
+        extracted to disk for the current video.
+
+        Returns
+        -------
+        frame_source : AbstractFrameSource
+            source of frames to detect on
+        """
+        if self.frame_source is not None:
+            return self.frame_source
+        video_dir, video_file = os.path.split(self.video_path)
+        video_name, video_extension = os.path.splitext(video_file)
+        return ExtractedFrameSource(os.path.join(video_dir, video_name,
+                                                 "extracted_frames"))
+
+    def get_coarse_step(self):
+        """
+        Returns the distance between frames of the coarse pass.
+
+        Returns
+        -------
+        coarse_step : int
+            distance between sampled frames; 1 if every frame is detected on
+        """
+        return self.coarse_step
+
+    def set_coarse_step(self, step):
+        """
+        Changes coarse step to specified value.
+
+        Parameters
+        ----------
+        step : int
+            new distance between sampled frames; 1 detects on every frame
+        """
+        self.coarse_step = step
+
+    def get_shards(self):
+        """
+        Returns number of detection processes.
+
+        Returns
+        -------
+        shards : int
+            number of processes frames are split across
+        """
+        return self.shards
+
+    def set_shards(self, shards):
+        """
+        Changes number of detection processes to specified value.
+
+        Parameters
+        ----------
+        shards : int
+            new number of processes; 1 detects in the current process
+        """
+        self.shards = shards
+
+    def get_intra_op_threads(self):
+        """
+        Returns number of threads running a single tf op.
+
+        Returns
+        -------
+        intra_op_threads : int
+            number of intra-op threads; 0 if tf decides
+        """
+        return self.intra_op_threads
+
+    def set_intra_op_threads(self, threads):
+        """
+        Changes number of intra-op threads to specified value.
+
+        Parameters
+        ----------
+        threads : int
+            new number of intra-op threads; 0 lets tf decide
+        """
+        self.intra_op_threads = threads
+
+    def get_inter_op_threads(self):
+        """
+        Returns number of tf ops run in parallel.
+
+        Returns
+        -------
+        inter_op_threads : int
+            number of inter-op threads; 0 if tf decides
+        """
+        return self.inter_op_threads
+
+    def set_inter_op_threads(self, threads):
+        """
+        Changes number of inter-op threads to specified value.
+
+        Parameters
+        ----------
+        threads : int
+            new number of inter-op threads; 0 lets tf decide
+        """
+        self.inter_op_threads = threads
+
+    def get_tflite_threads(self):
+        """
+        Returns number of threads running a TFLite model.
+
+        Returns
+        -------
+        tflite_threads : int
+            number of interpreter threads
+        """
+        return self.tflite_threads
+
+    def set_tflite_threads(self, threads):
+        """
+        Changes number of TFLite threads to specified value.
+
+        Parameters
+        ----------
+        threads : int
+            new number of interpreter threads
+        """
+        self.tflite_threads = threads
+
+    def get_indicator_size(self):
+        """
+        Returns the diameter of the touch indicator.
+
+        Returns
+        -------
+        indicator_size : float
+            diameter of the indicator, in pixels of the frames passed to the
+            model
+        """
+        return self.indicator_size
+
+    def set_indicator_size(self, size):
+        """
+        Changes indicator size to specified value.
+
+        Parameters
+        ----------
+        size : float
+            new diameter of the indicator, in pixels of the frames passed to
+            the model
+        """
+        self.indicator_size = size
+
+    def get_inference_server(self):
+        """
+        Returns the inference server address.
+
+        Returns
+        -------
+        inference_server : (string, int)
+            host and port of the server; None if disabled
+        """
+        return self.inference_server
+
+    def set_inference_server(self, address):
+        """
+        Changes inference server address to specified value.
+
+        Parameters
+        ----------
+        address : (string, int)
+            host and port of the server; None to run the model locally
+        """
+        self.inference_server = address
+
+    def get_model_service(self):
+        """
+        Returns the model service.
+
+        Returns
+        -------
+        model_service : TouchModelService
+            service keeping the model loaded; None if disabled
+        """
+        return self.model_service
+
+    def set_model_service(self, service):
+        """
+        Changes model service to specified value.
+
+        Parameters
+        ----------
+        service : TouchModelService
+            new model service; None to load the model for each detection
+        """
+        self.model_service = service
+
+    def get_frame_gate(self):
+        """
+        Returns the frame gate.
+
+        Returns
+        -------
+        frame_gate : FrameDifferenceGate
+            gate skipping inference on static frames; None if disabled
+        """
+        return self.frame_gate
+
+    def set_frame_gate(self, gate):
+        """
+        Changes frame gate to specified value.
+
+        Parameters
+        ----------
+        gate : FrameDifferenceGate
+            new frame gate; None to pass every frame to the model
+        """
+        self.frame_gate = gate
+
+    def get_opacity_detector(self):
+        """
+        Returns the opacity detector fused with touch detection.
+
+        Returns
+        -------
+        opacity_detector : OpacityDetectorALEXNET
+            detector scoring taps as they are detected; None if disabled
+        """
+        return self.opacity_detector
+
+    def set_opacity_detector(self, detector):
+        """
+        Changes opacity detector to specified value.
+
+        Parameters
+        ----------
+        detector : OpacityDetectorALEXNET
+            new opacity detector; None to leave the opacity of taps unset
+        """
+        self.opacity_detector = detector
+
+    def get_checkpoint(self):
+        """
+        Returns the detection checkpoint.
+
+        Returns
+        -------
+        checkpoint : DetectionCheckpoint
+            log of scored frames; None if disabled
+        """
+        return self.checkpoint
+
+    def set_checkpoint(self, checkpoint):
+        """
+        Changes detection checkpoint to specified value.
+
+        Parameters
+        ----------
+        checkpoint : DetectionCheckpoint
+            new checkpoint, prepared for the video; None to log nothing
+        """
+        self.checkpoint = checkpoint
+
+    def get_frame_listener(self):
+        """
+        Returns the frame listener.
+
+        Returns
+        -------
+        frame_listener : callable
+            called with every scored frame; None if not set
+        """
+        return self.frame_listener
+
+    def set_frame_listener(self, listener):
+        """
+        Changes frame listener to specified value.
+
+        Parameters
+        ----------
+        listener : callable
+            called with every scored frame in frame order; None to call
+            nothing
+        """
+        self.frame_listener = listener
+
+    def get_tracker(self):
+        """
+        Returns the touch tracker.
+
+        Returns
+        -------
+        tracker : TouchTracker
+            tracker following detected taps; None if disabled
+        """
+        return self.tracker
+
+    def set_tracker(self, tracker):
+        """
+        Changes touch tracker to specified value.
+
+        Parameters
+        ----------
+        tracker : TouchTracker
+            new touch tracker; None to pass every non-static frame to the model
+        """
+        self.tracker = tracker
+
+    def set_frame_source(self, source):
+        """
+        Changes frame source to specified value.
+
+        Parameters
+        ----------
+        source : AbstractFrameSource
+            new frame source; None to read extracted frames from disk
+        """
+        self.frame_source = source
+
     def get_touch_detections(self):
         """
         Returns touch detections.
@@ -0,0 +1,439 @@
+# touch_model.py
+import logging
+from abc import ABC, abstractmethod
+from threading import Lock
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from v2s.util.constants import INTER_OP_THREADS, INTRA_OP_THREADS, TFLITE_THREADS
+
+
+class AbstractTouchModel(ABC):
+    """
+    Trained touch detection model ready to run inference.
+
+    Attributes
+    ----------
+    process_wide_threads : bool
+        whether thread settings apply to the whole process and cannot change
+        once the model has run
+
+    Methods
+    -------
+    infer(images_np)
+        Runs the model on a batch of frames.
+    warm_up(image_shape)
+        Runs the model once so the first real batch does not pay for setup.
+    close()
+        Releases the resources held by the model.
+    """
+
+    process_wide_threads = False
+
+    @abstractmethod
+    def infer(self, images_np):
+        """
+        Runs the model on a batch of frames.
+
+        Parameters
+        ----------
+        images_np : np array
+            frames with shape [batch_size, height, width, 3]
+
+        Returns
+        -------
+        detections : list of (np array, np array, np array)
+            boxes, scores and classes detected in each frame
+        """
+        pass
+
+    def warm_up(self, image_shape):
+        """
+        Runs the model once so the first real batch does not pay for setup.
+
+        Parameters
+        ----------
+        image_shape : tuple
+            shape [height, width, 3] of the frames that will be detected on
+        """
+        self.infer(np.zeros((1,) + tuple(image_shape), dtype=np.uint8))
+
+    def close(self):
+        """
+        Releases the resources held by the model.
+        """
+        pass
+
+class FrozenGraphTouchModel(AbstractTouchModel):
+    """
+    Touch model loaded from a frozen graph, with a session kept open until the
+    model is closed.
+
+    Attributes
+    ----------
+    model_path : string
+        path to frozen graph
+    graph : tf Graph
+        graph of the model
+    session : tf Session
+        session running the graph
+    fetches : list of tf Tensors
+        output tensors of the graph
+    image_tensor : tf Tensor
+        input tensor of the graph
+    """
+
+    def __init__(self, model_path, intra_op_threads=INTRA_OP_THREADS,
+                 inter_op_threads=INTER_OP_THREADS):
+        """
+        Parameters
+        ----------
+        model_path : string
+            path to frozen graph
+        intra_op_threads : int, optional
+            threads running a single op; 0 lets tf decide
+        inter_op_threads : int, optional
+            ops run in parallel; 0 lets tf decide
+        """
+        self.model_path = model_path
+        # set the default graph in tf to trained touch detection model
+        self.graph = tf.compat.v1.Graph()
+        with self.graph.as_default():
+            od_graph_def = tf.compat.v1.GraphDef()
+            with tf.compat.v1.gfile.Open(model_path, 'rb') as fid:
+                serialized_graph = fid.read()
+                od_graph_def.ParseFromString(serialized_graph)
+                tf.compat.v1.import_graph_def(od_graph_def, name='')
+
+        config = tf.compat.v1.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads,
+            allow_soft_placement=True)
+        self.session = tf.compat.v1.Session(graph=self.graph, config=config)
+
+        # resolve the input and output tensors once for all batches
+        self.image_tensor = self.graph.get_tensor_by_name('image_tensor:0')
+        # Each box represents a part of the image where a particular object was detected.
+        boxes = self.graph.get_tensor_by_name('detection_boxes:0')
+        # Each score represents how level of confidence for each of the objects.
+        # Score is shown on the result image, together with the class label.
+        scores = self.graph.get_tensor_by_name('detection_scores:0')
+        classes = self.graph.get_tensor_by_name('detection_classes:0')
+        num_detections = self.graph.get_tensor_by_name('num_detections:0')
+        self.fetches = [boxes, scores, classes, num_detections]
+
+    def infer(self, images_np):
+        # Actual detection.
+        (batch_boxes, batch_scores, batch_classes, batch_num) = self.session.run(
+            self.fetches, feed_dict={self.image_tensor: images_np})
+        return [(batch_boxes[i], batch_scores[i], batch_classes[i])
+                for i in range(len(images_np))]
+
+    def close(self):
+        self.session.close()
+
+class SavedTouchModel(AbstractTouchModel):
+    """
+    Touch model loaded from a saved model directory.
+
+    Attributes
+    ----------
+    model_path : string
+        path to saved model directory
+    detect_fn : callable
+        loaded model
+    """
+
+    process_wide_threads = True
+
+    def __init__(self, model_path, intra_op_threads=INTRA_OP_THREADS,
+                 inter_op_threads=INTER_OP_THREADS):
+        """
+        Parameters
+        ----------
+        model_path : string
+            path to saved model directory
+        intra_op_threads : int, optional
+            threads running a single op; 0 lets tf decide
+        inter_op_threads : int, optional
+            ops run in parallel; 0 lets tf decide
+        """
+        self.model_path = model_path
+        # eager thread pools are per process and fixed once tf started
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        except RuntimeError:
+            logging.warning("TF already initialized, keeping its thread pools")
+        self.detect_fn = tf.saved_model.load(model_path)
+
+    def infer(self, images_np):
+        detections = self.detect_fn(tf.convert_to_tensor(images_np))
+
+        batch_num = detections['num_detections'].numpy().astype(np.int32)
+        batch_boxes = detections['detection_boxes'].numpy()
+        # Each score represents how level of confidence for each of the objects.
+        # Score is shown on the result image, together with the class label.
+        batch_scores = detections['detection_scores'].numpy()
+        batch_classes = detections['detection_classes'].numpy().astype(np.int64)
+        return [(batch_boxes[i, :num], batch_scores[i, :num], batch_classes[i, :num])
+                for i, num in enumerate(batch_num)]
+
+class TFLiteTouchModel(AbstractTouchModel):
+    """
+    Touch model converted to TFLite, optionally int8-quantized, run by the
+    TFLite interpreter on the CPU. Frames are resized to the input size of the
+    model; boxes are normalized so detections keep device coordinates.
+
+    Attributes
+    ----------
+    model_path : string
+        path to ".tflite" model
+    interpreter : tf Interpreter
+        interpreter running the model
+    runner : callable
+        signature runner of the model; None if the model has no signature
+    input_name : string
+        name of the signature input
+    input_details : dict
+        details of the input tensor
+    output_indices : dict of string:int
+        index of the boxes, classes, scores and count output tensors, used
+        without a signature
+    """
+
+    def __init__(self, model_path, num_threads=TFLITE_THREADS):
+        """
+        Parameters
+        ----------
+        model_path : string
+            path to ".tflite" model
+        num_threads : int, optional
+            number of threads used by the interpreter
+        """
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path,
+                                               num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+        # models exported by the TF2 object detection API name their outputs
+        # through a signature, older ones only through their tensor names;
+        # older interpreters cannot run signatures
+        self.runner = None
+        self.input_name = None
+        self.output_indices = None
+        signatures = {}
+        if (hasattr(self.interpreter, "get_signature_list") and
+                hasattr(self.interpreter, "get_signature_runner")):
+            signatures = self.interpreter.get_signature_list()
+        if len(signatures) != 0:
+            self.runner = self.interpreter.get_signature_runner()
+            self.input_name = list(signatures.values())[0]['inputs'][0]
+        else:
+            self.output_indices = self.__get_output_indices(self.interpreter.get_output_details())
+
+    def infer(self, images_np):
+        # the detection post-processing op only supports one image at a time
+        return [self.__infer_image(image_np) for image_np in images_np]
+
+    def __infer_image(self, image_np):
+        """
+        Runs the model on one frame.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        detection : (np array, np array, np array)
+            boxes, scores and classes detected in the frame
+        """
+        input_tensor = self.__prepare_input(image_np)
+        # TFLite classes start at 0 while the labelmap starts at 1
+        if self.runner is not None:
+            outputs = self.runner(**{self.input_name: input_tensor})
+            num = int(outputs['num_detections'][0])
+            return (outputs['detection_boxes'][0, :num],
+                    outputs['detection_scores'][0, :num],
+                    outputs['detection_classes'][0, :num].astype(np.int64) + 1)
+
+        self.interpreter.set_tensor(self.input_details['index'], input_tensor)
+        self.interpreter.invoke()
+        (boxes, classes, scores, count) = [
+            self.interpreter.get_tensor(self.output_indices[output])
+            for output in ("boxes", "classes", "scores", "count")]
+        num = int(np.ravel(count)[0])
+        return (boxes[0, :num], scores[0, :num],
+                classes[0, :num].astype(np.int64) + 1)
+
+    @staticmethod
+    def __get_output_indices(output_details):
+        """
+        Returns the index of the boxes, classes, scores and count output
+        tensors of a model without a signature, whose outputs may come in any
+        order. Outputs are told apart by name, then boxes and count by shape.
+
+        Parameters
+        ----------
+        output_details : list of dicts
+            details of the output tensors
+
+        Returns
+        -------
+        output_indices : dict of string:int
+            tensor index of each output
+
+        Raises
+        ------
+        ValueError
+            if the outputs cannot be told apart
+        """
+        output_indices = {}
+        for output in output_details:
+            name = output['name'].lower()
+            for key, words in (("boxes", ("boxes",)), ("classes", ("classes",)),
+                               ("scores", ("scores",)), ("count", ("num_detections", "count"))):
+                if any(word in name for word in words):
+                    output_indices.setdefault(key, output['index'])
+        # TFLite_Detection_PostProcess names its outputs by position: boxes,
+        # classes, scores and count
+        postprocess = {}
+        for output in output_details:
+            op_name, _, position = output['name'].partition(':')
+            if op_name == 'TFLite_Detection_PostProcess':
+                postprocess[int(position or 0)] = output['index']
+        if sorted(postprocess) == [0, 1, 2, 3]:
+            for position, key in enumerate(("boxes", "classes", "scores", "count")):
+                output_indices.setdefault(key, postprocess[position])
+        for output in output_details:
+            shape = list(output['shape'])
+            if len(shape) == 3 and shape[-1] == 4:
+                output_indices.setdefault("boxes", output['index'])
+            elif int(np.prod(shape)) == 1:
+                output_indices.setdefault("count", output['index'])
+        if len(output_indices) != 4 or len(set(output_indices.values())) != 4:
+            raise ValueError("Cannot tell the detection outputs apart: " +
+                             str([output['name'] for output in output_details]))
+        return output_indices
+
+    def __prepare_input(self, image_np):
+        """
+        Resizes a frame to the model input and converts it to the input type,
+        quantizing it for int8 models.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        input_tensor : np array
+            frame with shape [1, input height, input width, 3]
+        """
+        (height, width) = self.input_details['shape'][1:3]
+        image = Image.fromarray(image_np).resize((width, height), Image.BILINEAR)
+        # SSD models expect pixels in [-1, 1]
+        normalized = (np.asarray(image, dtype=np.float32) - 127.5) / 127.5
+
+        dtype = self.input_details['dtype']
+        if dtype == np.float32:
+            input_np = normalized
+        else:
+            scale, zero_point = self.input_details['quantization']
+            if scale == 0:
+                input_np = np.asarray(image).astype(dtype)
+            else:
+                info = np.iinfo(dtype)
+                input_np = np.clip(np.round(normalized / scale + zero_point),
+                                   info.min, info.max).astype(dtype)
+        return input_np[np.newaxis, ...]
+
+class TouchModelService():
+    """
+    Keeps touch models, and the opacity model, loaded so that detections run
+    by the same process reuse them instead of loading the model again for
+    every video.
+
+    A worker process should share one service, see get_instance().
+
+    Attributes
+    ----------
+    models : dict
+        loaded models by (model class, model path, model arguments)
+    lock : Lock
+        guards models while a model is loading
+
+    Methods
+    -------
+    get_instance()
+        Returns the service shared by the current process.
+    get_model(model_class, model_path, warm_up_shape=None, **model_args)
+        Returns the loaded model, loading it on first use.
+    close()
+        Closes all loaded models.
+    """
+
+    instance = None
+
+    def __init__(self):
+        self.models = {}
+        self.lock = Lock()
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns the service shared by the current process.
+
+        Returns
+        -------
+        service : TouchModelService
+            service of the current process
+        """
+        if cls.instance is None:
+            cls.instance = TouchModelService()
+        return cls.instance
+
+    def get_model(self, model_class, model_path, warm_up_shape=None,
+                  **model_args):
+        """
+        Returns the loaded model, loading it on first use.
+
+        Parameters
+        ----------
+        model_class : class
+            AbstractTouchModel subclass able to load the model
+        model_path : string
+            path to the model
+        warm_up_shape : tuple, optional
+            if set, a newly loaded model is run once on a frame of this shape
+        **model_args
+            extra arguments passed to model_class, e.g. num_threads
+
+        Returns
+        -------
+        model : AbstractTouchModel
+            loaded model
+        """
+        key = (model_class, model_path, tuple(sorted(model_args.items())))
+        with self.lock:
+            if key not in self.models:
+                logging.info("Loading touch model: " + model_path)
+                model = model_class(model_path, **model_args)
+                if warm_up_shape is not None:
+                    model.warm_up(warm_up_shape)
+                self.models[key] = model
+            return self.models[key]
+
+    def close(self):
+        """
+        Closes all loaded models.
+        """
+        with self.lock:
+            for model in self.models.values():
+                model.close()
+            self.models = {}
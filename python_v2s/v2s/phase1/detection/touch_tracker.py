@@ -0,0 +1,208 @@
+# touch_tracker.py
+import numpy as np
+
+from v2s.util.constants import (TOUCH_SCORE_THRESHOLD, TRACK_DOWNSAMPLE,
+                                TRACK_KEYFRAME_INTERVAL, TRACK_MIN_CORRELATION,
+                                TRACK_SEARCH_RADIUS)
+from v2s.util.general import ImageUtils
+
+
+class TouchTracker():
+    """
+    Follows the touch indicators found by the model into the next frames,
+    so that frames of long clicks and swipes need no full-frame inference.
+
+    When the model finds taps in a frame, the patch under each tap becomes a
+    template. In the following frames each template is searched by normalized
+    cross-correlation within search_radius pixels of its last position, on
+    frames downsampled by TRACK_DOWNSAMPLE. Tracking gives up, so the model
+    runs again, when any template matches worse than min_correlation or every
+    keyframe_interval frames.
+
+    Attributes
+    ----------
+    search_radius : int
+        largest move, in pixels, of an indicator between two frames
+    min_correlation : float
+        lowest correlation a template may match with
+    keyframe_interval : int
+        frames tracked at most before the model runs again
+    taps : list of dicts
+        template, position, box size and score of each followed tap
+    frames_tracked : int
+        frames tracked since the model last ran
+    tracked_frames : int
+        number of frames tracked instead of inferred
+
+    Methods
+    -------
+    is_following()
+        Returns whether taps are followed and a tracking attempt is due.
+    update(image_np, detection)
+        Starts following the taps the model detected in a frame.
+    track(image_np)
+        Returns the followed taps found in a frame, or None if lost.
+    reset()
+        Stops following taps and resets the tracked count.
+    __find_tap(gray, tap)
+        Returns the best match of a tap's template near its last position.
+    get_tracked_frames()
+        Returns number of frames tracked instead of inferred.
+    """
+
+    def __init__(self, search_radius=TRACK_SEARCH_RADIUS,
+                 min_correlation=TRACK_MIN_CORRELATION,
+                 keyframe_interval=TRACK_KEYFRAME_INTERVAL):
+        """
+        Parameters
+        ----------
+        search_radius : int, optional
+            largest move, in pixels, of an indicator between two frames
+        min_correlation : float, optional
+            lowest correlation a template may match with
+        keyframe_interval : int, optional
+            frames tracked at most before the model runs again
+        """
+        self.search_radius = search_radius
+        self.min_correlation = min_correlation
+        self.keyframe_interval = keyframe_interval
+        self.taps = []
+        self.frames_tracked = 0
+        self.tracked_frames = 0
+
+    def is_following(self):
+        """
+        Returns whether taps are followed and a tracking attempt is due.
+
+        Returns
+        -------
+        bool : bool
+            False if there is nothing to follow or a keyframe is due
+        """
+        return len(self.taps) != 0 and self.frames_tracked < self.keyframe_interval
+
+    def update(self, image_np, detection):
+        """
+        Starts following the taps the model detected in a frame, replacing
+        any followed before.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+        detection : (np array, np array, np array)
+            normalized boxes, scores and classes detected in the frame
+        """
+        boxes, scores, classes = detection
+        (height, width) = image_np.shape[:2]
+        gray = ImageUtils.to_gray(image_np, TRACK_DOWNSAMPLE)
+        self.taps = []
+        self.frames_tracked = 0
+        for box, score, category in zip(boxes, scores, classes):
+            if score <= TOUCH_SCORE_THRESHOLD:
+                continue
+            # template of the indicator box, in downsampled pixels
+            top = int(box[0] * height) // TRACK_DOWNSAMPLE
+            left = int(box[1] * width) // TRACK_DOWNSAMPLE
+            bottom = -(-int(box[2] * height) // TRACK_DOWNSAMPLE)
+            right = -(-int(box[3] * width) // TRACK_DOWNSAMPLE)
+            (top, left) = (max(top, 0), max(left, 0))
+            template = gray[top:bottom, left:right]
+            if template.shape[0] < 2 or template.shape[1] < 2:
+                # too small to match reliably, let the model follow it
+                self.taps = []
+                return
+            # box relative to the template, so moving the template moves it
+            origin = np.array([top * TRACK_DOWNSAMPLE / height,
+                               left * TRACK_DOWNSAMPLE / width] * 2)
+            self.taps.append({"template": template, "top": top, "left": left,
+                              "box": box - origin, "score": score,
+                              "class": category})
+
+    def track(self, image_np):
+        """
+        Returns the followed taps found in a frame, or None if any was lost.
+
+        Parameters
+        ----------
+        image_np : np array
+            frame with shape [height, width, 3]
+
+        Returns
+        -------
+        detection : (np array, np array, np array)
+            normalized boxes, scores and classes of the followed taps; None
+            if the model has to run on the frame
+        """
+        (height, width) = image_np.shape[:2]
+        gray = ImageUtils.to_gray(image_np, TRACK_DOWNSAMPLE)
+        found = []
+        for tap in self.taps:
+            match = self.__find_tap(gray, tap)
+            if match is None:
+                return None
+            found.append(match)
+
+        boxes, scores, classes = [], [], []
+        for tap, (top, left) in zip(self.taps, found):
+            tap["top"], tap["left"] = top, left
+            # boxes keep the size detected by the model
+            origin = np.array([top * TRACK_DOWNSAMPLE / height,
+                               left * TRACK_DOWNSAMPLE / width] * 2)
+            boxes.append(origin + tap["box"])
+            # tracked taps keep the confidence of the detection they follow
+            scores.append(tap["score"])
+            classes.append(tap["class"])
+        self.frames_tracked += 1
+        self.tracked_frames += 1
+        return np.array(boxes), np.array(scores), np.array(classes)
+
+    def reset(self):
+        """
+        Stops following taps and resets the tracked count.
+        """
+        self.taps = []
+        self.frames_tracked = 0
+        self.tracked_frames = 0
+
+    def __find_tap(self, gray, tap):
+        """
+        Returns the best match of a tap's template near its last position.
+
+        Parameters
+        ----------
+        gray : np array
+            downsampled grayscale frame
+        tap : dict
+            followed tap
+
+        Returns
+        -------
+        position : (int, int)
+            top and left of the match, in downsampled pixels; None if the
+            match is worse than min_correlation
+        """
+        radius = max(self.search_radius // TRACK_DOWNSAMPLE, 1)
+        (template_height, template_width) = tap["template"].shape
+        top = max(tap["top"] - radius, 0)
+        left = max(tap["left"] - radius, 0)
+        window = gray[top:tap["top"] + template_height + radius,
+                      left:tap["left"] + template_width + radius]
+        if window.shape[0] < template_height or window.shape[1] < template_width:
+            return None
+        scores = ImageUtils.match_template(window, tap["template"])
+        best = np.unravel_index(np.argmax(scores), scores.shape)
+        if scores[best] < self.min_correlation:
+            return None
+        return top + int(best[0]), left + int(best[1])
+
+    def get_tracked_frames(self):
+        """
+        Returns number of frames tracked instead of inferred.
+
+        Returns
+        -------
+        tracked_frames : int
+            number of tracked frames
+        """
+        return self.tracked_frames
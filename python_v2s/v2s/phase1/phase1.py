@@ -4,11 +4,26 @@ import logging
 import os
 import sys
 
-import numpy as np
 from v2s.phase import AbstractPhase
+from v2s.phase1.detection.detection_checkpoint import DetectionCheckpoint
+from v2s.phase1.detection.frame_gating import FrameDifferenceGate
 from v2s.phase1.detection.opacity_detection import OpacityDetectorALEXNET
 from v2s.phase1.detection.touch_detection import TouchDetectorFRCNN
+from v2s.phase1.detection.thread_tuner import ThreadTuner
+from v2s.phase1.detection.touch_model import (FrozenGraphTouchModel,
+                                             SavedTouchModel,
+                                             TouchModelService)
+from v2s.phase1.detection.touch_tracker import TouchTracker
+from v2s.phase1.video_manipulation.frame_source import AbstractFrameSource
 from v2s.phase1.video_manipulation.video_manipulation import FrameExtractor
+from v2s.util.constants import (COARSE_STEP, DECODE_WORKERS,
+                                DETECTION_BATCH_SIZE, INFERENCE_SCALE,
+                                INTER_OP_THREADS, INTRA_OP_THREADS,
+                                STATIC_FRAME_BLOCK, STATIC_FRAME_THRESHOLD,
+                                TFLITE_THREADS, TRACK_KEYFRAME_INTERVAL,
+                                TRACK_MIN_CORRELATION, TRACK_SEARCH_RADIUS,
+                                WRITE_WORKERS)
+from v2s.util.detection_table import DetectionTable
 from v2s.util.general import JSONFileUtils
 
 CURRPATH = os.getcwd().strip('flask_application') + 'python_v2s/v2s/'
@@ -30,19 +45,32 @@ class Phase1V2S(AbstractPhase):
         frame extractor for video
     detections : list of Frames
         output of phase
+    frame_listener : callable
+        called with each detected frame in frame order, as soon as it is
+        detected when detection runs through the frames in order, otherwise
+        with the frames with taps once detection ended. Taps only hold their
+        opacity confidence when it is fused with touch detection or given
+        after detection. If None, nothing is called
     
     Methods
     -------
     execute()
         Executes phase. Takes in video and ouputs touch detections with
         opacity confidence.
-    add_opacity_to_detections()
-        Adds the opacity predictions output by the opacity detector to the frames
-        that will be output to a json file.
+    get_frame_shape(config)
+        Returns the shape of the frames passed to the touch model.
+    get_indicator_size(config)
+        Returns the diameter of the touch indicator in those frames.
+    get_output()
+        Returns detections, handed to the next phase.
     get_detections()
         Returns detections of phase 1.
     set_detections(list)
         Changes detections to specified value.
+    get_frame_listener()
+        Returns the frame listener.
+    set_frame_listener(listener)
+        Changes frame listener to specified value.
     """
 
     def __init__(self, config):
@@ -58,6 +86,7 @@ class Phase1V2S(AbstractPhase):
         # frames will be set later
         self.opacity_detector = OpacityDetectorALEXNET(None)
         self.detections = []
+        self.frame_listener = None
     
     def execute(self):
         """
@@ -80,6 +109,9 @@ class Phase1V2S(AbstractPhase):
 
          # 1) Execute frame extraction      
         self.frame_extractor.set_video_path(cur_path)
+        # "stream" pipes frames from ffmpeg instead of extracting them to disk
+        self.frame_extractor.set_stream(self.config.get("frame_source") == "stream")
+        self.frame_extractor.set_decode_workers(self.config.get("decode_workers", DECODE_WORKERS))
         self.frame_extractor.execute()
 
         # 2) Execute touch detection
@@ -89,98 +121,203 @@ class Phase1V2S(AbstractPhase):
         self.touch_detector.set_model_path(touch_model)
         labelmap = CURRPATH + self.config["labelmap"]
         self.touch_detector.set_labelmap_path(labelmap)
-        self.touch_detector.execute_detection()
-        # incomplete detections - without opacity information
+        # "frozen_graph" (default), "saved_model", "tflite", "template" or
+        # "hybrid"; "template" matches the touch indicator without a model,
+        # "hybrid" only runs the frozen graph where the match is ambiguous
+        touch_backend = self.config.get("touch_backend", "frozen_graph")
+        # "host:port" of a shared inference server running the model; the
+        # template and hybrid detectors run in the current process
+        if self.config.get("inference_server") and touch_backend not in ("template", "hybrid"):
+            host, port = self.config["inference_server"].rsplit(":", 1)
+            self.touch_detector.set_inference_server((host, int(port)))
+        else:
+            self.touch_detector.set_inference_server(None)
+        # long-lived workers keep the model loaded between videos
+        if self.config.get("persistent_model", False):
+            self.touch_detector.set_model_service(TouchModelService.get_instance())
+        else:
+            self.touch_detector.set_model_service(None)
+        # frames may be downscaled before inference; taps keep device coordinates
+        frame_source = self.frame_extractor.get_frame_source(
+            self.config.get("inference_scale", INFERENCE_SCALE))
+        self.touch_detector.set_frame_source(frame_source)
+        self.touch_detector.set_write_workers(self.config.get("write_workers", WRITE_WORKERS))
+        # annotated "detected_frames" are only written when debugging
+        self.touch_detector.set_debug_artifacts(self.config.get("debug_artifacts", False))
+        # static frames reuse the detections of the last changed frame
+        if self.config.get("skip_static_frames", False):
+            self.touch_detector.set_frame_gate(FrameDifferenceGate(
+                self.config.get("static_frame_threshold", STATIC_FRAME_THRESHOLD),
+                self.config.get("static_frame_block", STATIC_FRAME_BLOCK)))
+        else:
+            self.touch_detector.set_frame_gate(None)
+        # follow detected touches by template matching between keyframes
+        if self.config.get("track_touches", False):
+            self.touch_detector.set_tracker(TouchTracker(
+                self.config.get("track_search_radius", TRACK_SEARCH_RADIUS),
+                self.config.get("track_min_correlation", TRACK_MIN_CORRELATION),
+                self.config.get("track_keyframe_interval", TRACK_KEYFRAME_INTERVAL)))
+        else:
+            self.touch_detector.set_tracker(None)
+        # search touches on sampled frames first, then only around touches
+        if self.config.get("coarse_to_fine", False):
+            self.touch_detector.set_coarse_step(self.config.get("coarse_step", COARSE_STEP))
+        else:
+            self.touch_detector.set_coarse_step(1)
+        # split frames across processes; "auto" derives the layout from the cpus
+        shards = self.config.get("shards", 1)
+        settings = {"intra_op_threads": INTRA_OP_THREADS,
+                    "inter_op_threads": INTER_OP_THREADS,
+                    "batch_size": DETECTION_BATCH_SIZE}
+        if shards == "auto":
+            shards, settings["intra_op_threads"], settings["inter_op_threads"] = \
+                TouchDetectorFRCNN.get_auto_shards()
+        elif self.config.get("autotune_threads", False) and touch_backend in ("frozen_graph", "saved_model"):
+            # fastest settings of this machine, measured once on a few frames
+            # of this video and cached
+            model_class = SavedTouchModel if touch_backend == "saved_model" else FrozenGraphTouchModel
+            settings = ThreadTuner(model_class, touch_model).get_settings(
+                self.get_frame_shape(self.config), frame_source)
+        self.touch_detector.set_shards(shards)
+        self.touch_detector.set_intra_op_threads(self.config.get("intra_op_threads", settings["intra_op_threads"]))
+        self.touch_detector.set_inter_op_threads(self.config.get("inter_op_threads", settings["inter_op_threads"]))
+        self.touch_detector.set_batch_size(self.config.get("batch_size", settings["batch_size"]))
+        # opacity is detected on the crops of each tap, cut from the decoded
+        # frames with the model kept loaded when the model is persistent
+        detect_opacity = bool(self.config.get("opacity_model")) and self.config.get("detect_opacity", True)
+        if detect_opacity:
+            opacity_model = CURRPATH + self.config["opacity_model"]
+            self.opacity_detector.set_video_path(cur_path)
+            self.opacity_detector.set_model_path(opacity_model)
+            self.opacity_detector.set_model_service(self.touch_detector.get_model_service())
+            # get the touch indicator size, in device pixels
+            touch_indicator = self.get_indicator_size(dict(self.config, inference_scale=1.0))
+            self.opacity_detector.set_indicator_size(round(touch_indicator*0.8))
+        # scored frames are logged as they go, so a crashed detection of the
+        # same video resumes where it stopped
+        checkpoint = None
+        if self.config.get("checkpoint", False):
+            checkpoint = DetectionCheckpoint(os.path.join(cur_dir_path, "detection_checkpoint.jsonl"), cur_path)
+            checkpoint.prepare()
+        self.touch_detector.set_checkpoint(checkpoint)
+        # fused opacity detection crops taps during touch detection instead
+        # of decoding the frames with touches a second time
+        fuse_opacity = detect_opacity and self.config.get("fuse_opacity", False)
+        self.touch_detector.set_opacity_detector(self.opacity_detector if fuse_opacity else None)
+        # frames are streamed to the listener while detected, so actions can
+        # be classified before the video is done, unless detected out of order
+        # or their opacity is only scored once detection ended
+        stream_frames = (self.frame_listener is not None and
+                         self.touch_detector.get_coarse_step() == 1 and
+                         self.touch_detector.get_shards() == 1 and
+                         (fuse_opacity or not detect_opacity))
+        self.touch_detector.set_frame_listener(self.frame_listener if stream_frames else None)
+        if touch_backend == "tflite":
+            self.touch_detector.set_tflite_threads(self.config.get("tflite_threads", TFLITE_THREADS))
+            self.touch_detector.execute_detection_tflite()
+        elif touch_backend == "saved_model":
+            self.touch_detector.execute_detection_2()
+        elif touch_backend in ("template", "hybrid"):
+            # the indicator is drawn at a fixed size on each device
+            self.touch_detector.set_indicator_size(self.get_indicator_size(self.config))
+            if touch_backend == "template":
+                self.touch_detector.execute_detection_template()
+            else:
+                self.touch_detector.execute_detection_hybrid()
+        else:
+            self.touch_detector.execute_detection()
+        # incomplete detections - without opacity information unless fused
         incomplete_detections = self.touch_detector.get_touch_detections()
 
-        JSONFileUtils.output_data_to_json(incomplete_detections, os.path.join(cur_dir_path, "incomplete_detections.json"))
-
-        # # 3) Execute opacity detection
-        # # get the proper opacity model
-        # opacity_model = CURRPATH + self.config["opacity_model"]
-
-        # self.opacity_detector.set_video_path(cur_path)
-        # self.opacity_detector.set_model_path(opacity_model)
-        # self.opacity_detector.set_frames(incomplete_detections)
-        # # get the touch indicator size
-        # device_model = self.config["device_model"]
-        # device_path = CURRPATH + 'device_config.json'
-        # # device_path = "/Users/em.ily/Documents/GitHub/video2scenario/python_v2s/v2s/device_config.json"
-        # device_file = open(device_path, 'r') 
-        # device_specs = json.load(device_file)[device_model]
-        # touch_indicator = device_specs["indicator_size"]
-        # self.opacity_detector.set_indicator_size(round(touch_indicator*0.8))
-        # self.opacity_detector.execute_detection()
-        # predictions = self.opacity_detector.get_opacity_predictions()
-        # self.detections = self.add_opacity_to_detections(predictions, 
-        #                                                  incomplete_detections,
-        #                                                  cur_path)
-
-        # # 4) Write these detections to json file
-        # # navigate to file pertaining to video being analyzed
-        # json_path = os.path.join(cur_dir_path, "detection_full.json")
-        # JSONFileUtils.output_data_to_json(self.detections, json_path)
-
-    def add_opacity_to_detections(self, predictions, incomplete, cur_vid):
-        """
-        Adds the opacity predictions output by the opacity detector to the frames
-        that will be output to a json file.
+        # detections are handed to the next phase in memory; the files are a
+        # side output, skipped if disabled, saved as columns along with the
+        # json export written in the background, unless disabled
+        write_artifacts = self.config.get("write_artifacts", True)
+        export_json = write_artifacts and self.config.get("export_json", True)
+        if write_artifacts:
+            DetectionTable.from_frames(incomplete_detections).save(os.path.join(cur_dir_path, "incomplete_detections.npy"))
+        if export_json:
+            JSONFileUtils.output_data_to_json_async(incomplete_detections, os.path.join(cur_dir_path, "incomplete_detections.json"))
+        if checkpoint is not None:
+            checkpoint.remove()
+
+        # 3) Execute opacity detection, unless fused with touch detection;
+        # frames resumed from a checkpoint may still lack it when fused
+        if detect_opacity:
+            missing = [frame for frame in incomplete_detections
+                       if any(tap.get_opacity_confidence() is None
+                              for tap in frame.get_screen_taps())]
+            if len(missing) > 0:
+                self.opacity_detector.set_frames(missing)
+                self.opacity_detector.set_frame_source(self.frame_extractor.get_frame_source(1.0))
+                self.opacity_detector.execute_detection()
+        # taps of the detections now hold their opacity confidence
+        self.detections = incomplete_detections
+        if self.frame_listener is not None and not stream_frames:
+            for frame in self.detections:
+                self.frame_listener(frame)
+
+        # 4) Write these detections to file
+        if detect_opacity and write_artifacts:
+            # navigate to file pertaining to video being analyzed
+            DetectionTable.from_frames(self.detections).save(os.path.join(cur_dir_path, "detection_full.npy"))
+        if detect_opacity and export_json:
+            json_path = os.path.join(cur_dir_path, "detection_full.json")
+            JSONFileUtils.output_data_to_json_async(self.detections, json_path)
+
+    @staticmethod
+    def get_frame_shape(config):
+        """
+        Returns the shape of the frames passed to the touch model, given by
+        the resolution of the configured device and the inference scale.
 
         Parameters
         ----------
-        predictions : array
-            opacity predictions from model
-        incomplete : list of Frames
-            list of detections lacking opacity information
-        cur_path : string
-            path to the current video being processed; allows cropped images
-            to be found
-        
+        config : dict
+            configuration for video file and device
+
         Returns
         -------
-        detections : list of Frames
-            detections complete with opacity predictions
+        shape : tuple
+            shape [height, width, 3] of the frames
         """
-        
-        # frame id dictionary for detection ids
-        # allow to easily match id number from cropped images to correct frame
-        frame_ids = {}
-        for frame in incomplete:
-            frame_ids[frame.get_id()] = frame
+        device_config = JSONFileUtils.read_data_from_json(CURRPATH + 'device_config.json')
+        device = device_config[config["device_model"]]
+        width, height = AbstractFrameSource.scaled_size(
+            device["width"], device["height"],
+            config.get("inference_scale", INFERENCE_SCALE))
+        return (height, width, 3)
 
-        # get path to cropped images
-        video_dir, video_file = os.path.split(cur_vid)
-        video_name, video_extension = os.path.splitext(video_file)
-        cropped_img_path = os.path.join(video_dir, video_name, "cropped_images")
-
-        # get images located at cropped img path
-        # sort them so they're in the same order as opacity detection occurred
-        img_list = [img for img in os.listdir(cropped_img_path) if 
-                                            os.path.splitext(img)[1] == ".jpg"]
-        img_list.sort()
-
-        if len(img_list) != np.size(predictions, 0):
-            sys.exit("ERROR: Number of predictions does not match number of \
-            cropped images. Cannot add opacity predictions to detections.")
-
-        for num, prediction in enumerate(predictions):
-            # extract the prediction that the indicator is low opacity
-            op_pred = prediction[0].item() #.item() converts from np.float32 to float
-            img_name = img_list[num]
-            # image name is formatted as "<id>_<tap_num>.jpg"
-            # want to get the information about the frame id and the tap number
-            split = img_name.split("_")
-            frame_id = int(split[0])
-            tap_number = int(split[1].split(".")[0])
-            # get the frame that we need to add this prediction to
-            frame = frame_ids[frame_id]
-            tap_list = frame.get_screen_taps()
-            # get the tap that this prediction should be added to
-            correct_tap = tap_list[tap_number]
-            correct_tap.set_opacity_confidence(op_pred)
-        
-        # detections have now been added to incomplete and can be returned
-        return incomplete
+    @staticmethod
+    def get_indicator_size(config):
+        """
+        Returns the diameter of the touch indicator of the configured device
+        in the frames passed to the touch model.
+
+        Parameters
+        ----------
+        config : dict
+            configuration for video file and device
+
+        Returns
+        -------
+        indicator_size : float
+            diameter of the indicator, in pixels
+        """
+        device_config = JSONFileUtils.read_data_from_json(CURRPATH + 'device_config.json')
+        device = device_config[config["device_model"]]
+        return device["indicator_size"] * config.get("inference_scale", INFERENCE_SCALE)
+
+    def get_output(self):
+        """
+        Returns detections, handed to the next phase.
+
+        Returns
+        -------
+        detections : list of Frames
+            detected frames through touch detection and opacity detection
+        """
+        return self.detections
 
     def get_detections(self):
         """
@@ -203,3 +340,26 @@ class Phase1V2S(AbstractPhase):
             new detections
         """
         self.detections = dets
+
+    def get_frame_listener(self):
+        """
+        Returns the frame listener.
+
+        Returns
+        -------
+        frame_listener : callable
+            called with each detected frame; None if not set
+        """
+        return self.frame_listener
+
+    def set_frame_listener(self, listener):
+        """
+        Changes frame listener to specified value.
+
+        Parameters
+        ----------
+        listener : callable
+            called with each detected frame in frame order, e.g. to
+            segment actions while detection runs; None to call nothing
+        """
+        self.frame_listener = listener
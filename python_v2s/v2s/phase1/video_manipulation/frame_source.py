@@ -0,0 +1,465 @@
+# frame_source.py
+import copy
+import glob
+import logging
+import os
+from abc import ABC, abstractmethod
+
+import ffmpeg
+import numpy as np
+from PIL import Image
+
+from v2s.util.constants import DECODE_WORKERS, FRAME_QUEUE_SIZE, INFERENCE_SCALE
+from v2s.util.general import ThreadUtils
+
+
+class AbstractFrameSource(ABC):
+    """
+    Provides the decoded frames of a video, in order, to a detector.
+
+    Iterating over a frame source yields (frame_id, image_np) pairs where
+    frame_id matches the numbering used for extracted frames ("0001.jpg" has
+    id 1) and image_np is an RGB array with shape [height, width, 3].
+
+    Frames may be downscaled while decoding, in which case image_np is scale
+    times the size of the video.
+
+    Attributes
+    ----------
+    scale : float
+        factor frames are resized by while decoding
+
+    Methods
+    -------
+    __iter__()
+        Yields (frame_id, image_np) pairs in frame order.
+    __len__()
+        Returns the number of frames the source will yield.
+    get_scale()
+        Returns the factor frames are resized by.
+    split(count)
+        Splits the source into sources over consecutive runs of frames.
+    sample(step)
+        Returns a source over every step-th frame.
+    select(frame_ids)
+        Returns a source over the frames with the given ids.
+    get_frame_ids()
+        Returns the ids of the frames the source will yield.
+    scaled_size(width, height, scale)
+        Returns the size of a frame resized by scale.
+    """
+
+    scale = 1.0
+
+    @abstractmethod
+    def __iter__(self):
+        """
+        Yields (frame_id, image_np) pairs in frame order.
+        """
+        pass
+
+    @abstractmethod
+    def __len__(self):
+        """
+        Returns the number of frames the source will yield.
+        """
+        pass
+
+    def get_scale(self):
+        """
+        Returns the factor frames are resized by.
+
+        Returns
+        -------
+        scale : float
+            size of yielded frames relative to the video
+        """
+        return self.scale
+
+    def split(self, count):
+        """
+        Splits the source into at most count sources over consecutive runs of
+        frames, e.g. to detect on them in separate processes. Sources that
+        cannot be split return themselves only.
+
+        Parameters
+        ----------
+        count : int
+            maximum number of sources to split into
+
+        Returns
+        -------
+        sources : list of AbstractFrameSources
+            sources yielding together the frames of this source, in order
+        """
+        return [self]
+
+    @abstractmethod
+    def sample(self, step):
+        """
+        Returns a source over every step-th frame, starting with the first.
+        Frames keep their ids.
+
+        Parameters
+        ----------
+        step : int
+            distance between yielded frames
+
+        Returns
+        -------
+        source : AbstractFrameSource
+            source over the sampled frames
+        """
+        pass
+
+    @abstractmethod
+    def select(self, frame_ids):
+        """
+        Returns a source over the frames with the given ids. Ids without a
+        frame are ignored.
+
+        Parameters
+        ----------
+        frame_ids : iterable of ints
+            ids of frames to yield
+
+        Returns
+        -------
+        source : AbstractFrameSource
+            source over the selected frames
+        """
+        pass
+
+    @abstractmethod
+    def get_frame_ids(self):
+        """
+        Returns the ids of the frames the source will yield, in order.
+
+        Returns
+        -------
+        frame_ids : list of ints
+            ids of the frames
+        """
+        pass
+
+    @staticmethod
+    def scaled_size(width, height, scale):
+        """
+        Returns the size of a frame resized by scale.
+
+        Parameters
+        ----------
+        width : int
+            width of frame
+        height : int
+            height of frame
+        scale : float
+            factor to resize by
+
+        Returns
+        -------
+        size : (int, int)
+            resized width and height
+        """
+        return max(round(width * scale), 1), max(round(height * scale), 1)
+
+class ExtractedFrameSource(AbstractFrameSource):
+    """
+    Frame source reading the frames previously written to disk by the
+    FrameExtractor. Frames are decoded ahead of the consumer by a pool of
+    threads.
+
+    Attributes
+    ----------
+    frames_path : string
+        directory holding the extracted "xxxx.jpg" frames
+    frame_paths : list of strings
+        sorted paths of the extracted frames
+    workers : int
+        number of threads decoding frames
+    queue_size : int
+        maximum number of decoded frames waiting to be consumed
+    scale : float
+        factor frames are resized by while decoding
+    """
+
+    def __init__(self, frames_path, workers=DECODE_WORKERS,
+                 queue_size=FRAME_QUEUE_SIZE, scale=INFERENCE_SCALE):
+        """
+        Parameters
+        ----------
+        frames_path : string
+            directory holding the extracted frames
+        workers : int, optional
+            number of threads decoding frames
+        queue_size : int, optional
+            maximum number of decoded frames waiting to be consumed
+        scale : float, optional
+            factor to resize frames by while decoding
+        """
+        self.frames_path = frames_path
+        # sort extracted frames so detections occur in a predictable order
+        self.frame_paths = glob.glob(os.path.join(frames_path, '*'))
+        self.frame_paths.sort()
+        self.workers = workers
+        self.queue_size = queue_size
+        self.scale = scale
+
+    def __iter__(self):
+        return ThreadUtils.map_ordered(self.__read_frame, self.frame_paths,
+                                       self.workers, self.queue_size)
+
+    def __read_frame(self, image_path):
+        """
+        Decodes an extracted frame.
+
+        Parameters
+        ----------
+        image_path : string
+            path to "xxxx.jpg" frame
+
+        Returns
+        -------
+        frame : (int, np array)
+            frame id and decoded frame
+        """
+        image = Image.open(image_path)
+        if self.scale != 1.0:
+            size = self.scaled_size(image.width, image.height, self.scale)
+            # let the jpeg decoder skip detail that resizing would drop
+            image.draft('RGB', size)
+            image = image.resize(size, Image.BILINEAR)
+        return self.__get_frame_id(image_path), np.array(image)
+
+    @staticmethod
+    def __get_frame_id(image_path):
+        """
+        Returns the id of an extracted frame.
+
+        Parameters
+        ----------
+        image_path : string
+            path to "xxxx.jpg" frame
+
+        Returns
+        -------
+        frame_id : int
+            id of the frame
+        """
+        return int(os.path.splitext(os.path.basename(image_path))[0])
+
+    def __subset(self, frame_paths):
+        """
+        Returns a source over some of the extracted frames.
+
+        Parameters
+        ----------
+        frame_paths : list of strings
+            sorted paths of frames to yield
+
+        Returns
+        -------
+        source : ExtractedFrameSource
+            source over the frames
+        """
+        subset = copy.copy(self)
+        subset.frame_paths = frame_paths
+        return subset
+
+    def __len__(self):
+        return len(self.frame_paths)
+
+    def split(self, count):
+        shard_size = -(-len(self.frame_paths) // max(count, 1))
+        shards = []
+        for start in range(0, len(self.frame_paths), max(shard_size, 1)):
+            shards.append(self.__subset(self.frame_paths[start:start + shard_size]))
+        return shards if len(shards) != 0 else [self]
+
+    def sample(self, step):
+        # sampling by id keeps the sampled frames the same across shards
+        return self.__subset([path for path in self.frame_paths
+                              if (self.__get_frame_id(path) - 1) % step == 0])
+
+    def select(self, frame_ids):
+        frame_ids = set(frame_ids)
+        return self.__subset([path for path in self.frame_paths
+                              if self.__get_frame_id(path) in frame_ids])
+
+    def get_frame_ids(self):
+        return [self.__get_frame_id(path) for path in self.frame_paths]
+
+class StreamFrameSource(AbstractFrameSource):
+    """
+    Frame source decoding a video with ffmpeg and reading the raw RGB frames
+    straight from its stdout. No frame is written to or read from disk. Frames
+    are read ahead of the consumer by a background thread.
+
+    Attributes
+    ----------
+    video_path : string
+        path to video to decode
+    width : int
+        width of decoded frames, after scaling
+    height : int
+        height of decoded frames, after scaling
+    num_frames : int
+        number of frames expected from the video
+    output_args : dict
+        extra ffmpeg output arguments (e.g. filters) applied while decoding
+    queue_size : int
+        maximum number of decoded frames waiting to be consumed
+    scale : float
+        factor frames are resized by while decoding
+    step : int
+        only every step-th frame is yielded
+    frame_ids : list of ints
+        ids of the frames yielded; None for every step-th frame
+    """
+
+    def __init__(self, video_path, width, height, num_frames, output_args=None,
+                 queue_size=FRAME_QUEUE_SIZE, scale=INFERENCE_SCALE):
+        """
+        Parameters
+        ----------
+        video_path : string
+            path to video to decode
+        width : int
+            width of the video
+        height : int
+            height of the video
+        num_frames : int
+            number of frames expected from the video
+        output_args : dict, optional
+            extra ffmpeg output arguments applied while decoding
+        queue_size : int, optional
+            maximum number of decoded frames waiting to be consumed
+        scale : float, optional
+            factor to resize frames by while decoding
+        """
+        self.video_path = video_path
+        self.width, self.height = self.scaled_size(width, height, scale)
+        self.num_frames = num_frames
+        self.output_args = dict(output_args) if output_args is not None else {}
+        self.queue_size = queue_size
+        self.scale = scale
+        self.step = 1
+        self.frame_ids = None
+
+    def __iter__(self):
+        return ThreadUtils.prefetch(self.__read_frames(), self.queue_size)
+
+    def __read_frames(self):
+        """
+        Decodes the video with ffmpeg and yields its frames.
+        """
+        frame_size = self.width * self.height * 3
+        process = (
+            ffmpeg
+            .input(self.video_path)
+            .output('pipe:', **{'format': 'rawvideo', 'pix_fmt': 'rgb24',
+                    'loglevel': 'panic'}, **self.__get_output_args())
+            .run_async(pipe_stdout=True)
+        )
+        try:
+            count = 0
+            while True:
+                # a bytearray keeps the resulting np array writable
+                buffer = bytearray(frame_size)
+                if process.stdout.readinto(buffer) != frame_size:
+                    break
+                if self.frame_ids is not None:
+                    frame_id = self.frame_ids[count]
+                else:
+                    frame_id = count * self.step + 1
+                count += 1
+                yield frame_id, np.frombuffer(buffer, np.uint8).reshape(
+                                                (self.height, self.width, 3))
+        finally:
+            process.stdout.close()
+            process.wait()
+        logging.info("Streamed " + str(count) + " frames from: " +
+                     self.video_path)
+
+    def __get_output_args(self):
+        """
+        Returns the ffmpeg output arguments, with the filters selecting and
+        scaling frames appended after any other filter, e.g. the frame rate
+        one.
+
+        Returns
+        -------
+        output_args : dict
+            ffmpeg output arguments
+        """
+        output_args = dict(self.output_args)
+        filters = [output_args['vf']] if 'vf' in output_args else []
+        # ffmpeg numbers frames from 0 while frame ids start at 1
+        if self.frame_ids is not None:
+            ranges = self.__get_ranges(self.frame_ids)
+            filters.append('select=' + '+'.join(
+                'between(n\\,{}\\,{})'.format(first - 1, last - 1)
+                for first, last in ranges))
+        elif self.step > 1:
+            filters.append('select=not(mod(n\\,{}))'.format(self.step))
+        if self.frame_ids is not None or self.step > 1:
+            # keep the selected frames only, instead of duplicating them to
+            # hold the frame rate
+            output_args['vsync'] = 'passthrough'
+        if self.scale != 1.0:
+            filters.append('scale={}:{}'.format(self.width, self.height))
+        if len(filters) != 0:
+            output_args['vf'] = ','.join(filters)
+        return output_args
+
+    @staticmethod
+    def __get_ranges(frame_ids):
+        """
+        Returns the runs of consecutive ids in a sorted list of frame ids.
+
+        Parameters
+        ----------
+        frame_ids : list of ints
+            sorted frame ids
+
+        Returns
+        -------
+        ranges : list of (int, int)
+            first and last id of each run
+        """
+        ranges = []
+        for frame_id in frame_ids:
+            if len(ranges) != 0 and ranges[-1][1] == frame_id - 1:
+                ranges[-1][1] = frame_id
+            else:
+                ranges.append([frame_id, frame_id])
+        return [tuple(run) for run in ranges]
+
+    def __len__(self):
+        if self.frame_ids is not None:
+            return len(self.frame_ids)
+        return -(-self.num_frames // self.step)
+
+    def sample(self, step):
+        # sampling by id, as ExtractedFrameSource does, keeps the frames a
+        # coarse pass detected on known to the fine pass
+        if self.frame_ids is not None:
+            return self.select([frame_id for frame_id in self.frame_ids
+                                if (frame_id - 1) % step == 0])
+        sampled = copy.copy(self)
+        sampled.step = self.step * step
+        return sampled
+
+    def select(self, frame_ids):
+        if self.frame_ids is not None or self.step != 1:
+            # only frames of this source are kept, as ExtractedFrameSource does
+            frame_ids = set(frame_ids).intersection(self.get_frame_ids())
+        selected = copy.copy(self)
+        selected.frame_ids = sorted(frame_ids)
+        selected.step = 1
+        return selected
+
+    def get_frame_ids(self):
+        if self.frame_ids is not None:
+            return list(self.frame_ids)
+        return [count * self.step + 1 for count in range(len(self))]
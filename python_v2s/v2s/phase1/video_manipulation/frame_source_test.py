@@ -0,0 +1,72 @@
+# frame_source_test.py
+import os
+import shutil
+import tempfile
+import unittest
+
+from v2s.phase1.video_manipulation.frame_source import (ExtractedFrameSource,
+                                                        StreamFrameSource)
+
+
+class StreamFrameSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.source = StreamFrameSource("video.mp4", 1080, 1920, 20,
+                                        output_args={"vf": "fps=30"}, scale=0.5)
+        # extracted frames of the same video, which stream sources match
+        self.directory = tempfile.mkdtemp()
+        for frame_id in range(1, 21):
+            open(os.path.join(self.directory, "%04d.jpg" % frame_id), "w").close()
+        self.extracted = ExtractedFrameSource(self.directory, scale=0.5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_filters(self, source):
+        return source._StreamFrameSource__get_output_args()["vf"]
+
+    def test_all_frames(self):
+        self.assertEqual(len(self.source), 20)
+        self.assertEqual(self.source.get_frame_ids(), list(range(1, 21)))
+        self.assertEqual((self.source.width, self.source.height), (540, 960))
+        self.assertEqual(self.get_filters(self.source), "fps=30,scale=540:960")
+
+    def test_sample(self):
+        sampled = self.source.sample(6)
+        self.assertEqual(sampled.get_frame_ids(), [1, 7, 13, 19])
+        self.assertEqual(len(sampled), 4)
+        self.assertEqual(self.get_filters(sampled),
+                         "fps=30,select=not(mod(n\\,6)),scale=540:960")
+        self.assertEqual(sampled.get_frame_ids(), self.extracted.sample(6).get_frame_ids())
+        self.assertEqual(sampled.sample(2).get_frame_ids(), [1, 13])
+        # the original source is left as is
+        self.assertEqual(len(self.source), 20)
+
+    def test_select(self):
+        selected = self.source.select([9, 3, 4, 5, 12])
+        self.assertEqual(selected.get_frame_ids(), [3, 4, 5, 9, 12])
+        self.assertEqual(len(selected), 5)
+        # ffmpeg numbers frames from 0
+        self.assertEqual(self.get_filters(selected),
+                         "fps=30,select=between(n\\,2\\,4)+between(n\\,8\\,8)"
+                         "+between(n\\,11\\,11),scale=540:960")
+        self.assertEqual(selected._StreamFrameSource__get_output_args()["vsync"], "passthrough")
+
+    def test_select_keeps_frames_of_source(self):
+        ids = [0, 2, 7, 8, 13, 25]
+        sampled = self.source.sample(6)
+        self.assertEqual(sampled.select(ids).get_frame_ids(), [7, 13])
+        self.assertEqual(sampled.select(ids).get_frame_ids(),
+                         self.extracted.sample(6).select(ids).get_frame_ids())
+        selected = self.source.select([3, 4, 5, 9])
+        self.assertEqual(selected.select([4, 5, 6]).get_frame_ids(), [4, 5])
+
+    def test_sample_selected(self):
+        selected = self.source.select([2, 4, 7, 8, 13, 14])
+        self.assertEqual(selected.sample(6).get_frame_ids(), [7, 13])
+        self.assertEqual(selected.sample(6).get_frame_ids(),
+                         self.extracted.select([2, 4, 7, 8, 13, 14]).sample(6).get_frame_ids())
+
+
+if __name__ == "__main__":
+    unittest.main()
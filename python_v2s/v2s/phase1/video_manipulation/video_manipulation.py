@@ -2,10 +2,14 @@
 import logging
 import os
 from abc import ABC, abstractmethod
+from fractions import Fraction
 
 import ffmpeg
 
-from v2s.util.constants import FRAMES_PER_SECOND
+from v2s.phase1.video_manipulation.frame_source import (ExtractedFrameSource,
+                                                       StreamFrameSource)
+from v2s.util.constants import (DECODE_WORKERS, FRAMES_PER_SECOND,
+                                INFERENCE_SCALE)
 
 
 class AbstractVideoManipulator(ABC):
@@ -44,6 +48,9 @@ class FrameExtractor(AbstractVideoManipulator):
 
     Executes manipulation on all videos available in input folder.
 
+    When streaming, frames are not extracted to disk; instead the frame source
+    returned by get_frame_source() decodes them on demand.
+
     Attributes
     ----------
     video_path : string
@@ -52,15 +59,35 @@ class FrameExtractor(AbstractVideoManipulator):
         desired frames per second of video
     frames_path : string
         where to place extracted frames
+    stream : bool
+        whether frames are streamed from ffmpeg instead of extracted to disk
+    decode_workers : int
+        number of threads decoding extracted frames
+    video_info : dict
+        probed metadata of the video; None if probing failed
+    decode_path : string
+        video frames are decoded from
+    decode_args : dict
+        ffmpeg output arguments used while decoding (e.g. fps filter)
 
     Methods
     -------
     execute()
         Executes standardization and frame extraction.
+    probe_video(path)
+        Reads the metadata of the video stream using ffprobe.
+    is_target_frame_rate(video_info)
+        Returns whether a probed video is constant frame rate at desired fps.
+    get_frame_source(scale)
+        Returns a frame source yielding the frames of the video.
     __fix_video_frame_rate()
         Standardizes video frame rate using ffmpeg.
     __extract_frames() 
         Extract frames from video using ffmpeg.
+    __get_fixed_video_path()
+        Returns path of the video with standardized frame rate.
+    __get_extracted_frames_path()
+        Returns path of the folder extracted frames are placed in.
     get_fps()
         Returns desired fps rate.
     set_fps(fps)
@@ -73,9 +100,18 @@ class FrameExtractor(AbstractVideoManipulator):
         Returns video path.
     set_video_path(path)
         Changes video path to specified value.
+    is_stream()
+        Returns whether frames are streamed.
+    set_stream(stream)
+        Changes whether frames are streamed to specified value.
+    get_decode_workers()
+        Returns number of threads decoding extracted frames.
+    set_decode_workers(workers)
+        Changes number of threads decoding extracted frames to specified value.
     """
 
-    def __init__(self, video_path=None, fps=FRAMES_PER_SECOND):
+    def __init__(self, video_path=None, fps=FRAMES_PER_SECOND, stream=False,
+                 decode_workers=DECODE_WORKERS):
         """
         Parameters
         ----------
@@ -83,18 +119,137 @@ class FrameExtractor(AbstractVideoManipulator):
             path to video
         fps : int
             desired fps
+        stream : bool, optional
+            stream frames from ffmpeg instead of extracting them to disk
+        decode_workers : int, optional
+            number of threads decoding extracted frames
         """
         self.video_path = video_path
         # default is 30
         self.fps = fps
+        self.stream = stream
+        self.decode_workers = decode_workers
+        self.video_info = None
+        self.decode_path = video_path
+        self.decode_args = {}
 
     def execute(self):
         """
         Executes standardization and frame extraction.
+
+        The video is probed first. Constant frame rate videos already at the
+        desired fps are decoded as is, other videos are resampled by the fps
+        filter while decoding. The video is only re-encoded to "-fixed.mp4"
+        when its frame rate cannot be probed.
         """
         logging.info("Manipulating: " + os.path.basename(self.video_path))
-        self.__fix_video_frame_rate()
-        self.__extract_frames()
+        try:
+            self.video_info = self.probe_video()
+        except (ffmpeg.Error, KeyError, StopIteration, ValueError, ZeroDivisionError):
+            self.video_info = None
+
+        if self.video_info is None:
+            logging.info("Could not probe frame rate, re-encoding video")
+            self.__fix_video_frame_rate()
+            self.decode_path = self.__get_fixed_video_path()
+            self.decode_args = {'vf': 'fps=' + str(self.fps)}
+        elif self.is_target_frame_rate(self.video_info):
+            logging.info("Video already at " + str(self.fps) + " fps, skipping re-encode")
+            self.decode_path = self.video_path
+            self.decode_args = {}
+        else:
+            logging.info("Resampling video from " + str(self.video_info["avg_frame_rate"])
+                         + " to " + str(self.fps) + " fps while decoding")
+            self.decode_path = self.video_path
+            self.decode_args = {'vf': 'fps=' + str(self.fps)}
+
+        # streamed frames are decoded later by the frame source
+        if not self.stream:
+            self.__extract_frames()
+
+    def probe_video(self, path=None):
+        """
+        Reads the metadata of the video stream using ffprobe.
+
+        Parameters
+        ----------
+        path : string, optional
+            video to probe; defaults to video_path
+
+        Returns
+        -------
+        video_info : dict
+            width and height of decoded frames, real and average frame rates
+            as Fractions, number of frames (0 if unknown) and duration in
+            seconds
+        """
+        probe = ffmpeg.probe(path if path is not None else self.video_path)
+        video_stream = next(stream for stream in probe['streams']
+                            if stream['codec_type'] == 'video')
+        width = int(video_stream['width'])
+        height = int(video_stream['height'])
+        # ffmpeg auto-rotates frames of rotated phone recordings when decoding
+        rotation = int(video_stream.get('tags', {}).get('rotate', 0))
+        for side_data in video_stream.get('side_data_list', []):
+            rotation = int(side_data.get('rotation', rotation))
+        if abs(rotation) in (90, 270):
+            width, height = height, width
+        duration = float(video_stream.get('duration',
+                                          probe['format'].get('duration', 0)))
+        return dict(width=width, height=height,
+                    r_frame_rate=Fraction(video_stream['r_frame_rate']),
+                    avg_frame_rate=Fraction(video_stream['avg_frame_rate']),
+                    nb_frames=int(video_stream.get('nb_frames', 0)),
+                    duration=duration)
+
+    def is_target_frame_rate(self, video_info):
+        """
+        Returns whether a probed video is constant frame rate at desired fps.
+
+        Parameters
+        ----------
+        video_info : dict
+            metadata returned by probe_video()
+
+        Returns
+        -------
+        bool : bool
+            True if the real and average frame rates both equal fps
+        """
+        return (video_info["r_frame_rate"] == self.fps and
+                video_info["avg_frame_rate"] == self.fps)
+
+    def get_frame_source(self, scale=INFERENCE_SCALE):
+        """
+        Returns a frame source yielding the frames of the video. Must be called
+        after execute().
+
+        Parameters
+        ----------
+        scale : float, optional
+            factor to downscale frames by while decoding
+
+        Returns
+        -------
+        source : AbstractFrameSource
+            streaming source over the decoded video if streaming, otherwise a
+            source over the extracted frames
+        """
+        if not self.stream:
+            return ExtractedFrameSource(self.__get_extracted_frames_path(),
+                                        self.decode_workers, scale=scale)
+
+        video_info = self.video_info
+        if video_info is None:
+            # the fixed video is always readable
+            video_info = self.probe_video(self.decode_path)
+        # number of frames is only used to report progress
+        num_frames = video_info["nb_frames"]
+        if not num_frames or self.decode_args:
+            num_frames = round(video_info["duration"] * self.fps)
+        return StreamFrameSource(self.decode_path, video_info["width"],
+                                 video_info["height"], num_frames,
+                                 self.decode_args, scale=scale)
 
     def __fix_video_frame_rate(self):
         """
@@ -108,12 +263,7 @@ class FrameExtractor(AbstractVideoManipulator):
         -preset ultrafast
         constant rate factor: -crf 15
         """
-        # separate the name and extension of the file
-        video_file = os.path.basename(self.video_path)
-        video_name, video_extension = os.path.splitext(video_file)
-        dir_path = os.path.join(os.path.dirname(self.video_path), video_name)
-       
-        output_vid_path = os.path.join(dir_path, video_name + "-fixed.mp4")
+        output_vid_path = self.__get_fixed_video_path()
         (
             ffmpeg
             .input(self.video_path)
@@ -132,27 +282,48 @@ class FrameExtractor(AbstractVideoManipulator):
         "xxxx.jpg".
         """
 
-        # separate the name and extension of the file
-        video_file = os.path.basename(self.video_path)
-        video_name, video_extension = os.path.splitext(video_file)
-        # get the subdirectory of the video
-        # created in phase1
-        dir_path = os.path.join(os.path.dirname(self.video_path), video_name)
-        fixed_video_path = os.path.normpath(dir_path + os.sep + video_name + "-fixed.mp4")
-        extracted_frames_path = os.path.join(dir_path, 'extracted_frames' + os.sep)
+        extracted_frames_path = self.__get_extracted_frames_path()
 
         # for each folder, create a folder for extracted images
         if not os.path.exists(extracted_frames_path):
             os.mkdir(extracted_frames_path)
         (
             ffmpeg
-            .input(fixed_video_path)
+            .input(self.decode_path)
             .output(os.path.join(extracted_frames_path, '%04d.jpg'), 
-                    **{'qscale:v': 3, 'vf':'fps='+str(self.fps), 'loglevel':'panic'})
+                    **{'qscale:v': 3, 'loglevel':'panic'}, **self.decode_args)
             .run()
         )
 
         logging.info("Frames extracted and placed in: " + extracted_frames_path)
+
+    def __get_fixed_video_path(self):
+        """
+        Returns path of the video with standardized frame rate, placed in the
+        subdirectory of the video created in phase1.
+
+        Returns
+        -------
+        fixed_video_path : string
+            path to "<name>-fixed.mp4"
+        """
+        # separate the name and extension of the file
+        video_file = os.path.basename(self.video_path)
+        video_name, video_extension = os.path.splitext(video_file)
+        dir_path = os.path.join(os.path.dirname(self.video_path), video_name)
+        return os.path.normpath(os.path.join(dir_path, video_name + "-fixed.mp4"))
+
+    def __get_extracted_frames_path(self):
+        """
+        Returns path of the folder extracted frames are placed in.
+
+        Returns
+        -------
+        extracted_frames_path : string
+            path to "extracted_frames" in the subdirectory of the video
+        """
+        fixed_video_path = self.__get_fixed_video_path()
+        return os.path.join(os.path.dirname(fixed_video_path), 'extracted_frames' + os.sep)
     
     def get_fps(self):
         """
@@ -223,3 +394,47 @@ class FrameExtractor(AbstractVideoManipulator):
         frames = os.path.join(os.path.dirname(self.video_path), 
                              "extracted_frames"+os.sep)
         self.set_frames_path(frames)
+
+    def is_stream(self):
+        """
+        Returns whether frames are streamed.
+
+        Returns
+        -------
+        stream : bool
+            whether frames are streamed from ffmpeg instead of extracted
+        """
+        return self.stream
+
+    def set_stream(self, stream):
+        """
+        Changes whether frames are streamed to specified value.
+
+        Parameters
+        ----------
+        stream : bool
+            new streaming setting
+        """
+        self.stream = stream
+
+    def get_decode_workers(self):
+        """
+        Returns number of threads decoding extracted frames.
+
+        Returns
+        -------
+        decode_workers : int
+            number of threads decoding extracted frames
+        """
+        return self.decode_workers
+
+    def set_decode_workers(self, workers):
+        """
+        Changes number of threads decoding extracted frames to specified value.
+
+        Parameters
+        ----------
+        workers : int
+            new number of decoding threads
+        """
+        self.decode_workers = workers
@@ -1,11 +1,15 @@
 # action_classification.py
+import bisect
 from abc import ABC, abstractmethod
+from collections import defaultdict, deque
 
+import numpy as np
 from v2s.util.constants import (DISTANCE_MERGE_COMPLEX, FRAMES_PER_SECOND,
                             LONG_CLICK_FRAMES, LONG_CLICK_THRESHOLD,
                             OPACITY_THRESHOLD, SWIPE_EPSILON, SWIPES_THRESHOLD,
                             TAP_COUNT_THRESHOLD, TAP_EPSILON, TAP_THRESHOLD)
 from v2s.util.event import ActionType, GUIAction
+from v2s.util.detection_table import DetectionTable
 from v2s.util.general import GeneralUtils
 
 
@@ -35,8 +39,9 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
 
     Attributes
     ----------
-    touch_detections : list of Frames
-        detected touches from Phase 1
+    touch_detections : DetectionTable
+        detected touches from Phase 1; a list of Frames is converted when
+        classification starts
     detected_actions : list of GUIActions
         detected actions
     
@@ -53,9 +58,9 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
     group_by_opacity()
         Ensures that list of GUIActions make sense based on opacity predictions
         of taps. Filters groups based on this.
-    __opacity_increasing(curr_tap, next_tap, threshold)
-        Determines if opacity is increasing between two taps relative to a given
-        threshold.
+    __opacity_increasing(opacities, threshold)
+        Determines if opacity is increasing between each pair of consecutive
+        taps relative to a given threshold.
      __fix_types_on_new_actions(actions)
         Makes sure that clicks and long clicks are classified correctly based
         on the number of frames that constitutes a long click.
@@ -69,6 +74,8 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         Takes detected GUIActions and further filters these to ensure they are
         as accurate as possible. Includes grouping further by opacity and by
         complex actions.
+    __get_rows(taps)
+        Returns the rows of taps in the detection table.
     get_touch_detections()
         Returns touch_detections.
     set_touch_detections(dets)
@@ -83,7 +90,7 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         """
         Parameters
         ----------
-        detections : list of Frames
+        detections : DetectionTable or list of Frames
             list of detections to classify into actions
         """
         self.detected_actions = []
@@ -94,12 +101,11 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         """
         Completes classification steps to translate from Frames to GUIActions.
         """
+        if not isinstance(self.touch_detections, DetectionTable):
+            self.touch_detections = DetectionTable.from_frames(self.touch_detections)
+        self.touch_detections.visited[:] = False
+        # taps are rows of the table, so their frame values are accurate
         frame_groups = self.group_consecutive_frames()
-        # fix tap frame values to be accurate
-        for frame_group in frame_groups:
-            for frame in frame_group:
-                for tap in frame.get_screen_taps():
-                    tap.set_frame(frame.get_id())
         
         tap_groups = self.group_taps_graph_alg(frame_groups)
         self.group_actions(tap_groups)
@@ -117,35 +123,28 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
 
         Returns 
         -------
-        frame_groups : list of list of Frames
+        frame_groups : list of list of FrameViews
             frames grouped by consecutive ids
         """
-        frame_groups = []
-        frame_group = []
-        for frame in self.touch_detections:
-            # check if consecutive frames
-            # end the consecutive frame group if the group is not empty and the
-            # next frame is not consecutive
-            if (len(frame_group)!=0) and (frame_group[len(frame_group)-1].get_id() != frame.get_id()-1):
-                # if the frame_group has enough taps in it to constitute a real
-                # action, add it to the total groups
-                if len(frame_group) > TAP_THRESHOLD:
-                    frame_groups.append(frame_group)
-                # and start a new group
-                frame_group = []
-            # if the group is empty or it's the next consecutive frame
-            frame_group.append(frame)
-        
-        # take care of last frame group
-        if len(frame_group) > TAP_THRESHOLD:
-            frame_groups.append(frame_group)
-        
-        return frame_groups
+        frames = self.touch_detections.get_frames()
+        # a group ends wherever the next frame is not the consecutive one
+        bounds = np.flatnonzero(np.diff(self.touch_detections.get_frame_ids()) != 1) + 1
+        bounds = [0] + bounds.tolist() + [len(frames)]
+        # only groups with enough taps to constitute a real action are kept
+        return [frames[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])
+                if stop - start > TAP_THRESHOLD]
 
     def group_taps_graph_alg(self, frame_groups):
         """
         Uses graph algorithm to group consecutive frames into groups of taps.
 
+        Each tap is linked to the closest unvisited tap of the next frame, if
+        closer than TAP_EPSILON; taps left over are queued to start groups of
+        their own. Groups of at most TAP_THRESHOLD taps are then merged with
+        the group starting on the frame after their last tap. Frames and
+        group starts are indexed by frame id, so the time taken grows
+        linearly with the number of taps.
+
         Parameters
         ----------
         frame_groups : list of list of Frames
@@ -157,16 +156,18 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
             groups of screen taps that are output by graph algorithm
         """
         tap_groups = []
+        # coordinates of the groups found, as a group identical to one found
+        # before is not added again
+        group_keys = set()
 
         for frame_group in frame_groups:
-            initial_frame = frame_group[0]
+            # taps of each frame in the group, by frame id
+            frame_taps = {frame.get_id(): frame.get_screen_taps() for frame in frame_group}
 
-            # implement queue using a list
-            queue = []
             # add all screen taps in initial frame to queue
-            queue.extend(initial_frame.get_screen_taps())
+            queue = deque(frame_group[0].get_screen_taps())
             while (len(queue)!=0):
-                curr_tap = queue.pop(0)
+                curr_tap = queue.popleft()
                 # if the tap has already been seen on our traversal, don't add
                 # it to the tap group --> move on to the next one
                 if (curr_tap.is_visited()):
@@ -175,18 +176,12 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
                 # ensure that we won't process same tap twice
                 curr_tap.set_visited(True)
 
-                tap_group = []
-                tap_group.append(curr_tap)
+                tap_group = [curr_tap]
+                complete = False
                 
-                # compare the current tap to the remaining frames in the group
-                for i in range(1, len(frame_group)):
-                    if curr_tap.get_frame() + 1 != frame_group[i].get_id():
-                        continue
-                    # if we reach this point, it means the frame that cur_tap
-                    # belongs to is frame_group[i-1]
-                    # next_taps is taps in frame directly after current frame
-                    next_taps = frame_group[i].get_screen_taps()
-
+                # follow the tap through the next frames of the group
+                next_taps = frame_taps.get(curr_tap.get_frame() + 1)
+                while next_taps is not None:
                     best_next_tap = next_taps[0]
                     for next_tap in next_taps:
                         if next_tap.is_visited():
@@ -199,7 +194,7 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
                         min_distance = GeneralUtils.get_distance(curr_tap, best_next_tap)
                         distance = GeneralUtils.get_distance(curr_tap, next_tap)
                         if distance < min_distance:
-                            best_next_tap = next_tap;
+                            best_next_tap = next_tap
                         # if the shortest distance from that tap hasn't been found
                         # add it to the queue
                         else:
@@ -209,44 +204,66 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
                     distance = GeneralUtils.get_distance(curr_tap, best_next_tap)
                     # if the distance is close enough, add the found tap to the
                     # tap group
-                    if distance < TAP_EPSILON:
-                        best_next_tap.set_visited(True)
-                        tap_group.append(best_next_tap)
-                    # otherwise, the tap group is complete
-                    else:
-                        tap_groups.append(tap_group)
+                    if distance >= TAP_EPSILON:
+                        # otherwise, the tap group is complete
+                        complete = True
                         break
+                    best_next_tap.set_visited(True)
+                    tap_group.append(best_next_tap)
                     
                     # find the next tap that can be linked in this group
                     curr_tap = best_next_tap
+                    next_taps = frame_taps.get(curr_tap.get_frame() + 1)
 
-                # takes care of last tap group
-                if (len(tap_group) > 0) and (tap_group not in tap_groups):
+                # groups ending with the frame group are dropped if identical
+                # to a group found before
+                group_key = tuple((tap.get_x(), tap.get_y()) for tap in tap_group)
+                if complete or group_key not in group_keys:
                     tap_groups.append(tap_group)
-        
-        i = 0
-        while i < len(tap_groups):
-            tap_group = tap_groups[i]
-            if len(tap_group) > TAP_THRESHOLD:
-                i += 1
-                continue
-            # last tap in the group
-            curr_tap = tap_group[len(tap_group)-1]
-            k = 1
-            while k < len(tap_groups):
-                next_tap_group = tap_groups[k]
-                # first tap in the next group
-                next_tap = next_tap_group[0]
-                # if the tap groups occur on consecutive frames, group them
-                if curr_tap.get_frame() + 1 == next_tap.get_frame():
-                    tap_group.extend(tap_groups[k])
-                    tap_groups.pop(k)
-                    k -= 1
-
-                curr_tap = tap_group[len(tap_group)-1]  
-                k += 1
-            i += 1
-        return tap_groups
+                    group_keys.add(group_key)
+
+        # positions in tap_groups of the groups starting on each frame
+        group_starts = defaultdict(list)
+        for position, tap_group in enumerate(tap_groups):
+            group_starts[tap_group[0].get_frame()].append(position)
+        # groups not merged yet, as a linked list of positions
+        following = list(range(1, len(tap_groups) + 1))
+        preceding = list(range(-1, len(tap_groups) - 1))
+
+        position = 0
+        while position < len(tap_groups):
+            tap_group = tap_groups[position]
+            merged_before = 0
+            if len(tap_group) <= TAP_THRESHOLD:
+                # merge, in order, the groups after the first one that start
+                # on the frame after the last tap of the group
+                merged = 0
+                while True:
+                    starts = group_starts.get(tap_group[-1].get_frame() + 1)
+                    if not starts:
+                        break
+                    i = bisect.bisect_right(starts, merged)
+                    if i == len(starts):
+                        break
+                    merged = starts.pop(i)
+                    tap_group.extend(tap_groups[merged])
+                    following[preceding[merged]] = following[merged]
+                    if following[merged] < len(tap_groups):
+                        preceding[following[merged]] = preceding[merged]
+                    if merged < position:
+                        merged_before += 1
+            # every group merged before this one moves the groups after it
+            # back a place, so as many groups are passed over
+            for _ in range(merged_before + 1):
+                if position < len(tap_groups):
+                    position = following[position]
+
+        merged_groups = []
+        position = 0
+        while position < len(tap_groups):
+            merged_groups.append(tap_groups[position])
+            position = following[position]
+        return merged_groups
 
     def group_actions(self, tap_groups):
         """
@@ -254,32 +271,33 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
 
         Parameters
         ----------
-        tap_groups : list of list of ScreenTaps
+        tap_groups : list of list of TapViews
             grouped screen taps to be classified into actions
         """
+        x = self.touch_detections.get_column("x")
+        y = self.touch_detections.get_column("y")
+        frame_ids = self.touch_detections.get_column("frame_id")
+        group_ids = self.touch_detections.get_column("group_id")
         result_list_group = []
-        for group in tap_groups:
+        for group_id, group in enumerate(tap_groups):
+            rows = self.__get_rows(group)
+            group_ids[rows] = group_id
             # set type to default as click or long click depending on # taps
             action_type = -1
             if len(group) < LONG_CLICK_FRAMES:
                 action_type = ActionType.CLICK
             else:
                 action_type = ActionType.LONG_CLICK
-            initial_tap = group[0]
-            for tap in group:
-                # TODO : may need to change SWIPES_THRESHOLD to detect more 
-                # minute swipes --> 10-25 is a good value?
-                # determine if group distance deviates enough to be a swipe
-                distance = GeneralUtils.get_distance(tap, initial_tap)
-                if distance >= SWIPES_THRESHOLD:
-                    action_type = ActionType.SWIPE
-                    break
+            # determine if group distance deviates enough to be a swipe
+            distances = np.sqrt((x[rows] - x[rows[0]]) ** 2 + (y[rows] - y[rows[0]]) ** 2)
+            if np.any(distances >= SWIPES_THRESHOLD):
+                action_type = ActionType.SWIPE
             
             # create list of frame ids for each tap
-            frames = [tap.get_frame() for tap in group]
+            frames = frame_ids[rows].tolist()
             result_list_group.append(GUIAction(group, frames, action_type))
 
-        self.detected_actions = result_list_group;
+        self.detected_actions = result_list_group
 
     def group_by_opacity(self):
         """
@@ -288,6 +306,7 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         middle of it. Filters groups based on this.
         """
         new_actions = []
+        opacity_conf = self.touch_detections.get_column("opacity_conf")
 
         for action in self.detected_actions:
             if ((action.get_type() == ActionType.LONG_CLICK) or 
@@ -296,16 +315,20 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
                 new_tap_group = []
                 frames = []
 
+                # see if each pair of taps is part of the same group or not
+                # based on opacity; should be included if the opacity is very
+                # high and if the opacity is not increasing
+                opacities = opacity_conf[self.__get_rows(tap_group)]
+                same_group = ((opacities[1:] == 0.0) | 
+                              ~self.__opacity_increasing(opacities)).tolist()
+
                 current_tap = tap_group[0]
 
                 # cycle through pairs of taps
                 for i in range(1, len(tap_group)):
                     next_tap = tap_group[i]
                     
-                    # see if part of the same group or not based on opacity
-                    # should be included if the opacity is very high and if the opacity is not increasing
-                    if ((next_tap.get_opacity_confidence() == 0.0) or 
-                        (not self.__opacity_increasing(current_tap, next_tap))):
+                    if same_group[i-1]:
                         new_tap_group.append(current_tap)
                         frames.append(current_tap.get_frame())
                     # if it is not part of the group, make sure the group is large
@@ -329,23 +352,24 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         new_actions = self.__fix_types_on_new_actions(new_actions)
         self.detected_actions = new_actions
 
-    def __opacity_increasing(self, curr_tap, next_tap, 
-                             threshold=OPACITY_THRESHOLD):
+    def __opacity_increasing(self, opacities, threshold=OPACITY_THRESHOLD):
         """
-        Determines if opacity is increasing between two taps relative to a given
-        threshold.
+        Determines if opacity is increasing between each pair of consecutive
+        taps relative to a given threshold.
 
         Parameters
         ----------
-        curr_tap : ScreenTap
-            first tap
-        next_tap : ScreenTap
-            second tap
+        opacities : np array
+            opacity confidence of consecutive taps
         threshold : int, optional
             threshold to judge increasing
+
+        Returns
+        -------
+        increasing : np array of bools
+            whether opacity increases from each tap to the next
         """
-        return ((curr_tap.get_opacity_confidence() < threshold) and 
-                        (next_tap.get_opacity_confidence() >= threshold))
+        return (opacities[:-1] < threshold) & (opacities[1:] >= threshold)
 
     def __fix_types_on_new_actions(self, actions):
         """
@@ -378,6 +402,8 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         actions. Filters groups based on this.
         """
         new_actions = []
+        if len(self.detected_actions) == 0:
+            return
         current = self.detected_actions[0]
 
         for i in range(1, len(self.detected_actions)):
@@ -430,49 +456,65 @@ class GUIActionClassifier(AbstractGUIActionClassifier):
         # complete more accuracy procedures
         # filter out actions that overlap with complex actions (swipes)
 
+        # first and last frame of each action
+        first_frames = np.array([action.get_frames()[0] for action in self.detected_actions])
+        last_frames = np.array([action.get_frames()[-1] for action in self.detected_actions])
         # isolate swipes
-        swipes = [action for action in self.detected_actions if action.get_type() == ActionType.SWIPE]
+        is_swipe = np.array([action.get_type() == ActionType.SWIPE for action in self.detected_actions],
+                            dtype=bool)
+        swipe_first_frames = first_frames[is_swipe]
+        swipe_last_frames = last_frames[is_swipe]
+        # if a swipe is marked as starting before the action but ends after
+        # the action, remove the action
+        inside_swipe = np.zeros(len(self.detected_actions), dtype=bool)
+        for first_frame, last_frame in zip(swipe_first_frames, swipe_last_frames):
+            inside_swipe |= (first_frame < first_frames) & (last_frame > last_frames)
+        self.detected_actions = [action for action, inside in 
+                                 zip(self.detected_actions, inside_swipe) if not inside]
+
+        x = self.touch_detections.get_column("x")
+        y = self.touch_detections.get_column("y")
+        opacity_conf = self.touch_detections.get_column("opacity_conf")
         remove = []
         for action in self.detected_actions:
-            for swipe in swipes:
-                swipe_frames = swipe.get_frames()
-                act_frames = action.get_frames()
-                # if a swipe is marked as starting before the action but ends after
-                # the action, remove the action
-                if ((swipe_frames[0] < act_frames[0]) and 
-                    (swipe_frames[len(swipe_frames)-1] > act_frames[len(act_frames)-1])):
-                    remove.append(action)
-        # remove the elements in remove from detected actions
-        self.detected_actions = [x for x in self.detected_actions if x not in remove]
-        remove.clear()
-
-        for action in self.detected_actions:
-            total = 0
             taps = action.get_taps()
+            rows = self.__get_rows(taps)
             # remove groups with very low opacity because they may not be real taps
-            for tap in taps:
-                # add up all average opacities across group
-                total += tap.get_opacity_confidence() / len(taps)
-            if (total != 0 and (total < 1.e-3 or (1-total) < 1.e-3) and (action.get_type() == ActionType.LONG_CLICK)):
-                remove.append(action)
+            # add up all average opacities across group
+            total = np.sum(opacity_conf[rows] / len(taps))
+            remove.append(total != 0 and (total < 1.e-3 or (1-total) < 1.e-3) and 
+                          (action.get_type() == ActionType.LONG_CLICK))
             
             # fix swipes to only include taps that move a lot of distance
             if action.get_type() == ActionType.SWIPE:
-                counter = 0
-                for i in range(len(taps)-1, 0, -1):
-                    tap_last = taps[i]
-                    tap_before = taps[i-1]
-                    if GeneralUtils.get_distance(tap_last, tap_before) < 10:
-                        counter += 1
-                    else:
-                        break
+                # the last taps closer than 10 to the tap before them
+                steps = np.sqrt(np.diff(x[rows]) ** 2 + np.diff(y[rows]) ** 2)
+                moving = np.flatnonzero(steps >= 10)
+                counter = len(steps) - 1 - moving[-1] if len(moving) != 0 else len(steps)
 
                 # remove taps past counter
                 action.set_taps(taps[0:len(taps)-counter])
                 frames = action.get_frames()
                 action.set_frames(frames[0:len(frames)-counter])
         # remove all actions that are in remove
-        self.detected_actions = [x for x in self.detected_actions if x not in remove]
+        self.detected_actions = [action for action, removed in 
+                                 zip(self.detected_actions, remove) if not removed]
+
+    def __get_rows(self, taps):
+        """
+        Returns the rows of taps in the detection table.
+
+        Parameters
+        ----------
+        taps : list of TapViews
+            taps of the detection table
+
+        Returns
+        -------
+        rows : np array
+            row of each tap
+        """
+        return np.fromiter((tap.get_index() for tap in taps), dtype=np.intp, count=len(taps))
 
     def get_touch_detections(self):
         """
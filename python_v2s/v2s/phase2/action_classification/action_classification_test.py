@@ -0,0 +1,129 @@
+# action_classification_test.py
+import random
+import unittest
+
+from v2s.phase2.action_classification.action_classification import \
+    GUIActionClassifier
+from v2s.util.constants import TAP_EPSILON, TAP_THRESHOLD
+from v2s.util.detection_table import DetectionTable
+from v2s.util.general import GeneralUtils
+from v2s.util.screen import Frame, ScreenTap
+
+
+def baseline_group_taps_graph_alg(frame_groups):
+    """
+    group_taps_graph_alg as it was before it was indexed by frame id, kept to
+    check the indexed version finds the same groups.
+    """
+    tap_groups = []
+
+    for frame_group in frame_groups:
+        initial_frame = frame_group[0]
+
+        queue = []
+        queue.extend(initial_frame.get_screen_taps())
+        while (len(queue)!=0):
+            curr_tap = queue.pop(0)
+            if (curr_tap.is_visited()):
+                continue
+
+            curr_tap.set_visited(True)
+
+            tap_group = []
+            tap_group.append(curr_tap)
+
+            for i in range(1, len(frame_group)):
+                if curr_tap.get_frame() + 1 != frame_group[i].get_id():
+                    continue
+                next_taps = frame_group[i].get_screen_taps()
+
+                best_next_tap = next_taps[0]
+                for next_tap in next_taps:
+                    if next_tap.is_visited():
+                        continue
+
+                    min_distance = GeneralUtils.get_distance(curr_tap, best_next_tap)
+                    distance = GeneralUtils.get_distance(curr_tap, next_tap)
+                    if distance < min_distance:
+                        best_next_tap = next_tap
+                    else:
+                        queue.append(next_tap)
+
+                distance = GeneralUtils.get_distance(curr_tap, best_next_tap)
+                if distance < TAP_EPSILON:
+                    best_next_tap.set_visited(True)
+                    tap_group.append(best_next_tap)
+                else:
+                    tap_groups.append(tap_group)
+                    break
+
+                curr_tap = best_next_tap
+
+            if (len(tap_group) > 0) and (tap_group not in tap_groups):
+                tap_groups.append(tap_group)
+
+    i = 0
+    while i < len(tap_groups):
+        tap_group = tap_groups[i]
+        if len(tap_group) > TAP_THRESHOLD:
+            i += 1
+            continue
+        curr_tap = tap_group[len(tap_group)-1]
+        k = 1
+        while k < len(tap_groups):
+            next_tap_group = tap_groups[k]
+            next_tap = next_tap_group[0]
+            if curr_tap.get_frame() + 1 == next_tap.get_frame():
+                tap_group.extend(tap_groups[k])
+                tap_groups.pop(k)
+                k -= 1
+
+            curr_tap = tap_group[len(tap_group)-1]
+            k += 1
+        i += 1
+    return tap_groups
+
+
+def make_frames(seed):
+    """
+    Returns random frames of one to three fingers, mostly consecutive, with
+    taps often at the same place so groups repeat and merge.
+    """
+    rng = random.Random(seed)
+    num_frames = rng.randint(1, 60)
+    fingers = rng.randint(1, 3)
+    jitter = rng.choice([0, 1])
+    frames = []
+    frame_id = 0
+    while len(frames) < num_frames:
+        frame_id += rng.choice([1, 1, 1, 1, 2, 3])
+        frame = Frame(frame_id)
+        for _ in range(rng.randint(1, fingers)):
+            x = rng.choice([100, 100 + rng.randint(-25, 25) * jitter, rng.randint(0, 1000)])
+            y = rng.choice([300, rng.randint(0, 1000)])
+            frame.add_tap(ScreenTap(float(x), float(y), 0.9, rng.random(), frame_id))
+        frames.append(frame)
+    return frames
+
+
+class GroupTapsGraphAlgTest(unittest.TestCase):
+
+    def test_same_groups_as_baseline(self):
+        for seed in range(500):
+            with self.subTest(seed=seed):
+                classifier = GUIActionClassifier(DetectionTable.from_frames(make_frames(seed)))
+                table = classifier.get_touch_detections()
+                frame_groups = classifier.group_consecutive_frames()
+
+                expected = baseline_group_taps_graph_alg(frame_groups)
+                expected_visited = table.visited.copy()
+                table.visited[:] = False
+                groups = classifier.group_taps_graph_alg(frame_groups)
+
+                self.assertEqual([[tap.get_index() for tap in group] for group in groups],
+                                 [[tap.get_index() for tap in group] for group in expected])
+                self.assertEqual(table.visited.tolist(), expected_visited.tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
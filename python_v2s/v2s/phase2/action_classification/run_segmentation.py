@@ -0,0 +1,279 @@
+# run_segmentation.py
+import numpy as np
+
+from v2s.util.constants import RUN_LONG_CLICK_FRAMES, RUN_SWIPE_DISTANCE
+from v2s.util.event import ActionType, GUIAction
+from v2s.util.screen import ScreenTap
+
+
+class ActionRuns():
+    """
+    Segments touch detections into actions, one per run of consecutive frames
+    with a touch, computed on whole arrays instead of frame by frame. Only the
+    first tap of each frame is used.
+
+    A run is a SWIPE if its first and second to last taps are more than
+    RUN_SWIPE_DISTANCE apart, otherwise a LONG_CLICK if it lasts more than
+    RUN_LONG_CLICK_FRAMES frames, or a CLICK. Clicks are located at the
+    floored mean of their taps, and swipes keep every tap, floored.
+
+    Attributes
+    ----------
+    frame_ids : np array
+        id of each frame with a touch, in frame order
+    x : np array
+        x-coordinate of the first tap of each frame
+    y : np array
+        y-coordinate of the first tap of each frame
+    table : DetectionTable
+        detections the first taps were taken from; None if built from arrays
+    rows : np array
+        row of the table holding the first tap of each frame
+    starts : np array
+        index of the first frame of each run
+    durations : np array
+        number of frames of each run
+    displacements : np array
+        distance between the first and second to last tap of each run
+    act_types : np array
+        ActionType value of each run
+    centroids : np array
+        floored mean of the taps of each run, one row of x and y per run
+
+    Methods
+    -------
+    from_arrays(frame_ids, x, y)
+        Returns the runs of the first tap of each frame.
+    from_table(table)
+        Returns the runs of a DetectionTable.
+    from_json(frames)
+        Returns the runs of Frames loaded from json.
+    get_durations()
+        Returns the number of frames of each run.
+    get_displacements()
+        Returns the distance the touch moved in each run.
+    get_act_types()
+        Returns the ActionType value of each run.
+    get_centroids()
+        Returns the floored mean of the taps of each run.
+    get_records()
+        Returns a dict per run with its type, taps and first frame.
+    get_actions()
+        Returns a GUIAction per run.
+    __segment()
+        Finds the runs and computes their type and centroid.
+    """
+
+    def __init__(self, frame_ids, x, y, table=None, rows=None):
+        """
+        Parameters
+        ----------
+        frame_ids : np array
+            id of each frame with a touch, in frame order
+        x : np array
+            x-coordinate of the first tap of each frame
+        y : np array
+            y-coordinate of the first tap of each frame
+        table : DetectionTable, optional
+            detections the first taps were taken from
+        rows : np array, optional
+            row of the table holding the first tap of each frame
+        """
+        self.frame_ids = np.asarray(frame_ids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.table = table
+        self.rows = rows
+        self.__segment()
+
+    @staticmethod
+    def from_arrays(frame_ids, x, y):
+        """
+        Returns the runs of the first tap of each frame.
+
+        Parameters
+        ----------
+        frame_ids : array-like
+            id of each frame with a touch, in frame order
+        x : array-like
+            x-coordinate of the first tap of each frame
+        y : array-like
+            y-coordinate of the first tap of each frame
+
+        Returns
+        -------
+        runs : ActionRuns
+            segmented runs
+        """
+        return ActionRuns(frame_ids, x, y)
+
+    @staticmethod
+    def from_table(table):
+        """
+        Returns the runs of a DetectionTable, whose taps are then the taps of
+        the actions.
+
+        Parameters
+        ----------
+        table : DetectionTable
+            detections, as filtered for classification
+
+        Returns
+        -------
+        runs : ActionRuns
+            segmented runs
+        """
+        frame_ids = table.get_column("frame_id")
+        # rows of a frame are contiguous, its first row starts it
+        rows = np.flatnonzero(np.diff(frame_ids, prepend=frame_ids[:1] - 1) != 0)
+        return ActionRuns(frame_ids[rows], table.get_column("x")[rows],
+                          table.get_column("y")[rows], table, rows)
+
+    @staticmethod
+    def from_json(frames):
+        """
+        Returns the runs of Frames loaded from json; frames without taps end
+        a run.
+
+        Parameters
+        ----------
+        frames : list of dicts
+            json of a list of Frames, in frame order
+
+        Returns
+        -------
+        runs : ActionRuns
+            segmented runs
+        """
+        frames = [frame for frame in frames if len(frame["screenTap"]) != 0]
+        frame_ids = np.fromiter((frame["screenId"] for frame in frames), dtype=np.int64, count=len(frames))
+        x = np.fromiter((frame["screenTap"][0]["x"] for frame in frames), dtype=np.float64, count=len(frames))
+        y = np.fromiter((frame["screenTap"][0]["y"] for frame in frames), dtype=np.float64, count=len(frames))
+        return ActionRuns(frame_ids, x, y)
+
+    def get_durations(self):
+        """
+        Returns the number of frames of each run.
+
+        Returns
+        -------
+        durations : np array
+            frames per run
+        """
+        return self.durations
+
+    def get_displacements(self):
+        """
+        Returns the distance between the first and second to last tap of each
+        run.
+
+        Returns
+        -------
+        displacements : np array
+            distance per run
+        """
+        return self.displacements
+
+    def get_act_types(self):
+        """
+        Returns the ActionType value of each run.
+
+        Returns
+        -------
+        act_types : np array
+            type per run
+        """
+        return self.act_types
+
+    def get_centroids(self):
+        """
+        Returns the floored mean of the taps of each run.
+
+        Returns
+        -------
+        centroids : np array
+            x and y per run
+        """
+        return self.centroids
+
+    def get_records(self):
+        """
+        Returns a dict per run with its type, taps and first frame, as the
+        Flask application outputs actions.
+
+        Returns
+        -------
+        records : list of dicts
+            actions, in order
+        """
+        floor_x = np.floor_divide(self.x, 1).tolist()
+        floor_y = np.floor_divide(self.y, 1).tolist()
+        first_frames = self.frame_ids[self.starts].tolist()
+        centroids = self.centroids.tolist()
+        records = []
+        for start, duration, act_type, first_frame, centroid in zip(
+                self.starts.tolist(), self.durations.tolist(), self.act_types.tolist(),
+                first_frames, centroids):
+            act_type = ActionType(act_type)
+            if act_type == ActionType.SWIPE:
+                taps = [{"x": x, "y": y} for x, y in
+                        zip(floor_x[start:start + duration], floor_y[start:start + duration])]
+            else:
+                taps = [{"x": centroid[0], "y": centroid[1]}]
+            records.append({"first_frame": first_frame, "act_type": act_type.name, "taps": taps})
+        return records
+
+    def get_actions(self):
+        """
+        Returns a GUIAction per run, with the first tap of each of its frames;
+        TapViews of the table when built from one, ScreenTaps otherwise.
+
+        Returns
+        -------
+        actions : list of GUIActions
+            actions, in order
+        """
+        actions = []
+        for start, duration, act_type in zip(self.starts.tolist(), self.durations.tolist(),
+                                             self.act_types.tolist()):
+            stop = start + duration
+            frames = self.frame_ids[start:stop].tolist()
+            if self.table is not None:
+                taps = [self.table.get_tap(row) for row in self.rows[start:stop].tolist()]
+            else:
+                taps = [ScreenTap(x, y, frame=frame) for x, y, frame in
+                        zip(self.x[start:stop].tolist(), self.y[start:stop].tolist(), frames)]
+            actions.append(GUIAction(taps, frames, ActionType(act_type)))
+        return actions
+
+    def __segment(self):
+        """
+        Finds the runs of consecutive frames and computes the displacement,
+        duration, type and centroid of all of them at once.
+        """
+        # a run ends wherever the next frame is not the following one
+        breaks = np.flatnonzero(np.diff(self.frame_ids) != 1) + 1
+        self.starts = np.concatenate(([0], breaks)) if len(self.frame_ids) != 0 else breaks
+        self.durations = np.diff(np.append(self.starts, len(self.frame_ids)))
+
+        # a single tap is compared with itself
+        ends = self.starts + np.maximum(self.durations - 2, 0)
+        delta_x = self.x[self.starts] - self.x[ends]
+        delta_y = self.y[self.starts] - self.y[ends]
+        self.displacements = np.sqrt(delta_x ** 2 + delta_y ** 2)
+        self.act_types = np.where(self.displacements > RUN_SWIPE_DISTANCE, ActionType.SWIPE.value,
+                                  np.where(self.durations > RUN_LONG_CLICK_FRAMES,
+                                           ActionType.LONG_CLICK.value, ActionType.CLICK.value))
+
+        # taps are summed in frame order, the k-th tap of every run long
+        # enough at once, so sums round as a sequential sum of each run would
+        sum_x = self.x[self.starts].copy()
+        sum_y = self.y[self.starts].copy()
+        longest = np.argsort(-self.durations, kind="stable")
+        sorted_durations = -self.durations[longest]
+        for k in range(1, self.durations.max(initial=0)):
+            runs = longest[:np.searchsorted(sorted_durations, -k, side="left")]
+            sum_x[runs] += self.x[self.starts[runs] + k]
+            sum_y[runs] += self.y[self.starts[runs] + k]
+        self.centroids = np.stack((np.floor_divide(sum_x, self.durations),
+                                   np.floor_divide(sum_y, self.durations)), axis=1)
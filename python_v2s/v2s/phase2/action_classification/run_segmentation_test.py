@@ -0,0 +1,124 @@
+# run_segmentation_test.py
+import math
+import random
+import unittest
+
+from v2s.phase2.action_classification.run_segmentation import ActionRuns
+from v2s.util.detection_table import DetectionTable
+from v2s.util.event import ActionType
+
+
+def baseline_extract_action(incomplete_actions):
+    """
+    extract_action of the Flask application as it was before it segmented on
+    arrays, kept to check ActionRuns gives the same actions.
+    """
+    def get_action(taps):
+        n = len(taps)
+        x0, y0 = taps[0]["x"], taps[0]["y"]
+        x2, y2 = taps[n - 2]["x"], taps[n - 2]["y"]
+        if math.sqrt(((x0 - x2) ** 2) + ((y0 - y2) ** 2)) > 5:
+            return "SWIPE"
+        return "LONG_CLICK" if n > 30 else "CLICK"
+
+    def make_action(frames, taps):
+        act_type = get_action(taps)
+        action = {"first_frame": frames[0], "act_type": act_type}
+        if act_type == "SWIPE":
+            action["taps"] = [{"x": tap["x"] // 1, "y": tap["y"] // 1} for tap in taps]
+        else:
+            x = 0
+            y = 0
+            for tap in taps:
+                x += tap["x"]
+                y += tap["y"]
+            action["taps"] = [{"x": x // len(taps), "y": y // len(taps)}]
+        return action
+
+    prev = incomplete_actions[0]
+    runs = [([prev["screenId"]], [prev["screenTap"][0]])]
+    for action in incomplete_actions[1:]:
+        if action["screenId"] - prev["screenId"] != 1:
+            runs.append(([], []))
+        runs[-1][0].append(action["screenId"])
+        runs[-1][1].append(action["screenTap"][0])
+        prev = action
+    return [make_action(frames, taps) for frames, taps in runs]
+
+
+def make_frames(seed):
+    """
+    Returns the json of random frames holding clicks, long clicks and swipes
+    of one or two fingers, with a few frames without taps, and coordinates
+    often repeated with one decimal so centroids are sums of the same values.
+    """
+    rng = random.Random(seed)
+    frames = []
+    frame_id = rng.randint(1, 5)
+    for _ in range(rng.randint(1, 15)):
+        frame_id += rng.randint(1, 5)
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1800)
+        dx, dy = rng.choice([(0.0, 0.0), (rng.uniform(-40, 40), rng.uniform(-40, 40))])
+        for i in range(rng.choice([1, 2, rng.randint(1, 60)])):
+            taps = []
+            if rng.random() > 0.05:
+                if rng.random() < 0.3:
+                    tap_x, tap_y = rng.choice([100.1, 200.3, 0.7]), rng.choice([10.1, 0.3])
+                else:
+                    tap_x = round(x + dx * i + rng.uniform(-2, 2), 1)
+                    tap_y = round(y + dy * i + rng.uniform(-2, 2), 1)
+                taps.append({"x": tap_x, "y": tap_y, "confidence": 0.9,
+                             "confidenceOpacity": rng.random(), "frame": frame_id})
+                if rng.random() < 0.1:
+                    taps.append({"x": rng.uniform(0, 1000), "y": rng.uniform(0, 1800),
+                                 "confidence": 0.9, "confidenceOpacity": rng.random(),
+                                 "frame": frame_id})
+            frames.append({"screenId": frame_id, "screenTap": taps})
+            frame_id += 1
+    return frames
+
+
+class ActionRunsTest(unittest.TestCase):
+
+    def test_same_actions_as_baseline(self):
+        for seed in range(500):
+            with self.subTest(seed=seed):
+                frames = make_frames(seed)
+                touched = [frame for frame in frames if len(frame["screenTap"]) != 0]
+                if len(touched) == 0:
+                    continue
+                self.assertEqual(ActionRuns.from_json(frames).get_records(),
+                                 baseline_extract_action(touched))
+
+    def test_from_table(self):
+        for seed in range(50):
+            with self.subTest(seed=seed):
+                frames = make_frames(seed)
+                runs = ActionRuns.from_table(DetectionTable.from_json(frames))
+                expected = ActionRuns.from_json(frames)
+                self.assertEqual(runs.get_records(), expected.get_records())
+                self.assertEqual(runs.get_act_types().tolist(), expected.get_act_types().tolist())
+                # actions keep the first tap of each frame, from the table
+                for action in runs.get_actions():
+                    self.assertEqual([tap.get_frame() for tap in action.get_taps()],
+                                     action.get_frames())
+
+    def test_act_types(self):
+        # a click, a long click and a swipe
+        frame_ids = list(range(1, 4)) + list(range(10, 42)) + list(range(50, 54))
+        x = [10.0] * 3 + [20.0] * 32 + [30.0, 40.0, 50.0, 60.0]
+        runs = ActionRuns.from_arrays(frame_ids, x, [5.0] * len(x))
+        self.assertEqual(runs.get_durations().tolist(), [3, 32, 4])
+        self.assertEqual(runs.get_displacements().tolist(), [0.0, 0.0, 20.0])
+        self.assertEqual([ActionType(act_type) for act_type in runs.get_act_types()],
+                         [ActionType.CLICK, ActionType.LONG_CLICK, ActionType.SWIPE])
+        self.assertEqual(runs.get_centroids()[:2].tolist(), [[10.0, 5.0], [20.0, 5.0]])
+
+    def test_empty(self):
+        runs = ActionRuns.from_json([{"screenId": 1, "screenTap": []}])
+        self.assertEqual(runs.get_records(), [])
+        self.assertEqual(runs.get_actions(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
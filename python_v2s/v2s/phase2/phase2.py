@@ -5,24 +5,26 @@ import os
 from v2s.phase import AbstractPhase
 from v2s.phase2.action_classification.action_classification import \
     GUIActionClassifier
+from v2s.phase2.action_classification.run_segmentation import ActionRuns
 from v2s.util.constants import THRESHOLD_CONFIDENCE
+from v2s.util.detection_table import ActionTable, DetectionTable
 from v2s.util.event import GUIAction
 from v2s.util.general import JSONFileUtils
-from v2s.util.screen import Frame, ScreenTap
 
 
 class Phase2V2S(AbstractPhase):
     """
     Takes touch detections from Phase 1 and classifies them into discrete actions
-    on the screen. Loads in detections from json file from Phase1 and translates
-    to output a list of GUIActions.
+    on the screen. Receives detections from Phase1 in memory, or loads them from
+    its file when run on its own, and translates to output a list of
+    GUIActions.
 
     Attributes
     ----------
     config : dict
         configuration with video/replay information
-    touch_detections : list of Frames
-        detections from Phase 1
+    touch_detections : DetectionTable
+        detections from Phase 1; None until handed over or read from file
     action_classifier : GUIActionClassifier
         will take care of classification
     actions : list of GUIActions
@@ -32,6 +34,12 @@ class Phase2V2S(AbstractPhase):
     --------
     execute()
         Execute the action classification.
+    set_input(dets)
+        Receives detections from Phase 1.
+    get_output()
+        Returns list of GUIActions, the output of the phase.
+    read_detections(detection_path)
+        Reads detections from the .npy file from Phase 1.
     read_detections_from_json(detection_path)
         Reads detections from json file from Phase 1.
     get_actions()
@@ -56,7 +64,7 @@ class Phase2V2S(AbstractPhase):
             configuration for video and device
         """
         self.config = config
-        self.touch_detections = []
+        self.touch_detections = None
         self.action_classifier = GUIActionClassifier()
         self.actions = []
     
@@ -73,33 +81,73 @@ class Phase2V2S(AbstractPhase):
 
         logging.basicConfig(filename=os.path.join(cur_dir_path, 'v2s.log'), filemode='w', level=logging.INFO)
 
-        detection_path = os.path.join(cur_dir_path, "detection_full.json")
-        self.read_detections_from_json(detection_path, video_file)
+        # detections are read from phase 1's file unless handed over; json
+        # is read for results of older versions
+        if self.touch_detections is None:
+            detection_path = os.path.join(cur_dir_path, "detection_full.npy")
+            if os.path.exists(detection_path):
+                self.read_detections(detection_path)
+            else:
+                detection_path = os.path.join(cur_dir_path, "detection_full.json")
+                self.read_detections_from_json(detection_path, video_file)
         
-        # filter detections before classifying
-        final_detections = []
-        for detection in self.touch_detections:
-            remove = []
-            for i in range(len(detection.get_screen_taps())):
-                if detection.get_screen_taps()[i].get_touch_confidence() < THRESHOLD_CONFIDENCE:
-                    remove.append(detection.get_screen_taps()[i])
-                
-            detection.set_screen_taps([tap for tap in detection.get_screen_taps() if tap not in remove])
-            if len(detection.get_screen_taps()) != 0:
-                final_detections.append(detection)
-        
-        self.touch_detections = final_detections
-
-        self.action_classifier.set_touch_detections(self.touch_detections)
-        self.action_classifier.execute_classification()
-
-        actions = self.action_classifier.get_detected_actions()
+        if not isinstance(self.touch_detections, DetectionTable):
+            self.touch_detections = DetectionTable.from_frames(self.touch_detections)
+
+        # filter detections before classifying; frames left without taps
+        # drop out of the table
+        touch_conf = self.touch_detections.get_column("touch_conf")
+        self.touch_detections = self.touch_detections.select(touch_conf >= THRESHOLD_CONFIDENCE)
+
+        # runs of consecutive frames can be taken as the actions instead, as
+        # the Flask application does
+        if self.config.get("segment_runs", False):
+            actions = ActionRuns.from_table(self.touch_detections).get_actions()
+        else:
+            self.action_classifier.set_touch_detections(self.touch_detections)
+            self.action_classifier.execute_classification()
+            actions = self.action_classifier.get_detected_actions()
         # add actions to self.actions dictionary of this class
         self.actions = actions
 
-        action_path = os.path.join(cur_dir_path, "detected_actions.json")
+        if self.config.get("write_artifacts", True):
+            ActionTable.from_actions(actions).save(os.path.join(cur_dir_path, "detected_actions.npy"))
+            if self.config.get("export_json", True):
+                action_path = os.path.join(cur_dir_path, "detected_actions.json")
+                JSONFileUtils.output_data_to_json_async(actions, action_path)
+
+    def set_input(self, dets):
+        """
+        Receives detections from Phase 1, so they are not read from file.
+
+        Parameters
+        ----------
+        dets : list of Frames
+            detections with opacity confidence
+        """
+        self.touch_detections = DetectionTable.from_frames(dets)
+
+    def get_output(self):
+        """
+        Returns list of GUIActions, the output of the phase.
+
+        Returns
+        -------
+        actions : list of GUIActions
+            classified GUIActions
+        """
+        return self.actions
 
-        JSONFileUtils.output_data_to_json(actions, action_path)
+    def read_detections(self, detection_path):
+        """
+        Reads detections from the .npy file from phase 1, memory-mapped.
+
+        Parameters
+        ----------
+        detection_path : string
+            path to detection .npy file
+        """
+        self.touch_detections = DetectionTable.load(detection_path)
 
     def read_detections_from_json(self, detection_path, vid_file):
         """
@@ -116,33 +164,8 @@ class Phase2V2S(AbstractPhase):
         # a dictionary 
         data = JSONFileUtils.read_data_from_json(detection_path) 
         
-        # list of frames that will be appended to as they are loaded
-        frames = []
-
-        # file is a list of dictionaries
-        for det_dict in data:
-            frame_id = det_dict["screenId"]
-            taps = det_dict["screenTap"]
-            tap_list = []
-            # taps is a list of dictionaries with tap information
-            for tap in taps:
-                # extract tap information
-                x = tap["x"]
-                y = tap["y"]
-                touch_confidence = tap["confidence"]
-                opacity_confidence = tap["confidenceOpacity"]
-                # create new tap
-                new_tap = ScreenTap(x, y, touch_confidence)
-                new_tap.set_opacity_confidence(opacity_confidence)
-                # add the new tap to the list of taps associated with this frame
-                tap_list.append(new_tap)
-            # create new frame object
-            frame = Frame(frame_id)
-            frame.set_screen_taps(tap_list)
-            frames.append(frame)
-
-        # add these detections to the full detections dictionary
-        self.touch_detections = frames
+        # file is a list of frame dictionaries, read into the table directly
+        self.touch_detections = DetectionTable.from_json(data)
 
     def get_actions(self):
         """
@@ -194,7 +217,7 @@ class Phase2V2S(AbstractPhase):
 
         Returns
         -------
-        touch_detections : dict
+        touch_detections : DetectionTable
             touch detections from Phase1
         """
         return self.touch_detections
@@ -205,7 +228,7 @@ class Phase2V2S(AbstractPhase):
 
         Parameters
         ----------
-        dets : dict
+        dets : DetectionTable or list of Frames
             new detections
         """
         self.touch_detections = dets
@@ -1,6 +1,7 @@
 # pipeline.py
 from v2s.phase1.phase1 import Phase1V2S
 from v2s.phase2.phase2 import Phase2V2S
+from v2s.util.general import JSONFileUtils
 
 
 class Pipeline():
@@ -11,6 +12,8 @@ class Pipeline():
     ----------
     phases : list of AbstractPhases
         list of phases in pipeline
+    output : 
+        output of the last phase
 
     Methods
     -------
@@ -18,11 +21,14 @@ class Pipeline():
         Inserts a new phase into the pipeline.
     execute()
         Executes phases in the pipeline.
+    get_output()
+        Returns the output of the last phase.
     """
 
     def __init__(self):
         # create a list of phases
         self.phases = []
+        self.output = None
     
     def add_phase(self, phase):
         """
@@ -37,10 +43,31 @@ class Pipeline():
     
     def execute(self):
         """
-        Executes the pipeline by executing each phase listed.
+        Executes the pipeline by executing each phase listed. The output of
+        each phase is handed to the next in memory; the json files phases
+        write on the side are complete once this returns.
         """
-        for phase in self.phases:
-            phase.execute()
+        output = None
+        try:
+            for phase in self.phases:
+                if output is not None:
+                    phase.set_input(output)
+                phase.execute()
+                output = phase.get_output()
+        finally:
+            JSONFileUtils.wait_for_writes()
+        self.output = output
+
+    def get_output(self):
+        """
+        Returns the output of the last phase.
+
+        Returns
+        -------
+        output : 
+            output of the last phase executed
+        """
+        return self.output
 
 class PipelineV2S(Pipeline):
     """
@@ -52,14 +79,18 @@ class PipelineV2S(Pipeline):
         phases included in the pipeline
     """
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, frame_listener=None):
         """
         Parameters
         ----------
         args : arg parse
             arguments from command line
+        frame_listener : callable, optional
+            called with each frame detected by Phase1, while detection runs
         """
         super().__init__()
         # add appropriate phases for V2S to pipeline
-        self.add_phase(Phase1V2S(config))
+        phase1 = Phase1V2S(config)
+        phase1.set_frame_listener(frame_listener)
+        self.add_phase(phase1)
         # self.add_phase(Phase2V2S(config))
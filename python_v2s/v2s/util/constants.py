@@ -1,8 +1,67 @@
 # constants.py
+import os
 
 #### Phase1 ####
 # video manipulation
 FRAMES_PER_SECOND = 30
+DECODE_WORKERS = 4
+# frames waiting between pipeline stages
+FRAME_QUEUE_SIZE = 16
+# touch detection
+DETECTION_BATCH_SIZE = 8
+# tf session threads; 0 lets tf decide
+INTRA_OP_THREADS = 0
+INTER_OP_THREADS = 4
+# thread tuning: frames of the video timed per setting, and where the
+# fastest setting of each machine and model is kept
+TUNING_FRAMES = 8
+TUNING_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".v2s", "thread_tuning.json")
+# intra-op threads of each process when detection is sharded automatically
+SHARD_THREADS = 4
+# coarse-to-fine detection samples every COARSE_STEP-th frame, so every run
+# of TAP_THRESHOLD + 1 touched frames, the shortest Phase 2 keeps, is found
+COARSE_STEP = 6
+# frames are downscaled by this factor before inference
+INFERENCE_SCALE = 1.0
+TOUCH_SCORE_THRESHOLD = 0.5
+# opacity detection: crops passed to the opacity model at once
+OPACITY_BATCH_SIZE = 32
+WRITE_WORKERS = 2
+# threads of the TFLite interpreter
+TFLITE_THREADS = 4
+# static frame gating: largest mean gray level change of a block of
+# STATIC_FRAME_BLOCK x STATIC_FRAME_BLOCK pixels still considered static
+STATIC_FRAME_THRESHOLD = 8
+STATIC_FRAME_BLOCK = 16
+# touch tracking: indicators are followed on frames downsampled by
+# TRACK_DOWNSAMPLE, moving at most TRACK_SEARCH_RADIUS pixels per frame; the
+# model runs again when a match is below TRACK_MIN_CORRELATION or after
+# TRACK_KEYFRAME_INTERVAL tracked frames
+TRACK_DOWNSAMPLE = 4
+TRACK_SEARCH_RADIUS = 24
+TRACK_MIN_CORRELATION = 0.8
+TRACK_KEYFRAME_INTERVAL = 10
+# template touch detection: frames are downsampled so the indicator spans
+# about TEMPLATE_DISC_SIZE pixels; correlation peaks of at least
+# TEMPLATE_MIN_CORRELATION are reported, and the hybrid detector only trusts
+# those of at least TEMPLATE_CONFIDENT_CORRELATION without the trained model
+TEMPLATE_DISC_SIZE = 12
+TEMPLATE_MAX_TAPS = 2
+TEMPLATE_MIN_CORRELATION = 0.4
+TEMPLATE_CONFIDENT_CORRELATION = 0.6
+# shared inference server: frames of concurrent jobs are batched together,
+# waiting at most INFERENCE_MAX_LATENCY seconds for a batch to fill
+INFERENCE_SERVER_HOST = "localhost"
+INFERENCE_SERVER_PORT = 6001
+# clients authenticate with the secret in INFERENCE_AUTHKEY_ENV, or in the file
+# named by INFERENCE_AUTHKEY_FILE_ENV; without one the server only listens on
+# loopback, with a random key written to INFERENCE_LOCAL_AUTHKEY_PATH that
+# only its user can read
+INFERENCE_AUTHKEY_ENV = "V2S_INFERENCE_AUTHKEY"
+INFERENCE_AUTHKEY_FILE_ENV = "V2S_INFERENCE_AUTHKEY_FILE"
+INFERENCE_LOCAL_AUTHKEY_PATH = os.path.join(os.path.expanduser("~"), ".v2s", "inference_authkey")
+INFERENCE_MAX_BATCH_SIZE = 32
+INFERENCE_MAX_LATENCY = 0.02
 
 #### Phase2 ####
 # action classification
@@ -18,6 +77,11 @@ SWIPE_EPSILON = 50 # Need to tune more
 TAP_COUNT_THRESHOLD = 50
 LONG_CLICK_FRAMES = int(LONG_CLICK_THRESHOLD * FRAMES_PER_SECOND / 3)
 BEST_FIT_R = 0.75
+# run segmentation: a run of consecutive touched frames is a swipe once the
+# touch moved more than RUN_SWIPE_DISTANCE pixels, otherwise a long click if
+# longer than RUN_LONG_CLICK_FRAMES frames
+RUN_SWIPE_DISTANCE = 5
+RUN_LONG_CLICK_FRAMES = 30
 
 #### Phase3 ####
 # action translation
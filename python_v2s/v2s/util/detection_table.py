@@ -0,0 +1,697 @@
+# detection_table.py
+import numpy as np
+
+from v2s.util.event import ActionType, GUIAction
+from v2s.util.screen import Frame, ScreenTap
+
+# one row per detected tap; confidences missing are nan, taps not grouped yet
+# have group -1
+DETECTION_DTYPE = np.dtype([("frame_id", np.int32),
+                            ("x", np.float64),
+                            ("y", np.float64),
+                            ("touch_conf", np.float64),
+                            ("opacity_conf", np.float64),
+                            ("group_id", np.int32)])
+# taps of classified actions, grouped by action, with the type of their action
+ACTION_DTYPE = np.dtype(DETECTION_DTYPE.descr + [("act_type", np.int8)])
+
+
+class DetectionTable():
+    """
+    Touch detections of a video stored as columns, one row per tap, instead
+    of a ScreenTap object per tap inside a Frame per frame. A tap takes
+    DETECTION_DTYPE.itemsize bytes, and passes over the detections are done
+    on whole columns.
+
+    Rows of the same frame are contiguous and frames keep the order they
+    were detected in. TapView and FrameView give access to single taps and
+    frames through the ScreenTap and Frame methods.
+
+    Tables are saved as .npy files, which load memory-mapped so that only
+    the rows used are read from disk.
+
+    Attributes
+    ----------
+    rows : np structured array
+        taps, with dtype DETECTION_DTYPE
+    visited : np array of bools
+        visited status of each tap for grouping algorithm
+
+    Methods
+    -------
+    from_frames(frames)
+        Returns a table holding the taps of a list of Frames.
+    from_json(data)
+        Returns a table holding the taps of Frames loaded from json.
+    load(file_path, mmap)
+        Returns the table saved in a .npy file.
+    save(file_path)
+        Saves the table to a .npy file.
+    get_frame_range(first_frame, last_frame)
+        Returns a table of the taps of a range of frames.
+    select(mask)
+        Returns a table of the taps selected by a mask.
+    get_frame_ids()
+        Returns the id of each frame, in order.
+    get_frames()
+        Returns a FrameView of each frame, in order.
+    get_tap(index)
+        Returns a TapView of a row.
+    get_column(name)
+        Returns a column of the table.
+    to_frames()
+        Returns the taps as a list of Frames.
+    asJson()
+        Defines how to output DetectionTable to JSON file.
+    """
+
+    def __init__(self, rows=None):
+        """
+        Parameters
+        ----------
+        rows : np structured array, optional
+            taps, with dtype DETECTION_DTYPE; empty if None
+        """
+        if rows is None:
+            rows = np.empty(0, dtype=DETECTION_DTYPE)
+        self.rows = rows
+        self.visited = np.zeros(len(rows), dtype=bool)
+
+    @staticmethod
+    def from_frames(frames):
+        """
+        Returns a table holding the taps of a list of Frames; frames without
+        taps are left out.
+
+        Parameters
+        ----------
+        frames : list of Frames
+            detected frames
+
+        Returns
+        -------
+        table : DetectionTable
+            taps of the frames
+        """
+        rows = np.array([(frame.get_id(), tap.get_x(), tap.get_y(),
+                          tap.get_touch_confidence(), tap.get_opacity_confidence(), -1)
+                         for frame in frames for tap in frame.get_screen_taps()],
+                        dtype=DETECTION_DTYPE)
+        return DetectionTable(rows)
+
+    @staticmethod
+    def from_json(data):
+        """
+        Returns a table holding the taps of Frames loaded from json, without
+        creating ScreenTaps.
+
+        Parameters
+        ----------
+        data : list of dicts
+            json of a list of Frames
+
+        Returns
+        -------
+        table : DetectionTable
+            taps of the frames
+        """
+        rows = np.array([(frame["screenId"], tap["x"], tap["y"],
+                          tap["confidence"], tap["confidenceOpacity"], -1)
+                         for frame in data for tap in frame["screenTap"]],
+                        dtype=DETECTION_DTYPE)
+        return DetectionTable(rows)
+
+    @staticmethod
+    def load(file_path, mmap=True):
+        """
+        Returns the table saved in a .npy file.
+
+        Parameters
+        ----------
+        file_path : string
+            path to file to read from
+        mmap : bool, optional
+            whether to map the file read-only instead of reading it whole
+
+        Returns
+        -------
+        table : DetectionTable
+            saved taps
+        """
+        return DetectionTable(np.load(file_path, mmap_mode="r" if mmap else None))
+
+    def save(self, file_path):
+        """
+        Saves the table to a .npy file.
+
+        Parameters
+        ----------
+        file_path : string
+            path to file to output to
+        """
+        np.save(file_path, self.rows)
+
+    def get_frame_range(self, first_frame, last_frame):
+        """
+        Returns a table of the taps of the frames with ids from first_frame to
+        last_frame included. Frames must be in increasing order, as detected;
+        only the rows found are read from a mapped file.
+
+        Parameters
+        ----------
+        first_frame : int
+            id of the first frame of the range
+        last_frame : int
+            id of the last frame of the range
+
+        Returns
+        -------
+        table : DetectionTable
+            taps of the range, a view of this table's rows
+        """
+        frame_ids = self.rows["frame_id"]
+        start = np.searchsorted(frame_ids, first_frame, side="left")
+        stop = np.searchsorted(frame_ids, last_frame, side="right")
+        return DetectionTable(self.rows[start:stop])
+
+    def select(self, mask):
+        """
+        Returns a table of the taps selected by a mask, in the same order.
+
+        Parameters
+        ----------
+        mask : np array of bools
+            whether to keep each tap
+
+        Returns
+        -------
+        table : DetectionTable
+            selected taps
+        """
+        return DetectionTable(self.rows[mask])
+
+    def get_frame_ids(self):
+        """
+        Returns the id of each frame, in order.
+
+        Returns
+        -------
+        frame_ids : np array
+            frame ids
+        """
+        return self.rows["frame_id"][self.__get_frame_starts()]
+
+    def get_frames(self):
+        """
+        Returns a FrameView of each frame, in order.
+
+        Returns
+        -------
+        frames : list of FrameViews
+            frames holding taps
+        """
+        starts = self.__get_frame_starts()
+        stops = np.append(starts[1:], len(self.rows))
+        return [FrameView(self, start, stop) for start, stop in
+                zip(starts.tolist(), stops.tolist())]
+
+    def get_tap(self, index):
+        """
+        Returns a TapView of a row.
+
+        Parameters
+        ----------
+        index : int
+            row of the tap
+
+        Returns
+        -------
+        tap : TapView
+            view of the tap
+        """
+        return TapView(self, index)
+
+    def get_column(self, name):
+        """
+        Returns a column of the table, as a view.
+
+        Parameters
+        ----------
+        name : string
+            field of DETECTION_DTYPE
+
+        Returns
+        -------
+        column : np array
+            value of the field for each tap
+        """
+        return self.rows[name]
+
+    def to_frames(self):
+        """
+        Returns the taps as a list of Frames.
+
+        Returns
+        -------
+        frames : list of Frames
+            frames holding ScreenTaps
+        """
+        frames = []
+        for frame_view in self.get_frames():
+            frame = Frame(frame_view.get_id())
+            frame.set_screen_taps([ScreenTap(tap.get_x(), tap.get_y(),
+                                             tap.get_touch_confidence(),
+                                             tap.get_opacity_confidence(),
+                                             tap.get_frame())
+                                   for tap in frame_view.get_screen_taps()])
+            frames.append(frame)
+        return frames
+
+    def __get_frame_starts(self):
+        """
+        Returns the first row of each frame.
+
+        Returns
+        -------
+        starts : np array
+            row indices where a frame starts
+        """
+        frame_ids = self.rows["frame_id"]
+        if len(frame_ids) == 0:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(([0], np.flatnonzero(frame_ids[1:] != frame_ids[:-1]) + 1))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def asJson(self):
+        """
+        Defines how to output DetectionTable to JSON file, as the list of
+        Frames it holds.
+        """
+        return self.get_frames()
+
+class TapView():
+    """
+    View of one tap of a DetectionTable, with the methods of ScreenTap.
+    Changes made through it are written to the table.
+
+    Attributes
+    ----------
+    table : DetectionTable
+        table holding the tap
+    index : int
+        row of the tap
+
+    Methods
+    -------
+    get_index()
+        Returns row of the tap in the table.
+    get_x()
+        Returns x-coordinate of tap.
+    get_y()
+        Returns y-coordinate of tap.
+    get_frame()
+        Returns frame id of tap.
+    get_touch_confidence()
+        Returns touch_confidence of tap.
+    get_opacity_confidence()
+        Returns opacity_confidence of tap.
+    set_opacity_confidence(confidence)
+        Changes opacity_confidence of tap to specified value.
+    get_group()
+        Returns the group of the tap.
+    set_group(group)
+        Changes group of the tap to specified value.
+    is_visited()
+        Returns value of visited.
+    set_visited(val)
+        Changes value of visited to specified value.
+    asJson()
+        Defines how to output TapView to JSON file.
+    """
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        """
+        Parameters
+        ----------
+        table : DetectionTable
+            table holding the tap
+        index : int
+            row of the tap
+        """
+        self.table = table
+        self.index = index
+
+    def get_index(self):
+        """
+        Returns row of the tap in the table.
+
+        Returns
+        -------
+        index : int
+            row of the tap
+        """
+        return self.index
+
+    def get_x(self):
+        """
+        Returns x-coordinate of tap.
+
+        Returns
+        -------
+        x : float
+            x-coordinate of tap
+        """
+        return float(self.table.rows["x"][self.index])
+
+    def get_y(self):
+        """
+        Returns y-coordinate of tap.
+
+        Returns
+        -------
+        y : float
+            y-coordinate of tap
+        """
+        return float(self.table.rows["y"][self.index])
+
+    def get_frame(self):
+        """
+        Returns frame id of tap.
+
+        Returns
+        -------
+        frame : int
+            frame id
+        """
+        return int(self.table.rows["frame_id"][self.index])
+
+    def get_touch_confidence(self):
+        """
+        Returns touch_confidence of tap.
+
+        Returns
+        -------
+        touch_confidence : float
+            confidence this is a true tap; None if missing
+        """
+        return self.__get_confidence("touch_conf")
+
+    def get_opacity_confidence(self):
+        """
+        Returns opacity_confidence of tap.
+
+        Returns
+        -------
+        opacity_confidence : float
+            confidence that this is not a fading tap; None if missing
+        """
+        return self.__get_confidence("opacity_conf")
+
+    def set_opacity_confidence(self, confidence):
+        """
+        Changes opacity confidence to specified value.
+
+        Parameters
+        ----------
+        confidence : float
+            new opacity confidence
+        """
+        self.table.rows["opacity_conf"][self.index] = confidence
+
+    def get_group(self):
+        """
+        Returns the group of the tap.
+
+        Returns
+        -------
+        group : int
+            index of the tap's group; -1 if not grouped
+        """
+        return int(self.table.rows["group_id"][self.index])
+
+    def set_group(self, group):
+        """
+        Changes group of the tap to specified value.
+
+        Parameters
+        ----------
+        group : int
+            index of the new group
+        """
+        self.table.rows["group_id"][self.index] = group
+
+    def is_visited(self):
+        """
+        Returns value of visited.
+
+        Returns
+        -------
+        visited : bool
+            depiction of visited status for grouping algorithm
+        """
+        return bool(self.table.visited[self.index])
+
+    def set_visited(self, val):
+        """
+        Changes visited to specified value.
+
+        Parameters
+        ----------
+        val : bool
+            new visited status
+        """
+        self.table.visited[self.index] = val
+
+    def __get_confidence(self, name):
+        """
+        Returns a confidence of the tap, None if missing.
+        """
+        confidence = float(self.table.rows[name][self.index])
+        return None if np.isnan(confidence) else confidence
+
+    def __str__(self):
+        return "tap{" + "x=" + str(self.get_x()) + ", y=" + str(self.get_y()) + "}"
+
+    def __eq__(self, other):
+        """
+        Two screen taps are considered equal if they have the same x and y
+        coordinates.
+        """
+        if self is other:
+            return True
+        if other is None or type(self) != type(other):
+            return False
+        return other.get_x() == self.get_x() and other.get_y() == self.get_y()
+
+    def __hash__(self):
+        return hash((self.get_x(), self.get_y()))
+
+    def asJson(self):
+        """
+        Defines how to output tap information to JSON file, as a ScreenTap.
+        """
+        return dict(x=self.get_x(), y=self.get_y(), confidence=self.get_touch_confidence(),
+                    confidenceOpacity=self.get_opacity_confidence(), frame=self.get_frame())
+
+class FrameView():
+    """
+    View of the taps of one frame of a DetectionTable, with the methods of
+    Frame.
+
+    Attributes
+    ----------
+    table : DetectionTable
+        table holding the frame
+    start : int
+        first row of the frame
+    stop : int
+        row after the last one of the frame
+
+    Methods
+    -------
+    get_id()
+        Returns the id of the frame.
+    get_screen_taps()
+        Returns list of TapViews.
+    asJson()
+        Defines how to output FrameView to JSON file.
+    """
+    __slots__ = ("table", "start", "stop")
+
+    def __init__(self, table, start, stop):
+        """
+        Parameters
+        ----------
+        table : DetectionTable
+            table holding the frame
+        start : int
+            first row of the frame
+        stop : int
+            row after the last one of the frame
+        """
+        self.table = table
+        self.start = start
+        self.stop = stop
+
+    def get_id(self):
+        """
+        Returns the id of the frame.
+
+        Returns
+        -------
+        id : int
+            frame id
+        """
+        return int(self.table.rows["frame_id"][self.start])
+
+    def get_screen_taps(self):
+        """
+        Returns list of TapViews.
+
+        Returns
+        -------
+        screen_taps : list of TapViews
+            taps detected in the frame
+        """
+        return [TapView(self.table, index) for index in range(self.start, self.stop)]
+
+    def asJson(self):
+        """
+        Defines how to output Frame information to JSON file.
+        """
+        return dict(screenId=self.get_id(), screenTap=self.get_screen_taps())
+
+class ActionTable():
+    """
+    GUIActions stored as columns, one row per tap of each action in order,
+    with the index of its action as group and the ActionType value of its
+    action. Saved as .npy files, which load memory-mapped like
+    DetectionTables.
+
+    Attributes
+    ----------
+    rows : np structured array
+        taps of the actions, with dtype ACTION_DTYPE
+
+    Methods
+    -------
+    from_actions(actions)
+        Returns a table holding a list of GUIActions.
+    load(file_path, mmap)
+        Returns the table saved in a .npy file.
+    save(file_path)
+        Saves the table to a .npy file.
+    get_frame_range(first_frame, last_frame)
+        Returns a table of the actions with taps in a range of frames.
+    to_actions()
+        Returns the GUIActions of the table.
+    """
+
+    def __init__(self, rows=None):
+        """
+        Parameters
+        ----------
+        rows : np structured array, optional
+            taps of the actions, with dtype ACTION_DTYPE; empty if None
+        """
+        if rows is None:
+            rows = np.empty(0, dtype=ACTION_DTYPE)
+        self.rows = rows
+
+    @staticmethod
+    def from_actions(actions):
+        """
+        Returns a table holding a list of GUIActions.
+
+        Parameters
+        ----------
+        actions : list of GUIActions
+            classified actions
+
+        Returns
+        -------
+        table : ActionTable
+            actions as columns
+        """
+        rows = np.array([(tap.get_frame(), tap.get_x(), tap.get_y(),
+                          tap.get_touch_confidence(), tap.get_opacity_confidence(),
+                          group, action.get_type().value)
+                         for group, action in enumerate(actions) for tap in action.get_taps()],
+                        dtype=ACTION_DTYPE)
+        return ActionTable(rows)
+
+    @staticmethod
+    def load(file_path, mmap=True):
+        """
+        Returns the table saved in a .npy file.
+
+        Parameters
+        ----------
+        file_path : string
+            path to file to read from
+        mmap : bool, optional
+            whether to map the file read-only instead of reading it whole
+
+        Returns
+        -------
+        table : ActionTable
+            saved actions
+        """
+        return ActionTable(np.load(file_path, mmap_mode="r" if mmap else None))
+
+    def save(self, file_path):
+        """
+        Saves the table to a .npy file.
+
+        Parameters
+        ----------
+        file_path : string
+            path to file to output to
+        """
+        np.save(file_path, self.rows)
+
+    def get_frame_range(self, first_frame, last_frame):
+        """
+        Returns a table of the actions with a tap on the frames with ids from
+        first_frame to last_frame included, with all their taps. Actions may
+        overlap, so only the frame and group columns are read whole.
+
+        Parameters
+        ----------
+        first_frame : int
+            id of the first frame of the range
+        last_frame : int
+            id of the last frame of the range
+
+        Returns
+        -------
+        table : ActionTable
+            actions of the range
+        """
+        frame_ids = self.rows["frame_id"]
+        groups = self.rows["group_id"]
+        in_range = (frame_ids >= first_frame) & (frame_ids <= last_frame)
+        return ActionTable(self.rows[np.isin(groups, np.unique(groups[in_range]))])
+
+    def to_actions(self):
+        """
+        Returns the GUIActions of the table, with TapViews of its taps.
+
+        Returns
+        -------
+        actions : list of GUIActions
+            saved actions
+        """
+        taps = DetectionTable(self.rows[list(DETECTION_DTYPE.names)])
+        frame_ids = self.rows["frame_id"]
+        # taps of each action are contiguous
+        starts = np.flatnonzero(np.diff(self.rows["group_id"], prepend=-1) != 0)
+        stops = np.append(starts[1:], len(self.rows))
+        act_types = self.rows["act_type"][starts]
+        return [GUIAction([taps.get_tap(row) for row in range(start, stop)],
+                          frame_ids[start:stop].tolist(), ActionType(act_type))
+                for act_type, start, stop in
+                zip(act_types.tolist(), starts.tolist(), stops.tolist())]
@@ -0,0 +1,167 @@
+# detection_table_test.py
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from v2s.util.detection_table import ActionTable, DetectionTable
+from v2s.util.event import ActionType, GUIAction
+from v2s.util.general import JSONFileUtils
+from v2s.util.screen import Frame, ScreenTap
+
+
+def make_frames():
+    """
+    Returns frames 1 to 9, with two taps on even frames, one on odd frames
+    and none on frame 5; opacity is missing on frame 9.
+    """
+    frames = []
+    for frame_id in range(1, 10):
+        frame = Frame(frame_id)
+        if frame_id != 5:
+            opacity = None if frame_id == 9 else frame_id / 10
+            frame.add_tap(ScreenTap(10.0 * frame_id, 20.5, 0.9, opacity, frame_id))
+            if frame_id % 2 == 0:
+                frame.add_tap(ScreenTap(300.25, 5.0 * frame_id, 0.4, 0.5, frame_id))
+        frames.append(frame)
+    return frames
+
+
+class DetectionTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = make_frames()
+        self.table = DetectionTable.from_frames(self.frames)
+
+    def test_from_frames(self):
+        self.assertEqual(len(self.table), 12)
+        self.assertEqual(self.table.get_frame_ids().tolist(), [1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual(self.table.get_column("group_id").tolist(), [-1] * 12)
+        # frames without taps are left out
+        self.assertEqual(JSONFileUtils.to_json_data(self.table),
+                         [frame for frame in JSONFileUtils.to_json_data(self.frames)
+                          if len(frame["screenTap"]) != 0])
+
+    def test_from_json(self):
+        table = DetectionTable.from_json(JSONFileUtils.to_json_data(self.frames))
+        self.assertEqual(table.rows.tobytes(), self.table.rows.tobytes())
+
+    def test_to_frames(self):
+        frames = self.table.to_frames()
+        self.assertTrue(all(isinstance(frame, Frame) for frame in frames))
+        self.assertEqual(JSONFileUtils.to_json_data(frames),
+                         JSONFileUtils.to_json_data(self.table))
+
+    def test_empty(self):
+        table = DetectionTable.from_frames([Frame(1), Frame(2)])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.get_frame_ids().tolist(), [])
+        self.assertEqual(table.get_frames(), [])
+        self.assertEqual(DetectionTable.from_json([]).rows.dtype, table.rows.dtype)
+
+    def test_get_frames(self):
+        frames = self.table.get_frames()
+        self.assertEqual([frame.get_id() for frame in frames], [1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual([len(frame.get_screen_taps()) for frame in frames],
+                         [1, 2, 1, 2, 2, 1, 2, 1])
+        tap = frames[1].get_screen_taps()[1]
+        self.assertEqual((tap.get_x(), tap.get_y(), tap.get_frame()), (300.25, 10.0, 2))
+        self.assertEqual((tap.get_touch_confidence(), tap.get_opacity_confidence()), (0.4, 0.5))
+        # a missing confidence stays missing
+        self.assertIsNone(frames[-1].get_screen_taps()[0].get_opacity_confidence())
+
+    def test_select(self):
+        selected = self.table.select(self.table.get_column("touch_conf") > 0.5)
+        self.assertEqual(len(selected), 8)
+        self.assertEqual(selected.get_frame_ids().tolist(), [1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertTrue(all(len(frame.get_screen_taps()) == 1
+                            for frame in selected.get_frames()))
+
+    def test_tap_changes_write_to_table(self):
+        tap = self.table.get_tap(3)
+        tap.set_group(2)
+        tap.set_visited(True)
+        tap.set_opacity_confidence(0.25)
+        self.assertEqual(self.table.get_column("group_id")[3], 2)
+        self.assertTrue(self.table.visited[3])
+        self.assertEqual(self.table.get_tap(3).get_opacity_confidence(), 0.25)
+        self.assertEqual(self.table.get_tap(3), tap)
+        self.assertFalse(self.table.get_tap(2).is_visited())
+
+
+class DetectionTableFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "detection_full.npy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load_round_trip(self):
+        frames = make_frames()
+        DetectionTable.from_frames(frames).save(self.path)
+        table = DetectionTable.load(self.path)
+        self.assertIsInstance(table.rows, np.memmap)
+        self.assertEqual(JSONFileUtils.to_json_data(table),
+                         [frame for frame in JSONFileUtils.to_json_data(frames)
+                          if len(frame["screenTap"]) != 0])
+
+    def test_get_frame_range(self):
+        DetectionTable.from_frames(make_frames()).save(self.path)
+        table = DetectionTable.load(self.path)
+        self.assertEqual(table.get_frame_range(4, 7).get_frame_ids().tolist(), [4, 6, 7])
+        self.assertEqual(len(table.get_frame_range(4, 7)), 5)
+        self.assertEqual(table.get_frame_range(5, 5).get_frame_ids().tolist(), [])
+        self.assertEqual(table.get_frame_range(0, 100).get_frame_ids().tolist(),
+                         [1, 2, 3, 4, 6, 7, 8, 9])
+
+
+class ActionTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "detected_actions.npy")
+        table = DetectionTable.from_frames(make_frames())
+        frames = table.get_frames()
+        # a click, a swipe overlapping it and a long click
+        self.actions = [
+            GUIAction([frame.get_screen_taps()[0] for frame in frames[0:3]],
+                      [1, 2, 3], ActionType.CLICK),
+            GUIAction([frames[1].get_screen_taps()[1], frames[3].get_screen_taps()[1]],
+                      [2, 4], ActionType.SWIPE),
+            GUIAction([frame.get_screen_taps()[0] for frame in frames[4:8]],
+                      [6, 7, 8, 9], ActionType.LONG_CLICK)]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_save_load_round_trip(self):
+        ActionTable.from_actions(self.actions).save(self.path)
+        table = ActionTable.load(self.path)
+        self.assertIsInstance(table.rows, np.memmap)
+        self.assertEqual(JSONFileUtils.to_json_data(table.to_actions()),
+                         JSONFileUtils.to_json_data(self.actions))
+
+    def test_empty(self):
+        ActionTable.from_actions([]).save(self.path)
+        self.assertEqual(ActionTable.load(self.path).to_actions(), [])
+
+    def test_get_frame_range(self):
+        ActionTable.from_actions(self.actions).save(self.path)
+        table = ActionTable.load(self.path)
+        # the click and the swipe both have taps on frame 2, whole actions
+        # are returned
+        actions = table.get_frame_range(2, 2).to_actions()
+        self.assertEqual(JSONFileUtils.to_json_data(actions),
+                         JSONFileUtils.to_json_data(self.actions[:2]))
+        actions = table.get_frame_range(5, 6).to_actions()
+        self.assertEqual(JSONFileUtils.to_json_data(actions),
+                         JSONFileUtils.to_json_data(self.actions[2:]))
+        self.assertEqual(table.get_frame_range(10, 20).to_actions(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,12 +23,16 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 ################################################################################
 
+import hashlib
 import json
 import math
 import os
+import queue
 import subprocess as sp
 import sys
-from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Event, Lock, Thread
 
 import numpy as np
 import tensorflow as tf
@@ -64,7 +68,8 @@ class ProgressBar():
         count = len(data)
 
         def show(curr_prog):
-            x = int(size * curr_prog / count)
+            # nothing to process counts as done
+            x = int(size * curr_prog / count) if count > 0 else size
             file.write("%s[%s%s] %i/%i\r" % (prefix, "#" * x, "." * (size - x), curr_prog, count))
             file.flush()
 
@@ -85,6 +90,11 @@ class ImageUtils():
         Loads image data into a numpy array.
     save_image_array_as_jpg(image, output_path)
         Saves an image (represented as a numpy array) to JPEG.
+    to_gray(image, step)
+        Returns a float grayscale copy of an image, keeping every step-th pixel.
+    match_template(image, template)
+        Returns the normalized cross-correlation of a template at every
+        position of an image.
     """
 
     @staticmethod
@@ -123,6 +133,58 @@ class ImageUtils():
             image_pil.save(fid, 'JPEG', quality=80, optimize=True, 
                            progressive=True)
 
+    @staticmethod
+    def to_gray(image, step=1):
+        """
+        Returns a float grayscale copy of an image, keeping every step-th
+        pixel.
+
+        Parameters
+        ----------
+        image : np array
+            image with shape [height, width, 3]
+        step : int, optional
+            distance between kept pixels
+
+        Returns
+        -------
+        gray : np array
+            float32 image with shape [height / step, width / step]
+        """
+        return image[::step, ::step].mean(axis=2, dtype=np.float32)
+
+    @staticmethod
+    def match_template(image, template):
+        """
+        Returns the normalized cross-correlation of a template at every
+        position of an image. Scores range from -1 to 1, where 1 is a perfect
+        match up to brightness and contrast.
+
+        Parameters
+        ----------
+        image : np array
+            float grayscale image, at least as large as the template
+        template : np array
+            float grayscale template
+
+        Returns
+        -------
+        scores : np array
+            score of the template's top-left corner at each position, with
+            shape [height - template height + 1, width - template width + 1]
+        """
+        template = template - template.mean()
+        template_norm = np.sqrt((template ** 2).sum())
+        windows = np.lib.stride_tricks.sliding_window_view(image, template.shape)
+        # the template has zero mean, so window means cancel out here
+        products = np.einsum('ijkl,kl->ij', windows, template)
+        sums = windows.sum(axis=(2, 3))
+        squares = (windows ** 2).sum(axis=(2, 3))
+        variances = np.maximum(squares - sums ** 2 / template.size, 0)
+        norms = np.sqrt(variances) * template_norm
+        # flat windows or templates cannot match anything
+        return np.where(norms > 1e-6, products / np.maximum(norms, 1e-6), 0)
+
 
 class GeneralUtils():
     """
@@ -139,6 +201,8 @@ class GeneralUtils():
     close_complex_actions(action1, action2, distance)
         Returns whether two actions are close in distance. May signify that 
         two actions can be merged.
+    get_file_hash(path)
+        Returns the sha1 hash of a file's content.
     """
 
     @staticmethod
@@ -157,6 +221,27 @@ class GeneralUtils():
         y2 = (tap2.get_y() - tap1.get_y()) ** 2
         return math.sqrt(x2 + y2)
     
+    @staticmethod
+    def get_file_hash(path):
+        """
+        Returns the sha1 hash of a file's content.
+
+        Parameters
+        ----------
+        path : string
+            path to file to hash
+
+        Returns
+        -------
+        hash : string
+            hex digest of the file's content
+        """
+        digest = hashlib.sha1()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
     @staticmethod
     def are_consecutive_frames(action1, action2):
         """
@@ -259,6 +344,185 @@ class RecordThread(Thread):
         """
         return self.replay_path
 
+class ThreadUtils():
+    """
+    Static methods to overlap the stages of a processing pipeline.
+
+    Methods
+    -------
+    map_ordered(func, data, workers, size)
+        Applies func to data on a pool of threads and yields results in order.
+    prefetch(data, size)
+        Iterates over data in a background thread.
+    """
+
+    @staticmethod
+    def map_ordered(func, data, workers, size):
+        """
+        Applies func to each item of data on a pool of threads and yields the
+        results in the order of data. At most size results are pending at
+        once, so memory stays flat however long data is.
+
+        Parameters
+        ----------
+        func : callable
+            function applied to each item
+        data : iterable
+            items to process
+        workers : int
+            number of threads
+        size : int
+            maximum number of pending results
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for item in data:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= size:
+                    yield pending.popleft().result()
+            # take care of remaining results
+            while len(pending) != 0:
+                yield pending.popleft().result()
+
+    @staticmethod
+    def prefetch(data, size):
+        """
+        Iterates over data in a background thread that keeps up to size items
+        ready in a bounded queue. Exceptions raised by data are re-raised by
+        the consumer.
+
+        Parameters
+        ----------
+        data : iterable
+            items to prefetch
+        size : int
+            maximum number of items waiting in the queue
+        """
+        buffer = queue.Queue(maxsize=size)
+        stop = Event()
+        # marks the end of data
+        end = object()
+
+        def put(entry):
+            # give up if the consumer stops iterating
+            while not stop.is_set():
+                try:
+                    buffer.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            iterator = iter(data)
+            try:
+                for item in iterator:
+                    if not put((item, None)):
+                        return
+                put((end, None))
+            except Exception as e:
+                put((end, e))
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+
+        producer = Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item, error = buffer.get()
+                if error is not None:
+                    raise error
+                if item is end:
+                    break
+                yield item
+        finally:
+            stop.set()
+
+class BoundedThreadPool():
+    """
+    Pool of threads executing tasks in the background. Submitting blocks once
+    size tasks are pending, so a fast producer cannot queue unbounded work.
+
+    Attributes
+    ----------
+    executor : ThreadPoolExecutor
+        threads running the tasks
+    slots : BoundedSemaphore
+        free places for pending tasks
+    errors : list of Exceptions
+        exceptions raised by tasks
+
+    Methods
+    -------
+    submit(func, *args)
+        Schedules func(*args) to be executed.
+    shutdown()
+        Waits for pending tasks and raises the first error of a task, if any.
+    """
+
+    def __init__(self, workers, size):
+        """
+        Parameters
+        ----------
+        workers : int
+            number of threads
+        size : int
+            maximum number of pending tasks
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = BoundedSemaphore(size)
+        self.errors = []
+        self.lock = Lock()
+
+    def submit(self, func, *args):
+        """
+        Schedules func(*args) to be executed, waiting for a free place if too
+        many tasks are pending.
+
+        Parameters
+        ----------
+        func : callable
+            task to execute
+        args :
+            arguments of func
+        """
+        self.slots.acquire()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self.__task_done)
+
+    def __task_done(self, future):
+        """
+        Frees the place of a finished task and records its error, if any.
+
+        Parameters
+        ----------
+        future : Future
+            finished task
+        """
+        self.slots.release()
+        if future.exception() is not None:
+            with self.lock:
+                self.errors.append(future.exception())
+
+    def shutdown(self):
+        """
+        Waits for pending tasks and raises the first error of a task, if any.
+        """
+        self.executor.shutdown(wait=True)
+        if len(self.errors) != 0:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # do not hide the original error with one from a task
+        if exc_type is not None:
+            self.executor.shutdown(wait=True)
+        else:
+            self.shutdown()
+
 class ComplexEncoder(json.JSONEncoder):
     def default(self, obj):
         if hasattr(obj, 'asJson'):
@@ -277,7 +541,16 @@ class JSONFileUtils():
         Reads data from json file.
     output_data_to_json(data, file_path)
         Outputs data to json file using ComplexEncoder.
+    output_data_to_json_async(data, file_path)
+        Outputs data to json file in the background.
+    wait_for_writes()
+        Waits until every background output is written.
+    to_json_data(data)
+        Returns a plain copy of data, as json would load it.
     """
+    # single thread writing json files in the background, in order
+    writer = None
+    pending_writes = []
     @staticmethod
     def read_data_from_json(file_path):
         """
@@ -316,6 +589,61 @@ class JSONFileUtils():
         file.write(json_data)
         file.close()
 
+    @staticmethod
+    def output_data_to_json_async(data, file_path):
+        """
+        Outputs data to json file in the background, so the caller does not
+        wait for the encoding and the disk. Data is copied first, so it may
+        change once this returns.
+
+        Parameters
+        ----------
+        data : 
+            data to output to json
+        file_path : string
+            path to file to output to
+        """
+        if JSONFileUtils.writer is None:
+            JSONFileUtils.writer = ThreadPoolExecutor(max_workers=1)
+        snapshot = JSONFileUtils.to_json_data(data)
+        JSONFileUtils.pending_writes.append(JSONFileUtils.writer.submit(
+            JSONFileUtils.output_data_to_json, snapshot, file_path))
+
+    @staticmethod
+    def wait_for_writes():
+        """
+        Waits until every background output is written, raising the error
+        of any that failed.
+        """
+        pending_writes = JSONFileUtils.pending_writes
+        JSONFileUtils.pending_writes = []
+        for write in pending_writes:
+            write.result()
+
+    @staticmethod
+    def to_json_data(data):
+        """
+        Returns a plain copy of data, as json would load it: objects are
+        replaced by their asJson output, recursively.
+
+        Parameters
+        ----------
+        data : 
+            data to copy
+
+        Returns
+        -------
+        json_data : 
+            dicts, lists and values only
+        """
+        if hasattr(data, 'asJson'):
+            data = data.asJson()
+        if isinstance(data, dict):
+            return {key: JSONFileUtils.to_json_data(value) for key, value in data.items()}
+        if isinstance(data, (list, tuple)):
+            return [JSONFileUtils.to_json_data(value) for value in data]
+        return data
+
 class Translator():
     """
     Provides methods to perform translation between sendevent commands output